@@ -1,10 +1,57 @@
 import streamlit as st
 import streamlit.components.v1 as components  # IMPORT CORRETO PARA HTML
-import psycopg2
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import json
+import hashlib
+import logging
 from datetime import datetime, date, timedelta
+import numpy as np
 import pandas as pd
 import plotly.express as px
+from psycopg2.extras import Json, execute_values
+
+from calendario import (
+    DIAS_SEMANA,
+    SEMANA_PADRAO,
+    calendario_de_config,
+    calendarios_de_recursos,
+    datas_atividades,
+)
+from eap import ArvoreEAP
+from cronograma import CacheCronogramas, CronogramaIncremental, chave_cronograma, curva_s_trabalho
+from nivelamento import histograma_recursos, nivelar_recursos
+from simulacao import simular_cronograma
+from banco import (
+    EXPR_BUSCA_PROJETOS,
+    CacheDocumentos,
+    ConflitoEdicao,
+    FilaGravacao,
+    TABELAS_SECOES,
+    PoolConexoes,
+    ajustar_modo_armazenamento,
+    ajustar_modo_projetos,
+    aplicar_migracoes,
+    arquivar_projetos,
+    desarquivar_projeto,
+    documento_completo,
+    garantir_snapshot_base,
+    gerar_patch,
+    gravar_listas_comprimidas,
+    gravar_resumo,
+    gravar_snapshot,
+    ler_listas_comprimidas,
+    listar_eventos,
+    projetos_com_resumo_defasado,
+    reconstruir_estado,
+    registrar_evento,
+    resumir_patch,
+    secoes_do_patch,
+    sql_atividades_atrasadas,
+    versao_a_desfazer,
+    versao_schema,
+)
+
+logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------
 # CONFIGURAÇÃO BÁSICA / CSS
@@ -221,123 +268,890 @@ def default_state():
 # BANCO DE DADOS - NEON POSTGRESQL
 # --------------------------------------------------------
 
+@st.cache_resource(show_spinner=False)
+def get_pool():
+    """
+    Pool de conexões único por processo, compartilhado por todas as sessões.
+    Tamanho e validação configuráveis na seção [general] do secrets.toml:
+    pool_min, pool_max, pool_timeout (s) e pool_max_ocioso (s).
+    """
+    cfg = st.secrets["general"]
+    return PoolConexoes(
+        cfg["database_url"],
+        minconn=int(cfg.get("pool_min", 1)),
+        maxconn=int(cfg.get("pool_max", 10)),
+        timeout_espera=float(cfg.get("pool_timeout", 30)),
+        max_ocioso=float(cfg.get("pool_max_ocioso", 300)),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_cache_documentos():
+    """
+    Cache LRU de documentos de projeto, único por processo e compartilhado
+    pelas sessões. Limite em MB no secrets.toml: [general] cache_documentos_mb.
+    """
+    mb = float(st.secrets["general"].get("cache_documentos_mb", 64))
+    return CacheDocumentos(max_bytes=int(mb * 1024 * 1024))
+
+@st.cache_resource(show_spinner=False)
+def get_cache_cronogramas():
+    """
+    Cache LRU de cronogramas (CPM) calculados, único por processo e
+    compartilhado pelas sessões. Limite de entradas no secrets.toml:
+    [general] cache_cronogramas_itens.
+    """
+    return CacheCronogramas(max_itens=int(st.secrets["general"].get("cache_cronogramas_itens", 64)))
+
 def get_conn():
     """
-    Abre conexão com o banco Neon usando a URL do secrets.toml.
+    Empresta uma conexão do pool. Uso: `with get_conn() as conn: ...`
+    A conexão volta ao pool ao final do bloco.
     """
-    db_url = st.secrets["general"]["database_url"]
-    conn = psycopg2.connect(db_url)
-    return conn
+    return get_pool().conexao()
+
+# Modo de armazenamento ([general] storage_mode no secrets.toml):
+# - "documento": o estado inteiro do projeto fica no JSON de projects.data;
+# - "normalizado": tap/close ficam em projects.data e cada seção em lista
+#   (EAP, finanças, KPIs, riscos, lições, plano de ação) vira uma tabela
+#   filha, gravada item a item;
+# - "comprimido": tap/close ficam em projects.data e cada seção em lista vai,
+#   em formato colunar comprimido (compactacao.py), para o seu bloco bytea
+#   em project_lists. O algoritmo ([general] compressao) é "zlib" (padrão)
+#   ou "lzma".
+# As consultas JSONB entre projetos sobre as listas só valem no modo documento.
+MODO_ARMAZENAMENTO = st.secrets["general"].get("storage_mode", "documento")
+MODO_NORMALIZADO = MODO_ARMAZENAMENTO == "normalizado"
+MODO_COMPRIMIDO = MODO_ARMAZENAMENTO == "comprimido"
+ALGORITMO_COMPRESSAO = st.secrets["general"].get("compressao", "zlib")
+
+# Arquivo de projetos encerrados ([general] arquivo_retencao_dias): projetos
+# encerrados e sem uso há mais dias que isso vão, comprimidos com lzma, para
+# projects_archive na inicialização do processo (0 = não arquivar).
+ARQUIVO_RETENCAO_DIAS = int(st.secrets["general"].get("arquivo_retencao_dias", 180))
+ALGORITMO_ARQUIVO = "lzma"
+
+def secao_no_documento(secao: str) -> bool:
+    """
+    Indica se a seção fica no JSON de projects.data no modo configurado.
+    """
+    return MODO_ARMAZENAMENTO == "documento" or secao not in TABELAS_SECOES
 
+@st.cache_resource(show_spinner=False)
 def init_db():
     """
-    Cria a tabela de projetos no PostgreSQL, caso ainda não exista.
+    Aplica as migrações pendentes do schema, converte os projetos para o
+    modo de armazenamento configurado, recalcula os resumos de portfólio
+    defasados e arquiva os projetos encerrados além da retenção, uma única
+    vez por processo.
+    Nos reruns seguintes o resultado vem do cache e nenhum DDL é enviado.
     """
-    conn = get_conn()
-    cur = conn.cursor()
+    with get_conn() as conn:
+        novas = aplicar_migracoes(conn)
+        ajustar_modo_armazenamento(conn, MODO_ARMAZENAMENTO, ALGORITMO_COMPRESSAO)
+        atualizar_resumos_defasados(conn)
+        if ARQUIVO_RETENCAO_DIAS > 0:
+            arquivar_projetos(conn, ARQUIVO_RETENCAO_DIAS, ALGORITMO_ARQUIVO)
+        return novas
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS projects (
-            id SERIAL PRIMARY KEY,
-            data TEXT,
-            nome TEXT,
-            status TEXT,
-            dataInicio TEXT,
-            gerente TEXT,
-            patrocinador TEXT,
-            encerrado BOOLEAN DEFAULT FALSE
-        );
-        """
+COLUNAS_LISTA_PROJETOS = "id, nome, status, dataInicio, gerente, patrocinador, encerrado, arquivado"
+
+# Quantidade de projetos por página no seletor da barra lateral
+# ([general] tamanho_pagina no secrets.toml).
+TAMANHO_PAGINA = int(st.secrets["general"].get("tamanho_pagina", 50))
+
+def _projeto_da_linha(r):
+    return {
+        "id": r[0],
+        "nome": r[1] or "",
+        "status": r[2] or "",
+        "dataInicio": r[3] or "",
+        "gerente": r[4] or "",
+        "patrocinador": r[5] or "",
+        "encerrado": bool(r[6]),
+        "arquivado": bool(r[7]),
+    }
+
+@st.cache_data(show_spinner=False)
+def buscar_projetos(
+    termo: str = "",
+    status=None,
+    encerrado=None,
+    arquivado=False,
+    apos_id=None,
+    limite: int = TAMANHO_PAGINA,
+):
+    """
+    Busca paginada de projetos, do mais novo para o mais antigo.
+    - termo: trecho procurado em nome, gerente ou patrocinador;
+    - status: status do TAP (None = todos);
+    - encerrado: True/False filtra pela situação (None = todos);
+    - arquivado: False (padrão) só projetos da tabela quente, True só os
+      arquivados, None todos;
+    - apos_id: cursor da página (paginação por chave: id < apos_id).
+    Retorna (projetos da página, cursor da próxima página ou None).
+    O resultado fica em cache no processo, compartilhado entre as sessões,
+    e só é refeito depois de invalidar_lista_projetos() (criação, exclusão,
+    encerramento, reabertura e mudança dos campos do TAP exibidos na lista).
+    """
+    filtros = []
+    params = []
+    termo = (termo or "").strip().lower()
+    if termo:
+        escapado = termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filtros.append(f"{EXPR_BUSCA_PROJETOS} LIKE %s")
+        params.append(f"%{escapado}%")
+    if status:
+        filtros.append("status = %s")
+        params.append(status)
+    if encerrado is True:
+        filtros.append("encerrado")
+    elif encerrado is False:
+        filtros.append("encerrado IS NOT TRUE")
+    if arquivado is True:
+        filtros.append("arquivado")
+    elif arquivado is False:
+        filtros.append("NOT arquivado")
+    if apos_id is not None:
+        filtros.append("id < %s")
+        params.append(apos_id)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    params.append(limite + 1)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {COLUNAS_LISTA_PROJETOS} FROM projects {where} ORDER BY id DESC LIMIT %s;",
+            params,
+        )
+        rows = cur.fetchall()
+        cur.close()
+
+    projetos = [_projeto_da_linha(r) for r in rows[:limite]]
+    proximo = projetos[-1]["id"] if len(rows) > limite else None
+    return projetos, proximo
+
+@st.cache_data(show_spinner=False)
+def resumo_projeto(project_id: int):
+    """
+    Linha de listagem de um único projeto (None se não existe).
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {COLUNAS_LISTA_PROJETOS} FROM projects WHERE id = %s;", (project_id,))
+        row = cur.fetchone()
+        cur.close()
+    return _projeto_da_linha(row) if row else None
+
+@st.cache_data(show_spinner=False)
+def contar_projetos() -> int:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM projects;")
+        total = cur.fetchone()[0]
+        cur.close()
+    return total
+
+def invalidar_lista_projetos():
+    """
+    Descarta os caches de listagem de projetos.
+    """
+    buscar_projetos.clear()
+    resumo_projeto.clear()
+    contar_projetos.clear()
+    painel_portfolio.clear()
+
+def _invalidar_lista_se_tap_mudou(project_id: int, campos):
+    """
+    Invalida os caches de listagem só se nome, status, data de início,
+    gerente ou patrocinador gravados diferem dos que estão em cache.
+    """
+    chaves = ("nome", "status", "dataInicio", "gerente", "patrocinador")
+    atual = resumo_projeto(project_id)
+    if atual is None or tuple(atual[k] for k in chaves) != tuple(campos):
+        invalidar_lista_projetos()
+
+def _carregar_itens(cur, project_id: int, secoes=None):
+    """
+    Lê as seções em lista de um projeto normalizado, numa única consulta.
+    """
+    secoes = [s for s in TABELAS_SECOES if secoes is None or s in secoes]
+    if not secoes:
+        return {}
+    consulta = " UNION ALL ".join(
+        f"SELECT '{secao}', posicao, item_id, dados FROM {TABELAS_SECOES[secao]} WHERE project_id = %(id)s"
+        for secao in secoes
     )
+    cur.execute(consulta + " ORDER BY 1, 2;", {"id": project_id})
+    itens = {secao: [] for secao in secoes}
+    for secao, _, item_id, dados in cur.fetchall():
+        itens[secao].append({"id": item_id, **dados})
+    return itens
 
-    conn.commit()
-    cur.close()
-    conn.close()
+def _gravar_itens(cur, project_id: int, data: dict, secoes=None):
+    """
+    Regrava as linhas filhas de um projeto normalizado a partir do estado
+    (todas as seções em lista, ou só as informadas).
+    """
+    for secao, tabela in TABELAS_SECOES.items():
+        if secoes is not None and secao not in secoes:
+            continue
+        cur.execute(f"DELETE FROM {tabela} WHERE project_id = %s;", (project_id,))
+        linhas = [
+            (project_id, int(item["id"]), pos, Json({k: v for k, v in item.items() if k != "id"}))
+            for pos, item in enumerate(data.get(secao) or [], start=1)
+        ]
+        if linhas:
+            execute_values(
+                cur,
+                f"INSERT INTO {tabela} (project_id, item_id, posicao, dados) VALUES %s;",
+                linhas,
+            )
 
-def list_projects():
+def _ler_secoes(cur, project_id: int, secoes):
     """
-    Retorna a lista de projetos.
+    Lê do banco só as seções pedidas do estado de um projeto.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, nome, status, dataInicio, gerente, patrocinador, encerrado
-        FROM projects
-        ORDER BY id DESC;
-        """
+    secoes = list(secoes)
+    valores = {}
+    padrao = default_state()
+    cabecalho = [s for s in secoes if secao_no_documento(s)]
+    if cabecalho:
+        cur.execute(
+            f"SELECT {', '.join(['data -> %s'] * len(cabecalho))} FROM projects WHERE id = %s;",
+            (*cabecalho, project_id),
+        )
+        row = cur.fetchone() or [None] * len(cabecalho)
+        for secao, valor in zip(cabecalho, row):
+            valores[secao] = valor if valor is not None else padrao.get(secao)
+    if MODO_NORMALIZADO:
+        valores.update(_carregar_itens(cur, project_id, secoes))
+    elif MODO_COMPRIMIDO and len(cabecalho) < len(secoes):
+        em_lista = [s for s in secoes if s not in cabecalho]
+        listas = ler_listas_comprimidas(cur, project_id, em_lista)
+        for secao in em_lista:
+            valores[secao] = listas.get(secao, padrao.get(secao))
+    return valores
+
+def _gravar_listas_comprimidas(cur, project_id: int, listas: dict):
+    """
+    Modo comprimido: regrava só os blocos das seções em lista informadas
+    (a linha do projeto já deve estar travada).
+    """
+    gravar_listas_comprimidas(cur, project_id, listas, ALGORITMO_COMPRESSAO)
+
+# Journal de alterações ([general] no secrets.toml): usuario grava o autor
+# de cada evento; historico_intervalo_snapshot é a distância, em versões,
+# entre snapshots completos; historico_retencao_dias (0 = sem limite) é a
+# janela de eventos mantida.
+USUARIO_ATUAL = st.secrets["general"].get("usuario", "BK Engenharia")
+HISTORICO_INTERVALO_SNAPSHOT = int(st.secrets["general"].get("historico_intervalo_snapshot", 50))
+HISTORICO_RETENCAO_DIAS = int(st.secrets["general"].get("historico_retencao_dias", 0))
+
+def _travar_projeto(cur, project_id: int):
+    """
+    Trava a linha do projeto, desarquiva o projeto se preciso e garante o
+    snapshot-base do journal antes de uma alteração. Retorna False se o
+    projeto não existe.
+    """
+    cur.execute("SELECT arquivado FROM projects WHERE id = %s FOR UPDATE;", (project_id,))
+    row = cur.fetchone()
+    if row is None:
+        return False
+    if row[0]:
+        desarquivar_projeto(cur, project_id, MODO_ARMAZENAMENTO, ALGORITMO_COMPRESSAO)
+    garantir_snapshot_base(cur, project_id, USUARIO_ATUAL)
+    return True
+
+# Seções usadas pelas métricas do resumo de portfólio (project_summary).
+SECOES_RESUMO = ("tap", "eapTasks", "finances", "risks", "actionPlan")
+
+def _secoes_resumo_do_patch(patch):
+    """
+    Seções alteradas pelo patch que mudam o resumo. Do TAP só contam os
+    campos do cronograma (CAMPOS_TAP_CRONOGRAMA); o TAP substituído inteiro
+    também conta.
+    """
+    secoes = set()
+    for op in patch:
+        if "path" not in op:
+            secoes.add(op["secao"])
+        elif op["path"][0] != "tap" or len(op["path"]) == 1 or op["path"][1] in CAMPOS_TAP_CRONOGRAMA:
+            secoes.add(op["path"][0])
+    return secoes
+
+def _atualizar_resumo(cur, project_id: int, versao: int, secoes=None, estado=None):
+    """
+    Mantém o resumo de portfólio do projeto na transação da gravação. Com
+    `secoes`, só os grupos de métricas que dependem delas são recalculados
+    e só as colunas deles são atualizadas; sem `secoes` (ou se o projeto
+    ainda não tem resumo), todas. As seções necessárias que não vierem em
+    `estado` são lidas do banco.
+    """
+    estado = dict(estado or {})
+    if secoes is not None:
+        grupos = [calcular for dependencias, calcular in GRUPOS_RESUMO if set(dependencias) & set(secoes)]
+        faltando = {
+            s
+            for dependencias, calcular in GRUPOS_RESUMO
+            if calcular in grupos
+            for s in dependencias
+            if s not in estado
+        }
+        if faltando:
+            estado.update(_ler_secoes(cur, project_id, faltando))
+        resumo = {}
+        for calcular in grupos:
+            resumo.update(calcular(estado))
+        if gravar_resumo(cur, project_id, versao, resumo, parcial=True):
+            return
+    faltando = [s for s in SECOES_RESUMO if s not in estado]
+    if faltando:
+        estado.update(_ler_secoes(cur, project_id, faltando))
+    gravar_resumo(cur, project_id, versao, metricas_projeto(estado))
+
+def _registrar_alteracao(cur, project_id: int, versao: int, patch, desfaz=None, estado=None):
+    """
+    Registra a alteração no journal e atualiza o resumo de portfólio.
+    """
+    _atualizar_resumo(cur, project_id, versao, _secoes_resumo_do_patch(patch), estado)
+    if patch:
+        registrar_evento(
+            cur,
+            project_id,
+            versao,
+            patch,
+            USUARIO_ATUAL,
+            intervalo_snapshot=HISTORICO_INTERVALO_SNAPSHOT,
+            retencao_dias=HISTORICO_RETENCAO_DIAS or None,
+            desfaz=desfaz,
+        )
+
+# Fragmento de UPDATE que incrementa a versão do projeto e registra, para
+# cada seção gravada (parâmetro text[]), a versão em que ela mudou.
+SQL_NOVA_VERSAO = """
+    version = version + 1,
+    versoes_secoes = versoes_secoes || COALESCE(
+        (SELECT jsonb_object_agg(s, version + 1) FROM unnest(%s::text[]) AS s),
+        '{}'::jsonb
     )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+"""
 
-    projetos = []
-    for r in rows:
-        projetos.append(
-            {
-                "id": r[0],
-                "nome": r[1] or "",
-                "status": r[2] or "",
-                "dataInicio": r[3] or "",
-                "gerente": r[4] or "",
-                "patrocinador": r[5] or "",
-                "encerrado": bool(r[6]),
-            }
+def carregar_projeto(project_id: int):
+    """
+    Carrega o estado do projeto e a versão correspondente, num mesmo
+    instantâneo do banco. No modo normalizado, as seções em lista vêm das
+    tabelas filhas; no comprimido, são decodificadas de project_lists.
+    Um projeto gravado em outro modo é convertido na hora, e um projeto
+    arquivado volta para a tabela quente.
+    Retorna (estado, versão); a versão é None se o projeto não existe.
+
+    Antes da leitura completa, a versão atual é sondada: se o cache de
+    documentos tem o projeto nessa versão, devolve uma cópia dele.
+    """
+    cache = get_cache_documentos()
+    sonda = versao_projeto(project_id)
+    if sonda is not None:
+        data = cache.obter(project_id, sonda[0])
+        if data is not None:
+            return data, sonda[0]
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT normalizado, comprimido, arquivado FROM projects WHERE id = %s;", (project_id,)
+        )
+        row = cur.fetchone()
+        desarquivado = False
+        if row and row[2]:
+            cur.execute("SELECT 1 FROM projects WHERE id = %s FOR UPDATE;", (project_id,))
+            desarquivado = desarquivar_projeto(
+                cur, project_id, MODO_ARMAZENAMENTO, ALGORITMO_COMPRESSAO
+            )
+        elif row and (row[0] != MODO_NORMALIZADO or row[1] != MODO_COMPRIMIDO):
+            ajustar_modo_projetos(cur, MODO_ARMAZENAMENTO, project_id, ALGORITMO_COMPRESSAO)
+        conn.commit()
+        if desarquivado:
+            invalidar_lista_projetos()
+
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute(
+            "SELECT data, normalizado, version, comprimido FROM projects WHERE id = %s;",
+            (project_id,),
         )
-    return projetos
+        row = cur.fetchone()
+        itens = None
+        if row and row[1]:
+            itens = _carregar_itens(cur, project_id)
+        elif row and row[3]:
+            itens = ler_listas_comprimidas(cur, project_id)
+        conn.commit()
+        cur.close()
+
+    if not row:
+        return default_state(), None
+    versao = row[2]
+    if not (row[0] or itens):
+        return default_state(), versao
+    try:
+        # JSONB já chega como dict; texto só aparece em bancos ainda não migrados.
+        data = row[0] or {}
+        if isinstance(data, str):
+            data = json.loads(data)
+        if not isinstance(data, dict):
+            return default_state(), versao
+    except Exception:
+        return default_state(), versao
+
+    if itens is not None:
+        data.update(itens)
+    for chave, valor in default_state().items():
+        data.setdefault(chave, valor)
+    cache.guardar(project_id, versao, data)
+    return data, versao
 
 def load_project_state(project_id: int):
     """
-    Carrega o JSON do campo 'data' para o estado do projeto.
+    Carrega o estado do projeto (sem a versão).
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT data FROM projects WHERE id = %s;", (project_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    return carregar_projeto(project_id)[0]
 
-    if row and row[0]:
-        try:
-            data = json.loads(row[0])
-            if "actionPlan" not in data:
-                data["actionPlan"] = []
-            return data
-        except Exception:
-            return default_state()
-    return default_state()
+def versao_projeto(project_id: int):
+    """
+    Sonda barata de alterações: retorna (versão, versões por seção) sem
+    trazer o documento, ou None se o projeto não existe mais.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT version, versoes_secoes FROM projects WHERE id = %s;", (project_id,))
+        row = cur.fetchone()
+        cur.close()
+    return (row[0], row[1] or {}) if row else None
+
+def carregar_alteracoes_desde(project_id: int, versao_base: int):
+    """
+    Lê, num mesmo instantâneo, a versão atual do projeto e o conteúdo das
+    seções alteradas depois de versao_base.
+    Retorna (versão, {seção: valor}) ou None se o projeto não existe mais.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute("SELECT version, versoes_secoes FROM projects WHERE id = %s;", (project_id,))
+        row = cur.fetchone()
+        if not row:
+            conn.commit()
+            return None
+        versao, versoes = row
+        alteradas = {s for s, v in (versoes or {}).items() if v > versao_base}
+        valores = _ler_secoes(cur, project_id, alteradas) if alteradas else {}
+        conn.commit()
+        cur.close()
+    return versao, valores
+
+def _campos_tap(tap: dict):
+    """
+    Campos do TAP desnormalizados em colunas da tabela projects.
+    """
+    tap = tap or {}
+    return (
+        tap.get("nome", "") or "",
+        tap.get("status", "rascunho") or "rascunho",
+        tap.get("dataInicio", "") or "",
+        tap.get("gerente", "") or "",
+        tap.get("patrocinador", "") or "",
+    )
 
-def save_project_state(project_id: int, data: dict):
+def save_project_state(project_id: int, data: dict, incluir_itens: bool = True):
     """
     Atualiza o registro do projeto com o JSON completo e
-    campos principais desnormalizados.
+    campos principais desnormalizados. Gravação incondicional: incrementa
+    a versão e marca todas as seções como alteradas.
+
+    Nos modos normalizado e comprimido, projects.data recebe só as seções
+    que não são listas; as tabelas filhas (ou o bloco comprimido) só são
+    regravadas se incluir_itens=True (no modo normalizado, edições item a
+    item usam salvar_item_projeto / excluir_item_projeto).
     """
     tap = data.get("tap", {}) if isinstance(data, dict) else {}
-    nome = tap.get("nome", "") or ""
-    status = tap.get("status", "rascunho") or "rascunho"
-    dataInicio = tap.get("dataInicio", "") or ""
-    gerente = tap.get("gerente", "") or ""
-    patrocinador = tap.get("patrocinador", "") or ""
+    nome, status, dataInicio, gerente, patrocinador = _campos_tap(tap)
+
+    documento = {k: v for k, v in data.items() if secao_no_documento(k)}
+    secoes = list(data if incluir_itens else documento)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not _travar_projeto(cur, project_id):
+            conn.rollback()
+            return None
+        # Só as seções regravadas entram no patch do journal.
+        antigos = _ler_secoes(cur, project_id, secoes)
+        cur.execute(
+            f"""
+            UPDATE projects
+            SET data = %s,
+                nome = %s,
+                status = %s,
+                dataInicio = %s,
+                gerente = %s,
+                patrocinador = %s,
+                {SQL_NOVA_VERSAO}
+            WHERE id = %s
+            RETURNING version;
+            """,
+            (Json(documento), nome, status, dataInicio, gerente, patrocinador, secoes, project_id),
+        )
+        row = cur.fetchone()
+        if MODO_NORMALIZADO and incluir_itens:
+            _gravar_itens(cur, project_id, data)
+        if MODO_COMPRIMIDO and incluir_itens:
+            _gravar_listas_comprimidas(
+                cur, project_id, {s: v for s, v in data.items() if not secao_no_documento(s)}
+            )
+        _registrar_alteracao(
+            cur,
+            project_id,
+            row[0],
+            gerar_patch(antigos, {s: data[s] for s in secoes}),
+            estado=data if incluir_itens else None,
+        )
+        conn.commit()
+        cur.close()
+    _invalidar_lista_se_tap_mudou(project_id, (nome, status, dataInicio, gerente, patrocinador))
+    return row[0] if row else None
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE projects
-        SET data = %s,
-            nome = %s,
-            status = %s,
-            dataInicio = %s,
-            gerente = %s,
-            patrocinador = %s
-        WHERE id = %s;
+def _sql_gravar_secoes(project_id: int, secoes: dict, alteradas):
+    """
+    UPDATE das seções de cabeçalho (patch `data || {...}` no JSONB), das
+    colunas do TAP e da versão do projeto, marcando `alteradas` em
+    versoes_secoes. Termina no WHERE da linha, para quem chama completar.
+    Retorna (sql, params).
+    """
+    cabecalho = {k: v for k, v in secoes.items() if secao_no_documento(k)}
+    sets, params = [], []
+    if cabecalho:
+        sets.append("data = CASE WHEN jsonb_typeof(data) = 'object' THEN data ELSE '{}'::jsonb END || %s")
+        params.append(Json(cabecalho))
+    if "tap" in cabecalho:
+        sets.append("nome = %s, status = %s, dataInicio = %s, gerente = %s, patrocinador = %s")
+        params.extend(_campos_tap(cabecalho["tap"]))
+    sets.append(SQL_NOVA_VERSAO)
+    params.extend([list(alteradas), project_id])
+    return f"UPDATE projects SET {', '.join(sets)} WHERE id = %s", params
+
+def salvar_secoes_projeto(project_id: int, secoes: dict, versao_base=None):
+    """
+    Grava só as seções informadas do estado do projeto com um patch
+    `data || {...}` no JSONB, sem reenviar o documento inteiro.
+    No modo normalizado as seções em lista são ignoradas aqui (elas são
+    gravadas item a item); no comprimido, vão para o bloco comprimido.
+
+    Com versao_base, a gravação é condicional (WHERE version = versao_base).
+    Se outra sessão gravou antes, as seções que ela alterou são comparadas
+    com as desta gravação: sem sobreposição, a gravação é refeita e as
+    seções alheias são lidas na mesma transação para mesclar na sessão;
+    com sobreposição, levanta ConflitoEdicao.
+
+    Retorna (nova versão, {seção alterada por outra sessão: valor}); a
+    versão é None quando nada foi gravado.
+    """
+    if MODO_NORMALIZADO:
+        secoes = {k: v for k, v in secoes.items() if k not in TABELAS_SECOES}
+    if not secoes:
+        return None, {}
+
+    sql, params = _sql_gravar_secoes(project_id, secoes, secoes)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not _travar_projeto(cur, project_id):
+            conn.rollback()
+            return None, {}
+        antigos = _ler_secoes(cur, project_id, secoes)
+        if versao_base is None:
+            cur.execute(sql + " RETURNING version;", params)
+        else:
+            cur.execute(sql + " AND version = %s RETURNING version;", params + [versao_base])
+        row = cur.fetchone()
+
+        if row is None and versao_base is not None:
+            cur.execute(
+                "SELECT versoes_secoes FROM projects WHERE id = %s FOR UPDATE;",
+                (project_id,),
+            )
+            atual = cur.fetchone()
+            if atual:
+                conflitos = {s for s, v in atual[0].items() if v > versao_base} & set(secoes)
+                if conflitos:
+                    conn.rollback()
+                    raise ConflitoEdicao(conflitos)
+                # A linha já está travada: grava sem a condição de versão.
+                cur.execute(sql + " RETURNING version;", params)
+                row = cur.fetchone()
+
+        if row is None:
+            conn.rollback()
+            return None, {}
+
+        nova_versao = row[0]
+        if MODO_COMPRIMIDO:
+            _gravar_listas_comprimidas(
+                cur, project_id, {k: v for k, v in secoes.items() if not secao_no_documento(k)}
+            )
+        _registrar_alteracao(
+            cur, project_id, nova_versao, gerar_patch(antigos, secoes), estado=secoes
+        )
+        remotas = {}
+        if versao_base is not None and nova_versao != versao_base + 1:
+            cur.execute("SELECT versoes_secoes FROM projects WHERE id = %s;", (project_id,))
+            versoes = cur.fetchone()[0]
+            remotas = _ler_secoes(
+                cur, project_id, {s for s, v in versoes.items() if versao_base < v < nova_versao}
+            )
+        conn.commit()
+        cur.close()
+    if "tap" in secoes:
+        _invalidar_lista_se_tap_mudou(project_id, _campos_tap(secoes["tap"]))
+    return nova_versao, remotas
+
+def _gravar_item(project_id: int, secao: str, sql: str, params, patch, versao_base=None):
+    """
+    Executa a gravação de um item do modo normalizado junto com o
+    incremento de versão do projeto e o registro do patch no journal. A
+    linha do projeto é travada antes, para que gravações concorrentes do
+    mesmo projeto fiquem em fila.
+    Retorna (nova versão, {seção alterada por outra sessão: valor}).
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not _travar_projeto(cur, project_id):
+            conn.rollback()
+            return None, {}
+        cur.execute(
+            f"UPDATE projects SET {SQL_NOVA_VERSAO} WHERE id = %s RETURNING version;",
+            ([secao], project_id),
+        )
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None, {}
+        cur.execute(sql, params)
+
+        nova_versao = row[0]
+        _registrar_alteracao(cur, project_id, nova_versao, patch)
+        remotas = {}
+        if versao_base is not None and nova_versao != versao_base + 1:
+            # Outras sessões gravaram no meio: relê as seções que elas
+            # alteraram (incluindo esta, que pode ter itens novos delas).
+            cur.execute("SELECT versoes_secoes FROM projects WHERE id = %s;", (project_id,))
+            versoes = cur.fetchone()[0]
+            remotas = _ler_secoes(
+                cur, project_id, {s for s, v in versoes.items() if v > versao_base}
+            )
+        conn.commit()
+        cur.close()
+    return nova_versao, remotas
+
+def _operacao_item(project_id: int, secao: str, item_id: int, item=None):
+    """
+    Modo normalizado: comando de linha que grava a inclusão ou edição de um
+    item (um INSERT ... ON CONFLICT DO UPDATE) ou, com item None, a exclusão
+    dele. Retorna (sql, params, patch).
+    """
+    tabela = TABELAS_SECOES[secao]
+    if item is None:
+        return (
+            f"DELETE FROM {tabela} WHERE project_id = %s AND item_id = %s;",
+            (project_id, int(item_id)),
+            [{"op": "item_del", "secao": secao, "id": int(item_id)}],
+        )
+    dados = {k: v for k, v in item.items() if k != "id"}
+    return (
+        f"""
+        INSERT INTO {tabela} (project_id, item_id, posicao, dados)
+        VALUES (
+            %s, %s,
+            (SELECT COALESCE(max(posicao), 0) + 1 FROM {tabela} WHERE project_id = %s),
+            %s
+        )
+        ON CONFLICT (project_id, item_id) DO UPDATE SET dados = EXCLUDED.dados;
         """,
-        (json.dumps(data), nome, status, dataInicio, gerente, patrocinador, project_id),
+        (project_id, int(item_id), project_id, Json(dados)),
+        [{"op": "item", "secao": secao, "id": int(item_id), "valor": dados}],
     )
-    conn.commit()
-    cur.close()
-    conn.close()
+
+def salvar_item_projeto(project_id: int, secao: str, item: dict, versao_base=None):
+    """
+    Modo normalizado: grava a inclusão ou edição de um único item de uma
+    seção em lista.
+    """
+    return _gravar_item(
+        project_id, secao, *_operacao_item(project_id, secao, item["id"], item), versao_base
+    )
+
+def excluir_item_projeto(project_id: int, secao: str, item_id: int, versao_base=None):
+    """
+    Modo normalizado: exclui um único item de uma seção em lista.
+    """
+    return _gravar_item(project_id, secao, *_operacao_item(project_id, secao, item_id), versao_base)
+
+def restaurar_secoes_projeto(project_id: int, valores: dict, desfaz=None):
+    """
+    Regrava seções inteiras do projeto com os valores informados (usado para
+    desfazer e para restaurar uma versão do journal). Nos modos normalizado
+    e comprimido as seções em lista têm as linhas filhas (ou o bloco
+    comprimido) regravadas. Retorna a nova versão.
+    """
+    sql, params = _sql_gravar_secoes(project_id, valores, valores)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not _travar_projeto(cur, project_id):
+            conn.rollback()
+            return None
+        antigos = _ler_secoes(cur, project_id, valores)
+        cur.execute(sql + " RETURNING version;", params)
+        nova_versao = cur.fetchone()[0]
+        if MODO_NORMALIZADO:
+            _gravar_itens(cur, project_id, valores, secoes=valores)
+        if MODO_COMPRIMIDO:
+            _gravar_listas_comprimidas(
+                cur, project_id, {s: v for s, v in valores.items() if not secao_no_documento(s)}
+            )
+        _registrar_alteracao(
+            cur, project_id, nova_versao, gerar_patch(antigos, valores), desfaz, estado=valores
+        )
+        conn.commit()
+        cur.close()
+    if "tap" in valores:
+        _invalidar_lista_se_tap_mudou(project_id, _campos_tap(valores["tap"]))
+    return nova_versao
+
+def estado_na_versao(project_id: int, versao=None, instante=None):
+    """
+    Reconstrói o estado do projeto numa versão (ou num instante) a partir do
+    journal. Retorna (estado, versão) ou (None, None).
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        data, versao = reconstruir_estado(cur, project_id, versao, instante)
+        cur.close()
+    if data is None:
+        return None, None
+    if not isinstance(data, dict):
+        data = {}
+    for chave, valor in default_state().items():
+        data.setdefault(chave, valor)
+    return data, versao
+
+def restaurar_versao_projeto(project_id: int, versao: int):
+    """
+    Volta o projeto inteiro ao estado de uma versão do journal (como uma
+    nova alteração, que também pode ser desfeita).
+    """
+    data, _ = estado_na_versao(project_id, versao)
+    if data is None:
+        return None
+    return restaurar_secoes_projeto(project_id, data)
+
+def desfazer_alteracao_projeto(project_id: int):
+    """
+    Desfaz a alteração mais recente ainda não desfeita: as seções que ela
+    tocou voltam ao estado da versão anterior. Chamadas seguidas desfazem
+    alterações cada vez mais antigas. Retorna a nova versão ou None.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        alvo = versao_a_desfazer(cur, project_id)
+        anterior = reconstruir_estado(cur, project_id, alvo[0] - 1)[0] if alvo else None
+        cur.close()
+    if anterior is None:
+        return None
+    padrao = default_state()
+    return restaurar_secoes_projeto(
+        project_id,
+        {s: anterior.get(s, padrao.get(s)) for s in secoes_do_patch(alvo[1])},
+        desfaz=alvo[0],
+    )
+
+def historico_projeto(project_id: int, limite: int = 30):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        eventos = listar_eventos(cur, project_id, limite)
+        cur.close()
+    return eventos
+
+def gravar_lote_projeto(project_id: int, lote: dict):
+    """
+    Grava um lote da fila assíncrona numa transação só, com um único
+    incremento de versão, um único evento no journal e uma única
+    atualização do resumo: as seções num patch `data || {...}` e cada item
+    (None = exclusão) com a operação de linha correspondente.
+
+    Com a versão-base do lote, as seções que outra sessão gravou depois
+    dela levantam ConflitoEdicao e nada é gravado (as versões em
+    "proprias" foram gravadas pela própria sessão e não contam). Itens não
+    entram na verificação: cada um é uma linha própria, como nas gravações
+    síncronas. A transação inteira pode ser repetida após erro transitório.
+    Retorna a nova versão (None se não há o que gravar ou o projeto não
+    existe).
+    """
+    secoes = lote["secoes"]
+    if MODO_NORMALIZADO:
+        secoes = {k: v for k, v in secoes.items() if k not in TABELAS_SECOES}
+    itens = lote["itens"]
+    alteradas = list(secoes) + sorted({s for s, _ in itens} - set(secoes))
+    if not alteradas:
+        return None
+    sql, params = _sql_gravar_secoes(project_id, secoes, alteradas)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not _travar_projeto(cur, project_id):
+            conn.rollback()
+            return None
+        versao_base = lote.get("versao_base")
+        if versao_base is not None and secoes:
+            cur.execute("SELECT versoes_secoes FROM projects WHERE id = %s;", (project_id,))
+            versoes = cur.fetchone()[0] or {}
+            conflitos = {
+                s
+                for s in secoes
+                if versoes.get(s, 0) > versao_base and versoes[s] not in lote.get("proprias", ())
+            }
+            if conflitos:
+                conn.rollback()
+                raise ConflitoEdicao(conflitos)
+        antigos = _ler_secoes(cur, project_id, secoes) if secoes else {}
+        cur.execute(sql + " RETURNING version;", params)
+        nova_versao = cur.fetchone()[0]
+        if MODO_COMPRIMIDO:
+            _gravar_listas_comprimidas(
+                cur, project_id, {k: v for k, v in secoes.items() if not secao_no_documento(k)}
+            )
+        patch = gerar_patch(antigos, secoes)
+        for (secao, item_id), item in itens.items():
+            sql_item, params_item, patch_item = _operacao_item(project_id, secao, item_id, item)
+            cur.execute(sql_item, params_item)
+            patch.extend(patch_item)
+        _registrar_alteracao(cur, project_id, nova_versao, patch, estado=secoes)
+        conn.commit()
+        cur.close()
+    if "tap" in secoes:
+        _invalidar_lista_se_tap_mudou(project_id, _campos_tap(secoes["tap"]))
+    return nova_versao
+
+# Gravação assíncrona ([general] gravacao_assincrona no secrets.toml): os
+# botões só enfileiram a gravação e a página redesenha na hora; uma thread
+# grava em segundo plano, juntando gravações seguidas do mesmo projeto.
+GRAVACAO_ASSINCRONA = bool(st.secrets["general"].get("gravacao_assincrona", False))
+TIMEOUT_DESCARGA = float(st.secrets["general"].get("gravacao_timeout", 30))
+
+@st.cache_resource(show_spinner=False)
+def get_fila_gravacao():
+    """
+    Fila de gravação assíncrona, única por processo.
+    """
+    return FilaGravacao(gravar_lote_projeto)
 
 def create_project(initial_data=None, meta=None) -> int:
     """
@@ -363,152 +1177,350 @@ def create_project(initial_data=None, meta=None) -> int:
     tap["patrocinador"] = patrocinador
     initial_data["tap"] = tap
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO projects (data, nome, status, dataInicio, gerente, patrocinador, encerrado)
-        VALUES (%s, %s, %s, %s, %s, %s, FALSE)
-        RETURNING id;
-        """,
-        (
-            json.dumps(initial_data),
-            nome,
-            status,
-            dataInicio,
-            gerente,
-            patrocinador,
-        ),
-    )
-    project_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
+    if MODO_NORMALIZADO:
+        for secao in TABELAS_SECOES:
+            for idx, item in enumerate(initial_data.get(secao) or []):
+                item.setdefault("id", int(datetime.now().timestamp() * 1000) + idx)
+    documento = {k: v for k, v in initial_data.items() if secao_no_documento(k)}
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO projects (
+                data, nome, status, dataInicio, gerente, patrocinador, encerrado,
+                normalizado, comprimido
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, FALSE, %s, %s)
+            RETURNING id, version;
+            """,
+            (
+                Json(documento),
+                nome,
+                status,
+                dataInicio,
+                gerente,
+                patrocinador,
+                MODO_NORMALIZADO,
+                MODO_COMPRIMIDO,
+            ),
+        )
+        project_id, versao = cur.fetchone()
+        if MODO_NORMALIZADO:
+            _gravar_itens(cur, project_id, initial_data)
+        if MODO_COMPRIMIDO:
+            _gravar_listas_comprimidas(
+                cur, project_id, {k: v for k, v in initial_data.items() if not secao_no_documento(k)}
+            )
+        gravar_snapshot(cur, project_id, USUARIO_ATUAL)
+        _atualizar_resumo(cur, project_id, versao, estado=initial_data)
+        conn.commit()
+        cur.close()
+    invalidar_lista_projetos()
     return project_id
 
 def close_project(project_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE projects SET encerrado = TRUE, status = %s WHERE id = %s;",
-        ("encerrado", project_id),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE projects SET encerrado = TRUE, status = %s, inativo_desde = now() WHERE id = %s;",
+            ("encerrado", project_id),
+        )
+        conn.commit()
+        cur.close()
+    invalidar_lista_projetos()
 
 def reopen_project(project_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE projects SET encerrado = FALSE WHERE id = %s;",
-        (project_id,),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    """
+    Reabre o projeto, trazendo o documento de volta do arquivo se preciso.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM projects WHERE id = %s FOR UPDATE;", (project_id,))
+        desarquivar_projeto(cur, project_id, MODO_ARMAZENAMENTO, ALGORITMO_COMPRESSAO)
+        cur.execute(
+            "UPDATE projects SET encerrado = FALSE, inativo_desde = NULL WHERE id = %s;",
+            (project_id,),
+        )
+        conn.commit()
+        cur.close()
+    invalidar_lista_projetos()
 
 def delete_project(project_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM projects WHERE id = %s;", (project_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM projects WHERE id = %s;", (project_id,))
+        conn.commit()
+        cur.close()
+    invalidar_lista_projetos()
+    get_cache_documentos().descartar(project_id)
+
+# Consultas entre projetos executadas no PostgreSQL, sem trazer os
+# documentos para o Python. Valem para qualquer modo de armazenamento
+# (documento, normalizado, comprimido, arquivado): o status do TAP vem da
+# coluna projects.status e as contagens/totais de project_summary.
+
+def projetos_por_status_tap(status: str):
+    """
+    IDs e nomes dos projetos cujo TAP está no status informado.
+    Usa o índice (status, id DESC) de projects.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, nome
+            FROM projects
+            WHERE status = %s
+            ORDER BY id DESC;
+            """,
+            (status,),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return [{"id": r[0], "nome": r[1] or ""} for r in rows]
+
+def projetos_com_atividades_no_status(status: str):
+    """
+    Projetos com ao menos uma atividade da EAP no status informado,
+    com a quantidade dessas atividades (project_summary.atividades_por_status).
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT p.id, p.nome, (s.atividades_por_status ->> %s)::int AS qtd
+            FROM project_summary s
+            JOIN projects p ON p.id = s.project_id
+            WHERE COALESCE((s.atividades_por_status ->> %s)::int, 0) > 0
+            ORDER BY p.id DESC;
+            """,
+            (status, status),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return [{"id": r[0], "nome": r[1] or "", "qtd": int(r[2])} for r in rows]
+
+def projetos_com_atividades_pendentes():
+    """
+    Projetos com atividades da EAP ainda não concluídas e a quantidade delas.
+    """
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT p.id, p.nome, s.atividades_a_fazer
+            FROM project_summary s
+            JOIN projects p ON p.id = s.project_id
+            WHERE s.atividades_a_fazer > 0
+            ORDER BY p.id DESC;
+            """
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return [{"id": r[0], "nome": r[1] or "", "qtd": int(r[2])} for r in rows]
+
+def totais_financeiros_realizados(project_id=None):
+    """
+    Soma dos lançamentos realizados por tipo (Entrada / Saída), em todos os
+    projetos ou em um só.
+    Retorna {"Entrada": float, "Saída": float, "saldo": float}.
+    """
+    sql = """
+        SELECT COALESCE(sum(receita_realizada), 0), COALESCE(sum(despesa_realizada), 0)
+        FROM project_summary
+    """
+    params = []
+    if project_id is not None:
+        sql += " WHERE project_id = %s"
+        params.append(project_id)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(sql + ";", params)
+        entrada, saida = cur.fetchone()
+        cur.close()
+
+    totais = {"Entrada": float(entrada), "Saída": float(saida)}
+    totais["saldo"] = totais["Entrada"] - totais["Saída"]
+    return totais
+
+# Painel de portfólio: tudo vem de project_summary (mantida a cada gravação),
+# agregado e ordenado no PostgreSQL. Nenhum documento de projeto é aberto,
+# exceto o dos projetos com resumo ausente ou defasado (importados pelo
+# transferencia.py, que não calcula métricas), recalculados antes da consulta.
+# O TTL cobre as gravações de itens, que não invalidam as listagens.
+
+@st.cache_data(show_spinner=False, ttl=60)
+def painel_portfolio(incluir_encerrados: bool = False, limite: int = 10):
+    """
+    Indicadores do portfólio: totais, projetos com atividades em atraso,
+    maiores riscos e projetos com término (CPM) no mês corrente.
+    """
+    atrasadas = sql_atividades_atrasadas("s")
+    base = "FROM projects p JOIN project_summary s ON s.project_id = p.id"
+    filtro = "TRUE" if incluir_encerrados else "NOT p.encerrado"
+
+    with get_conn() as conn:
+        atualizar_resumos_defasados(conn)
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT count(*),
+                   COALESCE(sum(s.receita_realizada - s.despesa_realizada), 0),
+                   COALESCE(sum(s.receita_prevista - s.despesa_prevista), 0),
+                   COALESCE(sum({atrasadas}) FILTER (WHERE s.primeiro_fim_pendente < current_date), 0),
+                   COALESCE(sum(s.atividades_a_fazer), 0),
+                   COALESCE(sum(s.acoes_abertas), 0)
+            {base}
+            WHERE {filtro};
+            """
+        )
+        totais = cur.fetchone()
+
+        cur.execute(
+            f"""
+            SELECT p.id, p.nome, p.gerente, {atrasadas} AS atrasadas, s.atividades_a_fazer
+            {base}
+            WHERE {filtro} AND s.primeiro_fim_pendente < current_date
+            ORDER BY atrasadas DESC, p.id DESC
+            LIMIT %s;
+            """,
+            (limite,),
+        )
+        em_atraso = cur.fetchall()
+
+        cur.execute(
+            f"""
+            SELECT p.id, p.nome, s.maior_risco, s.maior_indice_risco, s.acoes_abertas
+            {base}
+            WHERE {filtro} AND s.maior_indice_risco IS NOT NULL
+            ORDER BY s.maior_indice_risco DESC, p.id DESC
+            LIMIT %s;
+            """,
+            (limite,),
+        )
+        riscos = cur.fetchall()
+
+        cur.execute(
+            f"""
+            SELECT p.id, p.nome, p.gerente, s.data_fim_cpm, s.atividades_a_fazer
+            {base}
+            WHERE {filtro}
+              AND s.data_fim_cpm >= date_trunc('month', current_date)::date
+              AND s.data_fim_cpm < (date_trunc('month', current_date) + interval '1 month')::date
+            ORDER BY s.data_fim_cpm, p.id
+            LIMIT %s;
+            """,
+            (limite,),
+        )
+        fim_no_mes = cur.fetchall()
+        cur.close()
+
+    return {
+        "projetos": int(totais[0]),
+        "saldo_real": float(totais[1]),
+        "saldo_previsto": float(totais[2]),
+        "atrasadas": int(totais[3]),
+        "a_fazer": int(totais[4]),
+        "acoes_abertas": int(totais[5]),
+        "em_atraso": [
+            {"ID": r[0], "Projeto": r[1] or "", "Gerente": r[2] or "", "Em atraso": int(r[3]), "A fazer": r[4]}
+            for r in em_atraso
+        ],
+        "riscos": [
+            {"ID": r[0], "Projeto": r[1] or "", "Maior risco": r[2] or "", "Índice": float(r[3]), "Ações abertas": r[4]}
+            for r in riscos
+        ],
+        "fim_no_mes": [
+            {"ID": r[0], "Projeto": r[1] or "", "Gerente": r[2] or "", "Término (CPM)": r[3].strftime("%d/%m/%Y"), "A fazer": r[4]}
+            for r in fim_no_mes
+        ],
+    }
 
 # --------------------------------------------------------
 # CPM / GANTT / CURVA S TRABALHO
 # --------------------------------------------------------
 
-def calcular_cpm(tasks):
-    if not tasks:
-        return tasks, 0
-
-    tasks = [dict(t) for t in tasks]
-    mapa = {t["codigo"]: t for t in tasks}
-
-    for t in tasks:
-        t["es"] = 0
-        t["ef"] = 0
-        t["ls"] = 0
-        t["lf"] = 0
-        t["slack"] = 0
-
-    max_iter = 1000
-    for _ in range(max_iter):
-        atualizado = False
-        for t in tasks:
-            dur = int(t.get("duracao") or 0)
-            preds = t.get("predecessoras") or []
-            rel = t.get("relacao") or "FS"
-
-            if preds:
-                max_start = 0
-                todos_ok = True
-                for cod in preds:
-                    p = mapa.get(cod)
-                    if not p:
-                        todos_ok = False
-                        break
-                    if rel in ("FS", "FF"):
-                        cand = p.get("ef", 0)
-                    else:
-                        cand = p.get("es", 0)
-                    if cand > max_start:
-                        max_start = cand
-                if not todos_ok:
-                    continue
-                if t["ef"] == 0:
-                    t["es"] = max_start
-                    t["ef"] = t["es"] + dur
-                    atualizado = True
-            else:
-                if t["ef"] == 0:
-                    t["es"] = 0
-                    t["ef"] = dur
-                    atualizado = True
-        if not atualizado:
-            break
-
-    projeto_fim = max((t["ef"] for t in tasks), default=0)
-
-    succ_map = {t["codigo"]: [] for t in tasks}
-    for t in tasks:
-        for cod_p in (t.get("predecessoras") or []):
-            if cod_p in succ_map:
-                succ_map[cod_p].append(t["codigo"])
-
-    ordem = sorted(tasks, key=lambda x: x["es"], reverse=True)
-    for t in ordem:
-        cod = t["codigo"]
-        dur = int(t.get("duracao") or 0)
-        succs = succ_map.get(cod) or []
-        if not succs:
-            t["lf"] = projeto_fim
-            t["ls"] = projeto_fim - dur
-        else:
-            min_ls = None
-            for scod in succs:
-                s = mapa[scod]
-                if s["lf"] == 0:
-                    s["lf"] = s["ef"]
-                    s["ls"] = s["lf"] - int(s.get("duracao") or 0)
-                if (min_ls is None) or (s["ls"] < min_ls):
-                    min_ls = s["ls"]
-            if min_ls is None:
-                min_ls = projeto_fim - dur
-            t["lf"] = min_ls
-            t["ls"] = t["lf"] - dur
-
-        t["slack"] = t["ls"] - t["es"]
-
-    return tasks, projeto_fim
+AJUDA_PREDECESSORAS = (
+    "Código da predecessora, opcionalmente seguido do tipo de ligação (FS, SS, FF, SF) "
+    "e da defasagem em dias: 1.1, 1.2FS+3, 2SS-1. Sem tipo, vale a relação padrão."
+)
+
+AJUDA_TRES_PONTOS = (
+    "Opcional, para a análise de risco do cronograma (Monte Carlo). "
+    "0 = sem incerteza (usa a duração)."
+)
+
+def erro_tres_pontos(duracao, otimista, pessimista):
+    """
+    Mensagem de erro das durações otimista/pessimista (0 = não informada),
+    ou None se estiverem coerentes com a duração mais provável.
+    """
+    if otimista and otimista > duracao:
+        return "A duração otimista não pode ser maior que a duração."
+    if pessimista and pessimista < duracao:
+        return "A duração pessimista não pode ser menor que a duração."
+    return None
+
+def cronograma_projeto(tasks, data_inicio=None):
+    """
+    Cronograma (CPM) da EAP pelo cache de cronogramas: a mesma EAP com a
+    mesma data de início é calculada uma vez por processo. Numa falta, o
+    cálculo usa o motor incremental guardado na sessão, e editar uma
+    atividade só repropaga as datas afetadas por ela (inclusive no resumo
+    recalculado pelas gravações síncronas). Só fora da thread da página
+    (fila de gravação), onde não há sessão, o cálculo usa um motor próprio.
+    As atividades devolvidas são compartilhadas; não alterar.
+    """
+    if get_script_run_ctx(suppress_warning=True) is None:
+        motor = CronogramaIncremental()
+    else:
+        motor = st.session_state.get("cpm_incremental")
+        if motor is None:
+            motor = st.session_state["cpm_incremental"] = CronogramaIncremental()
+    return get_cache_cronogramas().obter(tasks, data_inicio, motor)
+
+def calcular_cpm(tasks, data_inicio=None):
+    """
+    ES/EF/LS/LF/folga das atividades e a duração do projeto. Os problemas
+    da rede (ciclos, predecessoras inexistentes) ficam com cronograma_projeto.
+    """
+    cronograma = cronograma_projeto(tasks, data_inicio)
+    return cronograma.tarefas, cronograma.projeto_fim
+
+def eap_hierarquica(tasks, tap):
+    """
+    Atividades com CPM, árvore da EAP (ordem natural dos códigos) e totais
+    dos nós resumo, com datas pelos calendários do TAP. Ficam nos derivados
+    do cronograma: recolher/expandir ramos ou reexecutar a página não
+    remonta a árvore nem refaz os totais.
+    """
+    cronograma = cronograma_projeto(tasks, tap.get("dataInicio"))
+    chave_calendario = json.dumps(
+        [tap.get("calendario"), tap.get("calendariosRecursos")], sort_keys=True, default=str
+    )
+    guardado = cronograma.derivados.get("eap")
+    if guardado is None or guardado[0] != chave_calendario:
+        arvore = guardado[1] if guardado else ArvoreEAP(cronograma.tarefas)
+        inicios = terminos = None
+        data_inicio = _data_iso(tap.get("dataInicio"))
+        if data_inicio:
+            calendario, por_responsavel = calendarios_projeto(tap)
+            inicios, terminos = datas_atividades(cronograma.tarefas, data_inicio, calendario, por_responsavel)
+        guardado = cronograma.derivados["eap"] = (
+            chave_calendario,
+            arvore,
+            arvore.totalizar(cronograma.tarefas, inicios, terminos),
+        )
+    return cronograma.tarefas, guardado[1], guardado[2]
 
 def gerar_curva_s_trabalho(tasks, data_inicio_str):
     if not tasks or not data_inicio_str:
         return None
 
-    tasks_cpm, total_dias = calcular_cpm(tasks)
+    cronograma = cronograma_projeto(tasks, data_inicio_str)
+    tasks_cpm, total_dias = cronograma.tarefas, cronograma.projeto_fim
     if total_dias <= 0:
         return None
 
@@ -516,23 +1528,10 @@ def gerar_curva_s_trabalho(tasks, data_inicio_str):
     if soma_duracoes <= 0:
         return None
 
-    dias = list(range(0, total_dias + 1))
-    progresso = []
-
-    for d in dias:
-        acum = 0
-        for t in tasks_cpm:
-            dur = int(t.get("duracao") or 0)
-            es = t.get("es", 0)
-            peso = dur / soma_duracoes if soma_duracoes > 0 else 0
-            if d <= es:
-                frac = 0
-            elif d >= es + dur:
-                frac = 1
-            else:
-                frac = (d - es) / dur
-            acum += peso * frac
-        progresso.append(acum * 100.0)
+    dias = np.arange(total_dias + 1)
+    progresso = cronograma.derivados.get("curva_s")
+    if progresso is None:
+        progresso = cronograma.derivados["curva_s"] = curva_s_trabalho(tasks_cpm, total_dias)
 
     df = pd.DataFrame(
         {
@@ -554,6 +1553,123 @@ def gerar_curva_s_trabalho(tasks, data_inicio_str):
     )
     return fig
 
+def datas_termino_simulacao(fins, data_inicio_str, calendario):
+    """
+    Datas de término (datetime64[D]) de durações simuladas do projeto, em
+    dias de trabalho do calendário.
+    """
+    inicio = datetime.strptime(data_inicio_str, "%Y-%m-%d").date()
+    dias = np.ceil(np.asarray(fins, dtype=float) - 1e-9).astype(np.int64)
+    return calendario.terminos(inicio, np.zeros_like(dias), dias)
+
+def gerar_graficos_simulacao(resultado, data_inicio_str, calendario, limite_tornado=10):
+    """
+    Distribuição do término do projeto e gráfico de tornado (correlação da
+    duração de cada atividade com o término) de uma simulação de Monte Carlo.
+    """
+    fins = pd.Series(
+        datas_termino_simulacao(resultado.fins, data_inicio_str, calendario), name="Término"
+    )
+    fig_dist = px.histogram(
+        fins, x="Término", nbins=40, title=f"Término do projeto em {resultado.iteracoes} iterações"
+    )
+    for p, cor in ((50, "#22c55e"), (80, "#eab308"), (90, "#ef4444")):
+        data_p = datas_termino_simulacao([resultado.percentis[p]], data_inicio_str, calendario)[0]
+        fig_dist.add_vline(x=pd.Timestamp(data_p), line_dash="dash", line_color=cor, annotation_text=f"P{p}")
+    fig_dist.update_layout(
+        template="plotly_dark", height=320, margin=dict(l=30, r=20, t=35, b=30), showlegend=False
+    )
+
+    ordem = np.argsort(-np.abs(resultado.sensibilidade))[:limite_tornado]
+    ordem = [i for i in ordem if resultado.sensibilidade[i] != 0][::-1]
+    df_tornado = pd.DataFrame(
+        {
+            "Atividade": [str(resultado.codigos[i]) for i in ordem],
+            "Correlação com o término": [float(resultado.sensibilidade[i]) for i in ordem],
+        }
+    )
+    fig_tornado = px.bar(
+        df_tornado,
+        x="Correlação com o término",
+        y="Atividade",
+        orientation="h",
+        title="Tornado: atividades que mais influenciam o término",
+    )
+    fig_tornado.update_layout(
+        template="plotly_dark",
+        height=max(220, 32 * len(ordem) + 80),
+        margin=dict(l=30, r=20, t=35, b=30),
+        xaxis_range=[-1, 1],
+    )
+    return fig_dist, fig_tornado
+
+def capacidades_recursos(tap: dict) -> dict:
+    """
+    Capacidade (atividades simultâneas por dia) dos responsáveis cadastrados
+    em tap.calendariosRecursos; os demais têm capacidade 1.
+    """
+    capacidades = {}
+    for nome, recurso in (tap.get("calendariosRecursos") or {}).items():
+        try:
+            capacidades[nome] = max(int((recurso or {}).get("capacidade", 1)), 0)
+        except (TypeError, ValueError):
+            capacidades[nome] = 1
+    return capacidades
+
+def cronograma_nivelado(tasks, tap):
+    """
+    Atividades com CPM e o nivelamento de recursos delas pelas capacidades
+    do TAP, guardado nos derivados do cronograma (só refaz quando a EAP, a
+    data de início ou as capacidades mudam).
+    """
+    cronograma = cronograma_projeto(tasks, tap.get("dataInicio"))
+    capacidades = capacidades_recursos(tap)
+    guardado = cronograma.derivados.get("nivelamento")
+    if guardado is None or guardado[0] != capacidades:
+        guardado = cronograma.derivados["nivelamento"] = (
+            capacidades,
+            nivelar_recursos(cronograma.tarefas, capacidades),
+        )
+    return cronograma.tarefas, guardado[1]
+
+def gerar_histograma_recursos(tasks_cpm, nivelamento, responsavel, capacidade, inicio=None, calendario=None):
+    """
+    Atividades em andamento por dia de um responsável no cronograma do CPM
+    (sem limite de capacidade) e no nivelado, com a linha da capacidade.
+    Com início e calendário, o eixo mostra datas. Os dias do histograma são
+    deslocamentos do CPM, então o calendário é sempre o do projeto.
+    """
+    dias = max(nivelamento.projeto_fim, nivelamento.projeto_fim_cpm, 1)
+    series = []
+    for rotulo, tarefas in (("CPM (sem limite)", tasks_cpm), ("Nivelado", nivelamento.tarefas)):
+        nomes, uso = histograma_recursos(tarefas, dias)
+        series.append(
+            pd.DataFrame(
+                {
+                    "Dia": np.arange(dias),
+                    "Atividades em andamento": uso[nomes.index(responsavel)] if responsavel in nomes else 0,
+                    "Cronograma": rotulo,
+                }
+            )
+        )
+    df = pd.concat(series, ignore_index=True)
+    eixo = "Dia"
+    if inicio and calendario is not None:
+        df["Data"] = calendario.datas(inicio, df["Dia"].to_numpy())
+        eixo = "Data"
+    fig = px.line(
+        df,
+        x=eixo,
+        y="Atividades em andamento",
+        color="Cronograma",
+        line_shape="hv",
+        title=f"Histograma de recursos — {responsavel}",
+    )
+    if capacidade > 0:
+        fig.add_hline(y=capacidade, line_dash="dash", line_color="#ef4444", annotation_text="Capacidade")
+    fig.update_layout(template="plotly_dark", height=320, margin=dict(l=30, r=20, t=35, b=30))
+    return fig
+
 # --------------------------------------------------------
 # FINANCEIRO / CURVA S FINANCEIRA
 # --------------------------------------------------------
@@ -613,87 +1729,469 @@ def gerar_curva_s_financeira(finances, inicio_str, meses):
     def key_mes(d: date):
         return f"{d.year}-{str(d.month).zfill(2)}"
 
-    mapa_prev = {}
-    mapa_real = {}
+    mapa_prev = {}
+    mapa_real = {}
+
+    cursor = inicio
+    while cursor <= fim:
+        k = key_mes(cursor)
+        mapa_prev[k] = 0.0
+        mapa_real[k] = 0.0
+        if cursor.month == 12:
+            cursor = date(cursor.year + 1, 1, 1)
+        else:
+            cursor = date(cursor.year, cursor.month + 1, 1)
+
+    for l in finances:
+        tipo = l["tipo"]
+        valor = float(l["valor"])
+        fator = 1 if tipo == "Entrada" else -1
+
+        ocorrencias = expandir_recorrencia(l, inicio, fim)
+        for d in ocorrencias:
+            k = key_mes(d)
+            mapa_prev[k] += fator * valor
+
+        if l.get("realizado") and l.get("dataRealizada"):
+            dr = datetime.strptime(l["dataRealizada"], "%Y-%m-%d").date()
+            if inicio <= dr <= fim:
+                k = key_mes(dr)
+                mapa_real[k] += fator * valor
+
+    labels = sorted(mapa_prev.keys())
+    prev_vals = [mapa_prev[k] for k in labels]
+    real_vals = [mapa_real[k] for k in labels]
+
+    prev_acum = []
+    real_acum = []
+    ap = 0
+    ar = 0
+    for p, r in zip(prev_vals, real_vals):
+        ap += p
+        ar += r
+        prev_acum.append(ap)
+        real_acum.append(ar)
+
+    df = pd.DataFrame(
+        {
+            "Mês": labels,
+            "Previsto (acumulado)": prev_acum,
+            "Realizado (acumulado)": real_acum,
+        }
+    )
+    fig = px.line(
+        df,
+        x="Mês",
+        y=["Previsto (acumulado)", "Realizado (acumulado)"],
+        title="Curva S Financeira - Previsto x Realizado (Acumulado)",
+    )
+    fig.update_traces(mode="lines+markers")
+    fig.update_layout(
+        template="plotly_dark",
+        height=350,
+        margin=dict(l=30, r=20, t=35, b=30),
+    )
+
+    return df, fig
+
+# --------------------------------------------------------
+# MÉTRICAS DO PROJETO (HOME / RESUMO DE PORTFÓLIO)
+# --------------------------------------------------------
+
+def _data_iso(valor):
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+CALENDARIO_PADRAO = {
+    "semana": SEMANA_PADRAO,
+    "feriadosNacionais": True,
+    "facultativos": True,
+    "feriados": [],
+    "diasTrabalhados": [],
+}
+
+def calendarios_projeto(tap: dict):
+    """
+    Calendário de trabalho do projeto e dos responsáveis ({nome: Calendario}),
+    a partir de tap.calendario e tap.calendariosRecursos. Configurações
+    inválidas caem no calendário padrão (seg-sex com feriados nacionais).
+    """
+    config = {**CALENDARIO_PADRAO, **(tap.get("calendario") or {})}
+    try:
+        return (
+            calendario_de_config(config),
+            calendarios_de_recursos(config, tap.get("calendariosRecursos") or {}),
+        )
+    except ValueError:
+        return calendario_de_config(CALENDARIO_PADRAO), {}
+
+def _ler_datas_br(texto: str):
+    """
+    Datas dd/mm/aaaa (uma por linha ou separadas por vírgula) em ISO, e as
+    entradas que não são datas válidas.
+    """
+    datas, invalidas = [], []
+    for parte in texto.replace(",", "\n").splitlines():
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            datas.append(datetime.strptime(parte, "%d/%m/%Y").date().isoformat())
+        except ValueError:
+            invalidas.append(parte)
+    return sorted(set(datas)), invalidas
+
+def _data_br(iso: str) -> str:
+    d = _data_iso(iso)
+    return d.strftime("%d/%m/%Y") if d else str(iso)
+
+def _parcelas_lancamento(lanc) -> int:
+    """
+    Quantidade de parcelas de um lançamento (1 se não é recorrente),
+    como no extrato da aba Financeiro.
+    """
+    if (lanc.get("recorrencia") or "Nenhuma") == "Nenhuma":
+        return 1
+    try:
+        return max(int(lanc.get("qtdRecorrencias") or 1), 1)
+    except (TypeError, ValueError):
+        return 1
+
+def _metricas_atividades(estado: dict):
+    """
+    Métricas das atividades: total, por status, a fazer (não concluídas),
+    términos previstos das não concluídas (CPM a partir de tap.dataInicio,
+    em dias de trabalho do calendário do projeto/responsável) e as datas de
+    início (TAP) e de término pelo CPM.
+    """
+    tap = estado.get("tap") or {}
+    tarefas = estado.get("eapTasks") or []
+    data_inicio = _data_iso(tap.get("dataInicio"))
+
+    por_status = {}
+    for t in tarefas:
+        s = t.get("status") or "nao-iniciado"
+        por_status[s] = por_status.get(s, 0) + 1
+
+    fins_pendentes = []
+    data_fim_cpm = None
+    if tarefas and data_inicio:
+        try:
+            tasks_cpm, _ = calcular_cpm(tarefas, tap.get("dataInicio"))
+            calendario, por_responsavel = calendarios_projeto(tap)
+            _, terminos = datas_atividades(tasks_cpm, data_inicio, calendario, por_responsavel)
+            # O término do projeto é o da última atividade: com calendários
+            # de responsáveis ele pode passar do EF do CPM no calendário do
+            # projeto.
+            data_fim_cpm = terminos.max().astype(date)
+            pendentes = [
+                i for i, t in enumerate(tasks_cpm) if t.get("status", "nao-iniciado") != "concluido"
+            ]
+            fins_pendentes = terminos[pendentes].astype(date).tolist()
+        except (TypeError, ValueError):
+            # Data de início ou calendário inválido no TAP: sem datas previstas.
+            fins_pendentes = []
+        except Exception:
+            logger.exception("Falha ao calcular o cronograma do projeto para as métricas")
+            fins_pendentes = []
+
+    return {
+        "atividades_total": len(tarefas),
+        "atividades_por_status": por_status,
+        "atividades_a_fazer": sum(1 for t in tarefas if t.get("status") != "concluido"),
+        "fins_pendentes": fins_pendentes,
+        "data_inicio": data_inicio,
+        "data_fim_cpm": data_fim_cpm,
+    }
+
+def _metricas_financeiras(estado: dict):
+    """
+    Receitas e despesas previstas (valor x parcelas) e realizadas.
+    """
+    totais = {("Entrada", False): 0.0, ("Entrada", True): 0.0, ("Saída", False): 0.0, ("Saída", True): 0.0}
+    for l in estado.get("finances") or []:
+        try:
+            valor = float(l.get("valor") or 0)
+        except (TypeError, ValueError):
+            continue
+        tipo = l.get("tipo")
+        if tipo not in ("Entrada", "Saída"):
+            continue
+        totais[(tipo, False)] += valor * _parcelas_lancamento(l)
+        if l.get("realizado"):
+            totais[(tipo, True)] += valor
+    return {
+        "receita_prevista": totais[("Entrada", False)],
+        "receita_realizada": totais[("Entrada", True)],
+        "despesa_prevista": totais[("Saída", False)],
+        "despesa_realizada": totais[("Saída", True)],
+    }
+
+def _metricas_riscos(estado: dict):
+    """
+    Maior índice de risco e a descrição do risco.
+    """
+    maior_risco = None
+    for r in estado.get("risks") or []:
+        try:
+            indice = float(r.get("indice"))
+        except (TypeError, ValueError):
+            continue
+        if maior_risco is None or indice > maior_risco[0]:
+            maior_risco = (indice, r.get("descricao") or "")
+    return {
+        "maior_indice_risco": maior_risco[0] if maior_risco else None,
+        "maior_risco": maior_risco[1] if maior_risco else None,
+    }
+
+def _metricas_acoes(estado: dict):
+    """
+    Ações abertas do plano de ação.
+    """
+    return {
+        "acoes_abertas": sum(
+            1 for a in estado.get("actionPlan") or [] if a.get("status") != "concluido"
+        ),
+    }
+
+# Grupos de métricas do resumo e as seções de que cada um depende: uma
+# gravação recalcula só os grupos das seções que mudou (o CPM só roda
+# quando mudam as atividades ou a data de início/calendários do TAP).
+GRUPOS_RESUMO = (
+    (("tap", "eapTasks"), _metricas_atividades),
+    (("finances",), _metricas_financeiras),
+    (("risks",), _metricas_riscos),
+    (("actionPlan",), _metricas_acoes),
+)
+
+# Campos do TAP que entram no cronograma; editar os outros (nome, gerente,
+# objetivos...) não recalcula o CPM do resumo.
+CAMPOS_TAP_CRONOGRAMA = ("dataInicio", "calendario", "calendariosRecursos")
+
+def metricas_projeto(estado: dict, hoje=None):
+    """
+    Métricas da Home de um projeto, também gravadas em project_summary
+    (todos os grupos de GRUPOS_RESUMO), mais as atividades atrasadas (término
+    previsto antes de hoje) e o saldo_real (entradas realizadas menos saídas
+    realizadas).
+    """
+    hoje = hoje or date.today()
+    metricas = _metricas_atividades(estado)
+    for _, calcular in GRUPOS_RESUMO[1:]:
+        metricas.update(calcular(estado))
+    metricas["atividades_atrasadas"] = sum(1 for d in metricas["fins_pendentes"] if d < hoje)
+    metricas["saldo_real"] = metricas["receita_realizada"] - metricas["despesa_realizada"]
+    return metricas
+
+def atualizar_resumos_defasados(conn):
+    """
+    Recalcula o resumo de portfólio dos projetos sem resumo ou com resumo
+    defasado (projetos anteriores à tabela, gravados por versões antigas ou
+    importados pelo transferencia.py).
+    """
+    cur = conn.cursor()
+    for project_id in projetos_com_resumo_defasado(cur):
+        cur.execute("SELECT 1 FROM projects WHERE id = %s FOR UPDATE;", (project_id,))
+        documento, versao = documento_completo(cur, project_id)
+        if documento is not None:
+            gravar_resumo(
+                cur,
+                project_id,
+                versao,
+                metricas_projeto(documento if isinstance(documento, dict) else {}),
+            )
+        conn.commit()
+    cur.close()
+
+# --------------------------------------------------------
+# INICIALIZAÇÃO
+# --------------------------------------------------------
 
-    cursor = inicio
-    while cursor <= fim:
-        k = key_mes(cursor)
-        mapa_prev[k] = 0.0
-        mapa_real[k] = 0.0
-        if cursor.month == 12:
-            cursor = date(cursor.year + 1, 1, 1)
-        else:
-            cursor = date(cursor.year, cursor.month + 1, 1)
+init_db()
 
-    for l in finances:
-        tipo = l["tipo"]
-        valor = float(l["valor"])
-        fator = 1 if tipo == "Entrada" else -1
+# Seções de tamanho pequeno: a cada gravação, o hash do conteúdo diz se
+# mudaram (os campos do TAP e do encerramento são editados por widgets).
+# As seções em lista são marcadas como alteradas por quem as modifica.
+SECOES_VERIFICADAS_POR_HASH = ("tap", "close")
 
-        ocorrencias = expandir_recorrencia(l, inicio, fim)
-        for d in ocorrencias:
-            k = key_mes(d)
-            mapa_prev[k] += fator * valor
+def hash_secao(valor) -> str:
+    return hashlib.sha1(
+        json.dumps(valor, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
 
-        if l.get("realizado") and l.get("dataRealizada"):
-            dr = datetime.strptime(l["dataRealizada"], "%Y-%m-%d").date()
-            if inicio <= dr <= fim:
-                k = key_mes(dr)
-                mapa_real[k] += fator * valor
+def carregar_estado(project_id: int):
+    """
+    Carrega o projeto na sessão e registra a base para as gravações parciais
+    (hash das seções e versão do projeto).
+    """
+    if GRAVACAO_ASSINCRONA:
+        get_fila_gravacao().descarregar(project_id, timeout=TIMEOUT_DESCARGA)
+    st.session_state.current_project_id = project_id
+    st.session_state.state, st.session_state.versao_projeto = carregar_projeto(project_id)
+    st.session_state.hash_secoes = {
+        secao: hash_secao(st.session_state.state.get(secao))
+        for secao in SECOES_VERIFICADAS_POR_HASH
+    }
+    st.session_state.pop("conflito", None)
+    st.session_state.rebasear_hashes = set(SECOES_VERIFICADAS_POR_HASH)
 
-    labels = sorted(mapa_prev.keys())
-    prev_vals = [mapa_prev[k] for k in labels]
-    real_vals = [mapa_real[k] for k in labels]
+def secoes_pendentes():
+    """
+    Seções entre tap e close com edições locais ainda não gravadas.
+    """
+    hashes = st.session_state.get("hash_secoes", {})
+    return {
+        secao
+        for secao in SECOES_VERIFICADAS_POR_HASH
+        if hashes.get(secao) != hash_secao(st.session_state.state.get(secao))
+    }
 
-    prev_acum = []
-    real_acum = []
-    ap = 0
-    ar = 0
-    for p, r in zip(prev_vals, real_vals):
-        ap += p
-        ar += r
-        prev_acum.append(ap)
-        real_acum.append(ar)
+def aplicar_gravacao(nova_versao, remotas):
+    """
+    Avança a versão-base da sessão e mescla as seções que outras sessões
+    gravaram (sem sobreposição com as desta sessão).
+    """
+    if nova_versao is None:
+        return
+    for secao, valor in remotas.items():
+        st.session_state.state[secao] = valor
+        if secao in SECOES_VERIFICADAS_POR_HASH:
+            st.session_state.hash_secoes[secao] = hash_secao(valor)
+            st.session_state.setdefault("rebasear_hashes", set()).add(secao)
+    st.session_state.versao_projeto = nova_versao
+
+def registrar_conflito(secoes, pendentes):
+    """
+    Guarda o conflito na sessão (para o aviso na tela) e recarrega a página.
+    """
+    st.session_state.conflito = {
+        "secoes": sorted(secoes),
+        "pendentes": {secao: st.session_state.state.get(secao) for secao in pendentes},
+    }
+    st.rerun()
 
-    df = pd.DataFrame(
-        {
-            "Mês": labels,
-            "Previsto (acumulado)": prev_acum,
-            "Realizado (acumulado)": real_acum,
-        }
-    )
-    fig = px.line(
-        df,
-        x="Mês",
-        y=["Previsto (acumulado)", "Realizado (acumulado)"],
-        title="Curva S Financeira - Previsto x Realizado (Acumulado)",
-    )
-    fig.update_traces(mode="lines+markers")
-    fig.update_layout(
-        template="plotly_dark",
-        height=350,
-        margin=dict(l=30, r=20, t=35, b=30),
+def descarregar_gravacoes(project_id=None) -> bool:
+    """
+    No modo de gravação assíncrona, espera as gravações pendentes chegarem
+    ao banco (ações críticas: encerrar, reabrir, excluir, sobrescrever).
+    """
+    if not GRAVACAO_ASSINCRONA:
+        return True
+    if get_fila_gravacao().descarregar(project_id, timeout=TIMEOUT_DESCARGA):
+        return True
+    erro = (
+        get_fila_gravacao().status(project_id, origem_gravacao())["erro"]
+        if project_id is not None
+        else None
     )
+    st.error(f"Há alterações ainda não gravadas no banco. {erro or 'Tente novamente.'}")
+    return False
 
-    return df, fig
+def origem_gravacao():
+    """
+    Identifica a sessão nos lotes da fila de gravação assíncrona.
+    """
+    return get_script_run_ctx().session_id
 
-# --------------------------------------------------------
-# INICIALIZAÇÃO
-# --------------------------------------------------------
+def enfileirar_gravacao(secoes=None, itens=None):
+    """
+    Modo assíncrono: agenda a gravação com a versão-base da sessão. Um
+    conflito com outra sessão só é detectado quando o lote chega ao banco e
+    aparece na próxima sonda de alterações externas.
+    """
+    get_fila_gravacao().enfileirar(
+        st.session_state.current_project_id,
+        secoes=secoes,
+        itens=itens,
+        versao_base=st.session_state.get("versao_projeto"),
+        origem=origem_gravacao(),
+    )
 
-init_db()
+def gravar_secoes(secoes: dict):
+    """
+    Grava as seções condicionadas à versão-base da sessão. Em conflito com
+    outra sessão, registra o conflito em vez de sobrescrever.
+    No modo assíncrono, só enfileira a gravação (com a mesma condição).
+    """
+    if GRAVACAO_ASSINCRONA:
+        if secoes:
+            enfileirar_gravacao(secoes=secoes)
+        return
+    try:
+        resultado = salvar_secoes_projeto(
+            st.session_state.current_project_id,
+            secoes,
+            st.session_state.get("versao_projeto"),
+        )
+    except ConflitoEdicao as e:
+        registrar_conflito(e.secoes, set(secoes) | secoes_pendentes())
+    aplicar_gravacao(*resultado)
+
+def verificar_alteracoes_externas():
+    """
+    Sonda a versão do projeto e, se outra sessão gravou, traz só as seções
+    alteradas. Se alguma delas também tem edição local não gravada, a
+    mesclagem é suspensa e o conflito fica registrado na sessão.
+    """
+    if st.session_state.get("conflito"):
+        return
+    pid = st.session_state.current_project_id
+    if GRAVACAO_ASSINCRONA:
+        fila = get_fila_gravacao()
+        erro = fila.falha(pid, origem_gravacao())
+        if isinstance(erro, ConflitoEdicao):
+            # Lote recusado por conflito: as seções sobrepostas vão para a
+            # escolha do usuário; o resto do lote volta para a fila.
+            lote = fila.descartar_falha(pid, origem_gravacao())
+            resto = {s: v for s, v in lote["secoes"].items() if s not in erro.secoes}
+            if resto or lote["itens"]:
+                fila.enfileirar(
+                    pid,
+                    secoes=resto,
+                    itens=lote["itens"],
+                    versao_base=lote["versao_base"],
+                    origem=origem_gravacao(),
+                )
+            registrar_conflito(erro.secoes, erro.secoes | secoes_pendentes())
+        if fila.pendente(pid):
+            # As próprias gravações ainda não chegaram ao banco.
+            return
+    base = st.session_state.get("versao_projeto")
+    sonda = versao_projeto(pid)
+    if sonda is None:
+        st.session_state.pop("current_project_id", None)
+        st.session_state.pop("state", None)
+        st.rerun()
+    if base is None or sonda[0] == base:
+        return
+    alteracoes = carregar_alteracoes_desde(pid, base)
+    if alteracoes is None:
+        return
+    nova_versao, remotas = alteracoes
+    # Seção que volta com o valor já registrado como base da sessão é a
+    # gravação da própria sessão (fila assíncrona), não de outra: só a
+    # versão-base avança.
+    hashes = st.session_state.get("hash_secoes", {})
+    remotas = {
+        secao: valor
+        for secao, valor in remotas.items()
+        if secao not in hashes or hashes[secao] != hash_secao(valor)
+    }
+    pendentes = secoes_pendentes()
+    sobrepostas = set(remotas) & pendentes
+    if sobrepostas:
+        registrar_conflito(sobrepostas, pendentes)
+    aplicar_gravacao(nova_versao, remotas)
 
 if "current_project_id" not in st.session_state:
-    projetos_ini = list_projects()
+    projetos_ini, _ = buscar_projetos(limite=1)
     if not projetos_ini:
         pid = create_project(default_state(), {"nome": "Projeto 1"})
-        st.session_state.current_project_id = pid
-        st.session_state.state = load_project_state(pid)
+        carregar_estado(pid)
     else:
-        pid = projetos_ini[0]["id"]
-        st.session_state.current_project_id = pid
-        st.session_state.state = load_project_state(pid)
+        carregar_estado(projetos_ini[0]["id"])
 
 if "state" not in st.session_state:
     st.session_state.state = default_state()
@@ -715,7 +2213,7 @@ with col_title:
 with col_info:
     st.markdown(
         f"<div style='text-align:right; font-size:12px; color:#9ca3af; padding-top:6px;'>"
-        f"Usuário: <strong>BK Engenharia</strong><br>Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}</div>",
+        f"Usuário: <strong>{USUARIO_ATUAL}</strong><br>Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}</div>",
         unsafe_allow_html=True
     )
 
@@ -727,45 +2225,82 @@ st.markdown("---")
 
 st.sidebar.markdown("### 🔁 Projetos")
 
-projetos = list_projects()
-if not projetos:
+if contar_projetos() == 0:
     pid = create_project(default_state(), {"nome": "Projeto 1"})
-    st.session_state.current_project_id = pid
-    st.session_state.state = load_project_state(pid)
+    carregar_estado(pid)
     st.rerun()
 
-proj_labels = []
-id_to_label = {}
-label_to_id = {}
-for p in projetos:
+def rotulo_projeto(p) -> str:
     status = p["status"] or "rascunho"
-    status_tag = f" ({status})"
-    extra = " [ENCERRADO]" if p["encerrado"] else ""
-    label = f"#{p['id']} - {p['nome']}{status_tag}{extra}"
-    proj_labels.append(label)
-    id_to_label[p["id"]] = label
-    label_to_id[label] = p["id"]
+    extra = " [ARQUIVADO]" if p["arquivado"] else " [ENCERRADO]" if p["encerrado"] else ""
+    return f"#{p['id']} - {p['nome']} ({status}){extra}"
+
+busca = st.sidebar.text_input("🔎 Buscar (nome, gerente, patrocinador)", key="busca_proj")
+cb1, cb2 = st.sidebar.columns(2)
+with cb1:
+    filtro_status = st.selectbox(
+        "Status",
+        ["(todos)", "rascunho", "em_aprovacao", "aprovado", "encerrado"],
+        key="busca_status",
+    )
+with cb2:
+    filtro_situacao = st.selectbox(
+        "Situação", ["Todos", "Ativos", "Encerrados", "Arquivados"], key="busca_situacao"
+    )
+
+# "Todos" lista só a tabela quente; os arquivados têm uma opção própria.
+filtros_busca = (
+    busca.strip().lower(),
+    None if filtro_status == "(todos)" else filtro_status,
+    {"Todos": None, "Ativos": False, "Encerrados": True, "Arquivados": None}[filtro_situacao],
+    filtro_situacao == "Arquivados",
+)
+# Pilha de cursores das páginas visitadas; volta à primeira página quando
+# os filtros mudam.
+if st.session_state.get("busca_filtros") != filtros_busca:
+    st.session_state.busca_filtros = filtros_busca
+    st.session_state.busca_cursores = [None]
+cursores = st.session_state.busca_cursores
+
+pagina, proximo_cursor = buscar_projetos(*filtros_busca, apos_id=cursores[-1])
 
 current_id = st.session_state.current_project_id
-current_label = id_to_label.get(current_id, proj_labels[0])
+current_proj = resumo_projeto(current_id)
+if current_proj is None:
+    # Projeto excluído por outra sessão.
+    st.session_state.pop("current_project_id", None)
+    st.session_state.pop("state", None)
+    st.rerun()
 
-selected_label = st.sidebar.selectbox(
+projetos_pagina = {p["id"]: p for p in pagina}
+opcoes_ids = list(projetos_pagina)
+if current_id not in projetos_pagina:
+    projetos_pagina[current_id] = current_proj
+    opcoes_ids.insert(0, current_id)
+
+selected_id = st.sidebar.selectbox(
     "Selecione o projeto",
-    proj_labels,
-    index=proj_labels.index(current_label),
+    opcoes_ids,
+    index=opcoes_ids.index(current_id),
+    format_func=lambda pid: rotulo_projeto(projetos_pagina[pid]),
 )
 
-selected_id = label_to_id[selected_label]
+cp1, cp2, cp3 = st.sidebar.columns([1, 2, 1])
+with cp1:
+    if st.button("◀", key="busca_anterior", disabled=len(cursores) == 1):
+        cursores.pop()
+        st.rerun()
+with cp2:
+    st.caption(f"Página {len(cursores)} — {contar_projetos()} projetos no total")
+with cp3:
+    if st.button("▶", key="busca_proxima", disabled=proximo_cursor is None):
+        cursores.append(proximo_cursor)
+        st.rerun()
 
 if selected_id != st.session_state.current_project_id:
-    st.session_state.current_project_id = selected_id
-    st.session_state.state = load_project_state(selected_id)
+    carregar_estado(selected_id)
     st.rerun()
 
-projetos = list_projects()
-current_id = st.session_state.current_project_id
-current_proj = next((p for p in projetos if p["id"] == current_id), projetos[0])
-
 with st.sidebar.expander("Ações do projeto atual", expanded=True):
     st.write(f"ID: `{current_proj['id']}`")
     st.write(f"Status: `{current_proj['status'] or 'rascunho'}`")
@@ -775,35 +2310,35 @@ with st.sidebar.expander("Ações do projeto atual", expanded=True):
         novo_nome = st.text_input("Novo nome do projeto", value=current_proj["nome"], key="rename_proj")
         if st.button("💾 Renomear"):
             st.session_state.state["tap"]["nome"] = novo_nome
-            save_project_state(st.session_state.current_project_id, st.session_state.state)
+            gravar_secoes({"tap": st.session_state.state["tap"]})
+            st.session_state.hash_secoes["tap"] = hash_secao(st.session_state.state["tap"])
             st.success("Projeto renomeado.")
             st.rerun()
     with c2:
         if current_proj["encerrado"]:
-            if st.button("🔓 Reabrir"):
+            if st.button("🔓 Reabrir") and descarregar_gravacoes(st.session_state.current_project_id):
                 reopen_project(st.session_state.current_project_id)
                 st.success("Projeto reaberto.")
                 st.rerun()
         else:
-            if st.button("📦 Encerrar"):
+            if st.button("📦 Encerrar") and descarregar_gravacoes(st.session_state.current_project_id):
                 close_project(st.session_state.current_project_id)
-                st.success("Projeto encerrado (arquivado).")
+                st.success("Projeto encerrado.")
                 st.rerun()
 
     st.markdown("---")
 
     if st.button("➕ Criar novo projeto"):
         meta = {
-            "nome": f"Projeto {len(projetos) + 1}",
+            "nome": f"Projeto {contar_projetos() + 1}",
             "status": "rascunho",
         }
         pid = create_project(default_state(), meta)
-        st.session_state.current_project_id = pid
-        st.session_state.state = load_project_state(pid)
+        carregar_estado(pid)
         st.success("Novo projeto criado.")
         st.rerun()
 
-    if st.button("🗑️ Excluir este projeto"):
+    if st.button("🗑️ Excluir este projeto") and descarregar_gravacoes(st.session_state.current_project_id):
         proj_id = st.session_state.current_project_id
         delete_project(proj_id)
         st.session_state.pop("current_project_id", None)
@@ -811,10 +2346,112 @@ with st.sidebar.expander("Ações do projeto atual", expanded=True):
         st.success("Projeto excluído.")
         st.rerun()
 
+    if GRAVACAO_ASSINCRONA:
+        status_gravacao = get_fila_gravacao().status(
+            st.session_state.current_project_id, origem_gravacao()
+        )
+        if status_gravacao["falha"]:
+            st.error(f"❌ Alterações recusadas pelo banco: {status_gravacao['erro']}")
+            col_reenviar, col_descartar = st.columns(2)
+            if col_reenviar.button("🔁 Tentar gravar de novo"):
+                get_fila_gravacao().reenviar(st.session_state.current_project_id, origem_gravacao())
+                st.rerun()
+            if col_descartar.button("Descartar alterações"):
+                get_fila_gravacao().descartar_falha(st.session_state.current_project_id, origem_gravacao())
+                carregar_estado(st.session_state.current_project_id)
+                st.rerun()
+        elif status_gravacao["erro"]:
+            st.warning(f"⚠️ Falha ao gravar (nova tentativa em andamento): {status_gravacao['erro']}")
+        elif status_gravacao["pendente"]:
+            st.caption("⏳ Gravando alterações no banco...")
+        elif status_gravacao["gravado_em"]:
+            st.caption(
+                "✅ Alterações gravadas às "
+                f"{datetime.fromtimestamp(status_gravacao['gravado_em']).strftime('%H:%M:%S')}"
+            )
+
+with st.sidebar.expander("🕒 Histórico de alterações", expanded=False):
+    eventos = historico_projeto(st.session_state.current_project_id)
+    versoes_patch = []
+    for _, versao_ev, criado_em, autor, tipo, patch_ev, desfaz in eventos:
+        if tipo == "snapshot":
+            descricao = "snapshot completo"
+        else:
+            versoes_patch.append(versao_ev)
+            descricao = resumir_patch(patch_ev)
+            if desfaz is not None:
+                descricao = f"desfaz v{desfaz} — {descricao}"
+        st.caption(f"v{versao_ev} · {criado_em.strftime('%d/%m %H:%M')} · {autor or '-'} · {descricao}")
+
+    if st.button("↩️ Desfazer última alteração") and descarregar_gravacoes(st.session_state.current_project_id):
+        if desfazer_alteracao_projeto(st.session_state.current_project_id) is None:
+            st.warning("Não há alteração a desfazer no histórico.")
+        else:
+            carregar_estado(st.session_state.current_project_id)
+            st.rerun()
+
+    if versoes_patch:
+        versao_restaurar = st.selectbox("Versão", versoes_patch, key="hist_versao")
+        if st.button("⏪ Restaurar esta versão") and descarregar_gravacoes(st.session_state.current_project_id):
+            if restaurar_versao_projeto(st.session_state.current_project_id, versao_restaurar) is None:
+                st.warning("O histórico não cobre esta versão.")
+            else:
+                carregar_estado(st.session_state.current_project_id)
+                st.rerun()
+
+with st.sidebar.expander("🔧 Diagnóstico do banco", expanded=False):
+    metricas_pool = get_pool().metricas()
+    st.caption(
+        f"Conexões em uso: {metricas_pool['em_uso']} / {metricas_pool['max']} "
+        f"(mínimo {metricas_pool['min']})"
+    )
+    st.caption(
+        f"Empréstimos: {metricas_pool['emprestimos']} — com espera: {metricas_pool['esperas']} "
+        f"— timeouts: {metricas_pool['timeouts']} — descartadas: {metricas_pool['descartadas']}"
+    )
+    st.caption(
+        f"Espera média: {metricas_pool['espera_media_ms']} ms — máxima: {metricas_pool['espera_max_ms']} ms"
+    )
+    metricas_cache = get_cache_documentos().metricas()
+    st.caption(
+        f"Cache de documentos: {metricas_cache['documentos']} projetos, "
+        f"{metricas_cache['bytes'] / 1024:.1f} / {metricas_cache['max_bytes'] / 1024:.0f} KB "
+        f"— acertos: {metricas_cache['acertos']} — faltas: {metricas_cache['faltas']} "
+        f"— despejos: {metricas_cache['despejos']}"
+    )
+    metricas_cronogramas = get_cache_cronogramas().metricas()
+    st.caption(
+        f"Cache de cronogramas: {metricas_cronogramas['cronogramas']} / {metricas_cronogramas['max_itens']} "
+        f"— acertos: {metricas_cronogramas['acertos']} — faltas: {metricas_cronogramas['faltas']} "
+        f"— despejos: {metricas_cronogramas['despejos']}"
+    )
+    st.caption(f"Versão do schema: {versao_schema()} — armazenamento: {MODO_ARMAZENAMENTO}")
+
 # --------------------------------------------------------
 # CARREGA ESTADO ATUAL
 # --------------------------------------------------------
 
+verificar_alteracoes_externas()
+
+conflito = st.session_state.get("conflito")
+if conflito:
+    st.warning(
+        "⚠️ Outra sessão gravou alterações neste projeto que se sobrepõem às suas "
+        f"(seções: {', '.join(conflito['secoes'])}). Escolha como continuar."
+    )
+    cf1, cf2 = st.columns(2)
+    with cf1:
+        if st.button("🔄 Recarregar do banco (descartar minhas alterações)"):
+            carregar_estado(st.session_state.current_project_id)
+            st.rerun()
+    with cf2:
+        if st.button("⚠️ Sobrescrever com minhas alterações") and descarregar_gravacoes(
+            st.session_state.current_project_id
+        ):
+            salvar_secoes_projeto(st.session_state.current_project_id, conflito["pendentes"])
+            carregar_estado(st.session_state.current_project_id)
+            st.rerun()
+
 state = st.session_state.state
 
 tap = state.get("tap", {})
@@ -826,16 +2463,17 @@ lessons = state.get("lessons", [])
 close_data = state.get("close", {})
 action_plan = state.get("actionPlan", [])
 
-for idx, t in enumerate(eapTasks):
-    if "id" not in t:
-        t["id"] = int(datetime.now().timestamp() * 1000) + idx
+for itens_secao in (eapTasks, finances, kpis, risks, lessons, action_plan):
+    for idx, item in enumerate(itens_secao):
+        if "id" not in item:
+            item["id"] = int(datetime.now().timestamp() * 1000) + idx
 
 # --------------------------------------------------------
 # FUNÇÃO SALVAR
 # --------------------------------------------------------
 
-def salvar_estado():
-    st.session_state.state = {
+def estado_atual():
+    return {
         "tap": tap,
         "eapTasks": eapTasks,
         "finances": finances,
@@ -845,7 +2483,58 @@ def salvar_estado():
         "close": close_data,
         "actionPlan": action_plan,
     }
-    save_project_state(st.session_state.current_project_id, st.session_state.state)
+
+def salvar_estado(*secoes):
+    """
+    Persiste só as seções alteradas desde a última carga ou gravação:
+    as informadas em `secoes` e, entre tap e close, as que mudaram de
+    conteúdo. No modo normalizado as seções em lista já são gravadas
+    item a item e não entram aqui.
+    """
+    st.session_state.state = estado_atual()
+    alteradas = set(secoes)
+    hashes = st.session_state.get("hash_secoes", {})
+    novos_hashes = {}
+    for secao in SECOES_VERIFICADAS_POR_HASH:
+        h = hash_secao(st.session_state.state[secao])
+        if hashes.get(secao) != h:
+            alteradas.add(secao)
+            novos_hashes[secao] = h
+
+    gravar_secoes({secao: st.session_state.state[secao] for secao in alteradas})
+    st.session_state.hash_secoes.update(novos_hashes)
+
+def salvar_item(secao, item):
+    """
+    Persiste a inclusão ou edição de um item de uma seção em lista.
+    No modo normalizado vira um único INSERT/UPDATE na tabela da seção.
+    """
+    if not MODO_NORMALIZADO:
+        salvar_estado(secao)
+        return
+    st.session_state.state = estado_atual()
+    if GRAVACAO_ASSINCRONA:
+        enfileirar_gravacao(itens={(secao, item["id"]): item})
+        return
+    aplicar_gravacao(*salvar_item_projeto(
+        st.session_state.current_project_id, secao, item, st.session_state.get("versao_projeto")
+    ))
+
+def excluir_item(secao, item_id):
+    """
+    Persiste a exclusão de um item de uma seção em lista.
+    No modo normalizado vira um único DELETE na tabela da seção.
+    """
+    if not MODO_NORMALIZADO:
+        salvar_estado(secao)
+        return
+    st.session_state.state = estado_atual()
+    if GRAVACAO_ASSINCRONA:
+        enfileirar_gravacao(itens={(secao, item_id): None})
+        return
+    aplicar_gravacao(*excluir_item_projeto(
+        st.session_state.current_project_id, secao, item_id, st.session_state.get("versao_projeto")
+    ))
 
 # --------------------------------------------------------
 # TABS
@@ -863,6 +2552,7 @@ tabs = st.tabs(
         "✅ Encerramento",
         "📑 Relatórios HTML",
         "📌 Plano de Ação",
+        "🗂️ Portfólio",
     ]
 )
 
@@ -902,36 +2592,10 @@ with tabs[0]:
         st.write("**Patrocinador**")
         st.info(tap.get("patrocinador") or current_proj.get("patrocinador") or "Não informado", icon="💼")
 
-    atrasadas = 0
-    a_fazer = 0
-    if eapTasks:
-        a_fazer = sum(1 for t in eapTasks if t.get("status") != "concluido")
-        if tap.get("dataInicio"):
-            try:
-                tasks_cpm, _ = calcular_cpm(eapTasks)
-                data_inicio_dt = datetime.strptime(tap["dataInicio"], "%Y-%m-%d").date()
-                hoje = date.today()
-                for t in tasks_cpm:
-                    status_t = t.get("status", "nao-iniciado")
-                    if status_t != "concluido":
-                        ef_dia = t.get("ef", 0)
-                        fim_prev = data_inicio_dt + timedelta(days=ef_dia)
-                        if fim_prev < hoje:
-                            atrasadas += 1
-            except Exception:
-                pass
-
-    saldo_real = 0.0
-    if finances:
-        df_fin_home = pd.DataFrame(finances)
-        if "realizado" in df_fin_home.columns:
-            entradas_real = df_fin_home[
-                (df_fin_home["tipo"] == "Entrada") & (df_fin_home["realizado"])
-            ]["valor"].sum()
-            saidas_real = df_fin_home[
-                (df_fin_home["tipo"] == "Saída") & (df_fin_home["realizado"])
-            ]["valor"].sum()
-            saldo_real = entradas_real - saidas_real
+    metricas_home = metricas_projeto(estado_atual())
+    atrasadas = metricas_home["atividades_atrasadas"]
+    a_fazer = metricas_home["atividades_a_fazer"]
+    saldo_real = metricas_home["saldo_real"]
 
     st.markdown("#### Situação operacional e financeira")
     c_sit1, c_sit2, c_sit3 = st.columns(3)
@@ -1010,6 +2674,127 @@ with tabs[1]:
             height=90,
         )
 
+    with st.expander("📅 Calendário de trabalho", expanded=False):
+        st.caption(
+            "O cronograma (CPM) conta dias de trabalho: as datas de início e término das "
+            "atividades pulam os dias fora da semana de trabalho, os feriados e as folgas."
+        )
+        cal_atual = {**CALENDARIO_PADRAO, **(tap.get("calendario") or {})}
+        dias_trabalho = st.multiselect(
+            "Dias de trabalho",
+            list(DIAS_SEMANA),
+            default=[d for d, c in zip(DIAS_SEMANA, cal_atual["semana"]) if c == "1"],
+        )
+        cc1, cc2 = st.columns(2)
+        with cc1:
+            cal_nacionais = st.checkbox(
+                "Considerar feriados nacionais", value=bool(cal_atual["feriadosNacionais"])
+            )
+        with cc2:
+            cal_facultativos = st.checkbox(
+                "Parar nos pontos facultativos (Carnaval, Corpus Christi)",
+                value=bool(cal_atual["facultativos"]),
+            )
+        cc3, cc4 = st.columns(2)
+        with cc3:
+            cal_feriados, invalidas_feriados = _ler_datas_br(
+                st.text_area(
+                    "Feriados e folgas do projeto (dd/mm/aaaa, um por linha)",
+                    value="\n".join(_data_br(d) for d in cal_atual["feriados"]),
+                    height=110,
+                )
+            )
+        with cc4:
+            cal_extras, invalidas_extras = _ler_datas_br(
+                st.text_area(
+                    "Dias trabalhados extras (dd/mm/aaaa, um por linha)",
+                    value="\n".join(_data_br(d) for d in cal_atual["diasTrabalhados"]),
+                    height=110,
+                )
+            )
+
+        st.markdown("**Calendários e capacidade dos responsáveis**")
+        recursos_atuais = tap.get("calendariosRecursos") or {}
+        df_recursos = pd.DataFrame(
+            [
+                {
+                    "Responsável": nome,
+                    "Dias de trabalho": ", ".join(
+                        d for d, c in zip(DIAS_SEMANA, r.get("semana") or "") if c == "1"
+                    ),
+                    "Folgas (dd/mm/aaaa)": ", ".join(_data_br(d) for d in r.get("folgas") or []),
+                    "Capacidade (atividades/dia)": int(r.get("capacidade", 1)),
+                }
+                for nome, r in recursos_atuais.items()
+            ],
+            columns=["Responsável", "Dias de trabalho", "Folgas (dd/mm/aaaa)", "Capacidade (atividades/dia)"],
+        )
+        df_recursos_edit = st.data_editor(
+            df_recursos,
+            num_rows="dynamic",
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Dias de trabalho": st.column_config.TextColumn(
+                    help="Ex.: Seg, Ter, Qua. Vazio = dias de trabalho do projeto. As atividades do "
+                    "responsável duram esses dias, e as sucessoras esperam o término delas."
+                ),
+                "Capacidade (atividades/dia)": st.column_config.NumberColumn(
+                    min_value=0,
+                    step=1,
+                    default=1,
+                    help="Atividades que o responsável toca ao mesmo tempo no nivelamento "
+                    "de recursos da EAP. 0 = sem limite; quem não está na tabela tem capacidade 1.",
+                ),
+            },
+        )
+
+        invalidas = invalidas_feriados + invalidas_extras
+        recursos_novos = {}
+        for _, linha in df_recursos_edit.iterrows():
+            nome = str(linha.get("Responsável") or "").strip()
+            if not nome or nome == "nan":
+                continue
+            dias_txt = [d.strip().capitalize() for d in str(linha.get("Dias de trabalho") or "").split(",")]
+            dias_txt = [d for d in dias_txt if d and d != "Nan"]
+            semana_recurso = "".join("1" if d in dias_txt else "0" for d in DIAS_SEMANA)
+            folgas, invalidas_recurso = _ler_datas_br(str(linha.get("Folgas (dd/mm/aaaa)") or "").replace("nan", ""))
+            invalidas += invalidas_recurso
+            recurso = {"folgas": folgas}
+            capacidade = pd.to_numeric(linha.get("Capacidade (atividades/dia)"), errors="coerce")
+            if not pd.isna(capacidade) and int(capacidade) != 1:
+                recurso["capacidade"] = max(int(capacidade), 0)
+            if dias_txt:
+                if "1" in semana_recurso:
+                    recurso["semana"] = semana_recurso
+                else:
+                    invalidas.append(", ".join(dias_txt))
+            recursos_novos[nome] = recurso
+
+        if invalidas:
+            st.warning("Entradas ignoradas (datas ou dias inválidos): " + "; ".join(invalidas))
+        if not dias_trabalho:
+            st.warning("Selecione ao menos um dia de trabalho; mantido o calendário anterior.")
+        else:
+            cal_novo = {
+                "semana": "".join("1" if d in dias_trabalho else "0" for d in DIAS_SEMANA),
+                "feriadosNacionais": cal_nacionais,
+                "facultativos": cal_facultativos,
+                "feriados": cal_feriados,
+                "diasTrabalhados": cal_extras,
+            }
+            if cal_novo != cal_atual:
+                tap["calendario"] = cal_novo
+        if recursos_novos != recursos_atuais:
+            tap["calendariosRecursos"] = recursos_novos
+
+        calendario_tap, _ = calendarios_projeto(tap)
+        ano_atual = date.today().year
+        st.caption(
+            f"Dias de trabalho em {ano_atual}: "
+            f"{calendario_tap.dias_uteis(date(ano_atual, 1, 1), date(ano_atual, 12, 31))}"
+        )
+
     st.markdown("#### Requisitos e alterações de escopo")
 
     col_req, col_alt = st.columns([1, 1.2])
@@ -1080,7 +2865,7 @@ with tabs[1]:
             st.caption("Nenhuma alteração registrada.")
 
     if st.button("💾 Salvar TAP", type="primary"):
-        salvar_estado()
+        salvar_estado("tap")
         st.success("TAP salvo e persistido no banco.")
 
 # --------------------------------------------------------
@@ -1107,11 +2892,14 @@ with tabs[2]:
         col_pp, col_rel, col_stat = st.columns([2, 1, 1])
         with col_pp:
             predecessoras_str = st.text_input(
-                "Predecessoras (códigos separados por vírgula)", key="eap_pred"
+                "Predecessoras (códigos separados por vírgula)",
+                key="eap_pred",
+                help=AJUDA_PREDECESSORAS,
             )
         with col_rel:
             relacao = st.selectbox(
-                "Relação", ["FS", "FF", "SS", "SF"], index=0, key="eap_rel"
+                "Relação padrão", ["FS", "FF", "SS", "SF"], index=0, key="eap_rel",
+                help="Usada nas predecessoras informadas sem tipo.",
             )
         with col_stat:
             status = st.selectbox(
@@ -1121,42 +2909,108 @@ with tabs[2]:
                 key="eap_status",
             )
 
+        col_otim, col_pess, col_custo, _ = st.columns([1, 1, 1, 1])
+        with col_otim:
+            dur_otimista = st.number_input(
+                "Duração otimista (dias)", min_value=0, value=0, key="eap_dur_otim",
+                help=AJUDA_TRES_PONTOS,
+            )
+        with col_pess:
+            dur_pessimista = st.number_input(
+                "Duração pessimista (dias)", min_value=0, value=0, key="eap_dur_pess",
+                help=AJUDA_TRES_PONTOS,
+            )
+        with col_custo:
+            custo = st.number_input(
+                "Custo previsto (R$)", min_value=0.0, step=100.0, key="eap_custo",
+                help="Somado nos níveis superiores da EAP.",
+            )
+
         if st.button("Incluir atividade EAP", type="primary", key="eap_add_btn"):
+            erro_pontos = erro_tres_pontos(int(duracao), int(dur_otimista), int(dur_pessimista))
             if not codigo.strip() or not descricao.strip():
                 st.warning("Informe código e descrição.")
+            elif erro_pontos:
+                st.warning(erro_pontos)
             else:
                 preds = [x.strip() for x in predecessoras_str.split(",") if x.strip()]
-                eapTasks.append(
-                    {
-                        "id": int(datetime.now().timestamp() * 1000),
-                        "codigo": codigo.strip(),
-                        "descricao": descricao.strip(),
-                        "nivel": int(nivel),
-                        "predecessoras": preds,
-                        "responsavel": responsavel.strip(),
-                        "duracao": int(duracao),
-                        "relacao": relacao,
-                        "status": status,
-                    }
-                )
-                salvar_estado()
+                nova_tarefa = {
+                    "id": int(datetime.now().timestamp() * 1000),
+                    "codigo": codigo.strip(),
+                    "descricao": descricao.strip(),
+                    "nivel": int(nivel),
+                    "predecessoras": preds,
+                    "responsavel": responsavel.strip(),
+                    "duracao": int(duracao),
+                    "duracaoOtimista": int(dur_otimista) or None,
+                    "duracaoPessimista": int(dur_pessimista) or None,
+                    "custo": float(custo) or None,
+                    "relacao": relacao,
+                    "status": status,
+                }
+                eapTasks.append(nova_tarefa)
+                salvar_item("eapTasks", nova_tarefa)
                 st.success("Atividade adicionada.")
                 st.rerun()
 
     if eapTasks:
         st.markdown("#### Tabela de atividades da EAP")
-        df_eap = pd.DataFrame(eapTasks)
-        df_eap_sorted = df_eap.sort_values(by="codigo")
-        st.dataframe(df_eap_sorted.drop(columns=["id"]), use_container_width=True, height=260)
+        tasks_eap, arvore_eap, totais_eap = eap_hierarquica(eapTasks, tap)
+        codigos_resumo = list(dict.fromkeys(arvore_eap.codigos[pos] for pos in arvore_eap.resumos()))
+        recolhidos_validos = [c for c in st.session_state.get("eap_recolhidos", []) if c in codigos_resumo]
+        if recolhidos_validos != st.session_state.get("eap_recolhidos", recolhidos_validos):
+            st.session_state["eap_recolhidos"] = recolhidos_validos
+        recolhidos = st.multiselect(
+            "Recolher ramos da EAP",
+            codigos_resumo,
+            key="eap_recolhidos",
+            help="Os nós resumo mostram o total do ramo: início, término, duração, % concluído e custo.",
+        )
+        posicoes_recolhidas = {arvore_eap.posicao_de(c) for c in recolhidos}
+        linhas_eap = []
+        for pos in arvore_eap.visiveis(posicoes_recolhidas):
+            t = tasks_eap[arvore_eap.ordem[pos]]
+            marcador = ("▸ " if pos in posicoes_recolhidas else "▾ ") if arvore_eap.tem_filhos(pos) else ""
+            linhas_eap.append(
+                {
+                    "Código": "\u2003" * int(arvore_eap.profundidade[pos]) + marcador + str(t.get("codigo", "")),
+                    "Descrição": t.get("descricao", ""),
+                    "Responsável": t.get("responsavel", ""),
+                    "Status": t.get("status", ""),
+                    "Início": totais_eap.inicio[pos].astype(date) if totais_eap.inicio is not None else None,
+                    "Término": totais_eap.termino[pos].astype(date) if totais_eap.termino is not None else None,
+                    "Duração (dias)": int(totais_eap.duracao[pos]),
+                    "% concluído": float(totais_eap.percentual[pos]),
+                    "Custo previsto (R$)": float(totais_eap.custo[pos]),
+                    "Predecessoras": ", ".join(t.get("predecessoras") or []),
+                }
+            )
+        df_eap_arvore = pd.DataFrame(linhas_eap)
+        if not totais_eap.custo.any():
+            df_eap_arvore = df_eap_arvore.drop(columns=["Custo previsto (R$)"])
+        st.dataframe(
+            df_eap_arvore,
+            use_container_width=True,
+            height=260,
+            hide_index=True,
+            column_config={
+                "Início": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "Término": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                "% concluído": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.0f%%"),
+                "Custo previsto (R$)": st.column_config.NumberColumn(format="R$ %.2f"),
+            },
+        )
 
         idx_eap = st.selectbox(
             "Selecione a atividade para editar / excluir",
-            options=list(range(len(df_eap_sorted))),
-            format_func=lambda i: f"{df_eap_sorted.iloc[i]['codigo']} - {df_eap_sorted.iloc[i]['descricao'][:60]}",
+            options=list(range(len(arvore_eap))),
+            format_func=lambda pos: (
+                f"{arvore_eap.codigos[pos]} - {str(eapTasks[arvore_eap.ordem[pos]].get('descricao', ''))[:60]}"
+            ),
             key="eap_del_idx"
         )
 
-        id_sel = int(df_eap_sorted.iloc[idx_eap]["id"])
+        id_sel = eapTasks[arvore_eap.ordem[idx_eap]].get("id")
         tarefa_sel = next((t for t in eapTasks if t.get("id") == id_sel), None)
 
         # --------- EDIÇÃO DE ATIVIDADE DA EAP ---------
@@ -1201,7 +3055,8 @@ with tabs[2]:
                 preds_edit = st.text_input(
                     "Predecessoras (edição)",
                     value=preds_edit_str,
-                    key="eap_edit_pred"
+                    key="eap_edit_pred",
+                    help=AJUDA_PREDECESSORAS,
                 )
             with ce6:
                 relacao_opts = ["FS", "FF", "SS", "SF"]
@@ -1209,7 +3064,7 @@ with tabs[2]:
                 if relacao_val not in relacao_opts:
                     relacao_val = "FS"
                 relacao_edit = st.selectbox(
-                    "Relação (edição)",
+                    "Relação padrão (edição)",
                     relacao_opts,
                     index=relacao_opts.index(relacao_val),
                     key="eap_edit_rel"
@@ -1226,30 +3081,78 @@ with tabs[2]:
                     key="eap_edit_status"
                 )
 
+            ce8, ce9, ce10, _ = st.columns([1, 1, 1, 1])
+            with ce8:
+                otim_edit = st.number_input(
+                    "Duração otimista (dias) - edição",
+                    min_value=0,
+                    value=int(tarefa_sel.get("duracaoOtimista") or 0),
+                    key="eap_edit_dur_otim",
+                    help=AJUDA_TRES_PONTOS,
+                )
+            with ce9:
+                pess_edit = st.number_input(
+                    "Duração pessimista (dias) - edição",
+                    min_value=0,
+                    value=int(tarefa_sel.get("duracaoPessimista") or 0),
+                    key="eap_edit_dur_pess",
+                    help=AJUDA_TRES_PONTOS,
+                )
+            with ce10:
+                custo_edit = st.number_input(
+                    "Custo previsto (R$) - edição",
+                    min_value=0.0,
+                    step=100.0,
+                    value=float(tarefa_sel.get("custo") or 0),
+                    key="eap_edit_custo",
+                )
+
             if st.button("Salvar alterações da atividade", key="eap_edit_btn"):
-                tarefa_sel["codigo"] = codigo_edit.strip()
-                tarefa_sel["nivel"] = int(nivel_edit)
-                tarefa_sel["descricao"] = desc_edit.strip()
-                tarefa_sel["duracao"] = int(dur_edit)
-                tarefa_sel["responsavel"] = resp_edit.strip()
-                tarefa_sel["predecessoras"] = [
-                    x.strip() for x in preds_edit.split(",") if x.strip()
-                ]
-                tarefa_sel["relacao"] = relacao_edit
-                tarefa_sel["status"] = status_edit
-                salvar_estado()
-                st.success("Atividade atualizada.")
-                st.rerun()
+                erro_pontos = erro_tres_pontos(int(dur_edit), int(otim_edit), int(pess_edit))
+                if erro_pontos:
+                    st.warning(erro_pontos)
+                else:
+                    tarefa_sel["codigo"] = codigo_edit.strip()
+                    tarefa_sel["nivel"] = int(nivel_edit)
+                    tarefa_sel["descricao"] = desc_edit.strip()
+                    tarefa_sel["duracao"] = int(dur_edit)
+                    tarefa_sel["duracaoOtimista"] = int(otim_edit) or None
+                    tarefa_sel["duracaoPessimista"] = int(pess_edit) or None
+                    tarefa_sel["custo"] = float(custo_edit) or None
+                    tarefa_sel["responsavel"] = resp_edit.strip()
+                    tarefa_sel["predecessoras"] = [
+                        x.strip() for x in preds_edit.split(",") if x.strip()
+                    ]
+                    tarefa_sel["relacao"] = relacao_edit
+                    tarefa_sel["status"] = status_edit
+                    salvar_item("eapTasks", tarefa_sel)
+                    st.success("Atividade atualizada.")
+                    st.rerun()
 
         # --------- EXCLUSÃO ---------
         if st.button("Excluir atividade selecionada", key="eap_del_btn"):
             eapTasks[:] = [t for t in eapTasks if t.get("id") != id_sel]
-            salvar_estado()
+            excluir_item("eapTasks", id_sel)
             st.success("Atividade excluída.")
             st.rerun()
     else:
         st.info("Nenhuma atividade cadastrada na EAP ainda.")
 
+    if eapTasks:
+        problemas_rede = cronograma_projeto(eapTasks, tap.get("dataInicio")).problemas
+        avisos_rede = []
+        for ciclo in problemas_rede["ciclos"]:
+            avisos_rede.append(
+                "Ciclo de precedências entre " + " → ".join(ciclo)
+                + " (as ligações que fecham o ciclo foram ignoradas no CPM)."
+            )
+        for codigo_t, codigo_p in problemas_rede["ausentes"]:
+            avisos_rede.append(f"A atividade {codigo_t} cita a predecessora {codigo_p}, que não existe na EAP.")
+        for codigo_t in problemas_rede["duplicados"]:
+            avisos_rede.append(f"O código {codigo_t} é usado por mais de uma atividade.")
+        if avisos_rede:
+            st.warning("**Problemas na rede de precedências**\n\n" + "\n".join(f"- {a}" for a in avisos_rede))
+
     st.markdown("#### Curva S de trabalho (CPM / Gantt simplificado)")
     if eapTasks:
         if tap.get("dataInicio"):
@@ -1263,6 +3166,146 @@ with tabs[2]:
     else:
         st.caption("Cadastre atividades na EAP para gerar a Curva S.")
 
+    st.markdown("#### Nivelamento de recursos")
+    if eapTasks:
+        st.caption(
+            "Programa as atividades respeitando a capacidade diária de cada responsável "
+            "(Calendário de trabalho, no TAP): entre as atividades liberadas pelas "
+            "predecessoras, vai primeiro a de menor folga no CPM e, no empate, a de menor "
+            "início cedo (ES)."
+        )
+        if st.checkbox("Programar com a capacidade limitada dos responsáveis", key="eap_nivelar"):
+            tasks_cpm_niv, nivelamento = cronograma_nivelado(eapTasks, tap)
+            inicio_niv = _data_iso(tap.get("dataInicio"))
+            calendario_niv, _ = calendarios_projeto(tap)
+
+            def _data_niv(dias):
+                if not inicio_niv:
+                    return f"dia {dias}"
+                data = calendario_niv.terminos(inicio_niv, [0], [dias])[0]
+                return data.astype(date).strftime("%d/%m/%Y")
+
+            cn1, cn2, cn3 = st.columns(3)
+            cn1.metric("Término pelo CPM", _data_niv(nivelamento.projeto_fim_cpm))
+            cn2.metric(
+                "Término nivelado",
+                _data_niv(nivelamento.projeto_fim),
+                delta=f"{nivelamento.projeto_fim - nivelamento.projeto_fim_cpm} dias de trabalho",
+                delta_color="inverse",
+            )
+            cn3.metric("Atividades adiadas", nivelamento.atrasadas)
+
+            capacidades_niv = capacidades_recursos(tap)
+            nomes_niv, uso_cpm = histograma_recursos(tasks_cpm_niv)
+            if nomes_niv:
+                resumo_recursos = pd.DataFrame(
+                    {
+                        "Responsável": nomes_niv,
+                        "Capacidade": [str(capacidades_niv.get(n, 1) or "sem limite") for n in nomes_niv],
+                        "Pico no CPM": uso_cpm.max(axis=1, initial=0),
+                        "Dias acima da capacidade no CPM": [
+                            int((uso_cpm[k] > capacidades_niv.get(n, 1)).sum()) if capacidades_niv.get(n, 1) else 0
+                            for k, n in enumerate(nomes_niv)
+                        ],
+                    }
+                )
+                st.dataframe(resumo_recursos, use_container_width=True, hide_index=True)
+
+                resp_niv = st.selectbox("Responsável no histograma", nomes_niv, key="eap_nivelar_resp")
+                st.plotly_chart(
+                    gerar_histograma_recursos(
+                        tasks_cpm_niv,
+                        nivelamento,
+                        resp_niv,
+                        capacidades_niv.get(resp_niv, 1),
+                        inicio_niv,
+                        calendario_niv,
+                    ),
+                    use_container_width=True,
+                    key="eap_histograma_recursos",
+                )
+            else:
+                st.caption("Nenhuma atividade tem responsável definido.")
+
+            adiadas = [t for t in nivelamento.tarefas if t["es"] > t["esCpm"]]
+            if adiadas:
+                st.markdown("**Atividades adiadas pelo nivelamento**")
+                st.dataframe(
+                    pd.DataFrame(
+                        {
+                            "Código": [t.get("codigo", "") for t in adiadas],
+                            "Descrição": [t.get("descricao", "") for t in adiadas],
+                            "Responsável": [t.get("responsavel", "") for t in adiadas],
+                            "Folga no CPM": [t.get("slack", 0) for t in adiadas],
+                            "Início CPM (dia)": [t["esCpm"] for t in adiadas],
+                            "Início nivelado (dia)": [t["es"] for t in adiadas],
+                            "Adiamento (dias)": [t["es"] - t["esCpm"] for t in adiadas],
+                        }
+                    ).sort_values(["Adiamento (dias)", "Código"], ascending=[False, True]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+    else:
+        st.caption("Cadastre atividades na EAP para nivelar os recursos.")
+
+    st.markdown("#### Análise de risco do cronograma (Monte Carlo)")
+    if eapTasks and tap.get("dataInicio"):
+        st.caption(
+            "Sorteia as durações de cada atividade entre a otimista e a pessimista "
+            "(distribuição beta-PERT, com a duração como a mais provável) e recalcula o CPM "
+            "em cada iteração. Atividades sem as durações otimista/pessimista ficam fixas."
+        )
+        col_it, col_sim = st.columns([1, 3])
+        with col_it:
+            iteracoes_mc = st.selectbox(
+                "Iterações", [1000, 5000, 10000, 50000], index=2, key="mc_iteracoes"
+            )
+        chave_mc = chave_cronograma(eapTasks, tap["dataInicio"])
+        with col_sim:
+            st.write("")
+            if st.button("Simular cronograma", key="mc_simular"):
+                with st.spinner("Simulando..."):
+                    st.session_state["simulacao_cronograma"] = (
+                        chave_mc,
+                        simular_cronograma(eapTasks, iteracoes=int(iteracoes_mc)),
+                    )
+
+        simulacao_mc = st.session_state.get("simulacao_cronograma")
+        if simulacao_mc and simulacao_mc[0] == chave_mc:
+            resultado_mc = simulacao_mc[1]
+            calendario_mc, _ = calendarios_projeto(tap)
+
+            def _data_mc(dias):
+                data = datas_termino_simulacao([dias], tap["dataInicio"], calendario_mc)[0]
+                return data.astype(date).strftime("%d/%m/%Y")
+
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Término pelo CPM", _data_mc(resultado_mc.duracao_deterministica))
+            m2.metric("P50", _data_mc(resultado_mc.percentis[50]))
+            m3.metric("P80", _data_mc(resultado_mc.percentis[80]))
+            m4.metric("P90", _data_mc(resultado_mc.percentis[90]))
+
+            fig_dist_mc, fig_tornado_mc = gerar_graficos_simulacao(
+                resultado_mc, tap["dataInicio"], calendario_mc
+            )
+            st.plotly_chart(fig_dist_mc, use_container_width=True, key="mc_distribuicao")
+            st.plotly_chart(fig_tornado_mc, use_container_width=True, key="mc_tornado")
+
+            descricoes = {t.get("codigo"): t.get("descricao", "") for t in eapTasks}
+            df_criticidade = pd.DataFrame(
+                {
+                    "Código": resultado_mc.codigos,
+                    "Descrição": [descricoes.get(c, "") for c in resultado_mc.codigos],
+                    "Índice de criticidade (%)": np.round(resultado_mc.criticidade * 100, 1),
+                    "Correlação com o término": np.round(resultado_mc.sensibilidade, 3),
+                }
+            ).sort_values("Índice de criticidade (%)", ascending=False)
+            st.dataframe(df_criticidade.head(20), use_container_width=True, hide_index=True)
+        elif simulacao_mc:
+            st.caption("A EAP mudou desde a última simulação; simule novamente.")
+    else:
+        st.caption("Cadastre atividades na EAP e a data de início no TAP para simular o cronograma.")
+
 # --------------------------------------------------------
 # TAB 3 - FINANCEIRO / CURVA S
 # --------------------------------------------------------
@@ -1336,7 +3379,7 @@ with tabs[3]:
                         else "",
                     }
                     finances.append(lanc)
-                    salvar_estado()
+                    salvar_item("finances", lanc)
                     st.success("Lançamento adicionado.")
                     st.rerun()
 
@@ -1553,14 +3596,14 @@ with tabs[3]:
                             else ""
                         )
                         break
-                salvar_estado()
+                salvar_item("finances", lanc_sel)
                 st.success("Lançamento atualizado.")
                 st.rerun()
 
         # --------- EXCLUSÃO ---------
         if st.button("Excluir lançamento selecionado", key="fin_del_btn"):
             finances[:] = [l for l in finances if l["id"] != sel_id]
-            salvar_estado()
+            excluir_item("finances", sel_id)
             st.success("Lançamento excluído.")
             st.rerun()
 
@@ -1641,24 +3684,24 @@ with tabs[4]:
             if not nome_kpi.strip() or not unidade.strip():
                 st.warning("Informe nome e unidade do KPI.")
             else:
-                kpis.append(
-                    {
-                        "nome": nome_kpi.strip(),
-                        "unidade": unidade.strip(),
-                        "mesesProjeto": int(meses_proj),
-                        "mes": int(mes_ref),
-                        "previsto": float(prev),
-                        "realizado": float(real),
-                    }
-                )
-                salvar_estado()
+                novo_kpi = {
+                    "id": int(datetime.now().timestamp() * 1000),
+                    "nome": nome_kpi.strip(),
+                    "unidade": unidade.strip(),
+                    "mesesProjeto": int(meses_proj),
+                    "mes": int(mes_ref),
+                    "previsto": float(prev),
+                    "realizado": float(real),
+                }
+                kpis.append(novo_kpi)
+                salvar_item("kpis", novo_kpi)
                 st.success("Ponto de KPI registrado.")
                 st.rerun()
 
     if kpis:
         st.markdown("#### Tabela de KPIs")
         df_k = pd.DataFrame(kpis)
-        st.dataframe(df_k, use_container_width=True, height=260)
+        st.dataframe(df_k.drop(columns=["id"], errors="ignore"), use_container_width=True, height=260)
 
         idx_kpi = st.selectbox(
             "Selecione o ponto de KPI para editar / excluir",
@@ -1720,13 +3763,13 @@ with tabs[4]:
             k_sel["mes"] = int(mes_ref_edit)
             k_sel["previsto"] = float(prev_edit)
             k_sel["realizado"] = float(real_edit)
-            salvar_estado()
+            salvar_item("kpis", k_sel)
             st.success("KPI atualizado.")
             st.rerun()
 
         if st.button("Excluir ponto de KPI selecionado", key="kpi_del_btn"):
-            kpis.pop(idx_kpi)
-            salvar_estado()
+            kpi_removido = kpis.pop(idx_kpi)
+            excluir_item("kpis", kpi_removido["id"])
             st.success("Ponto de KPI excluído.")
             st.rerun()
 
@@ -1804,17 +3847,17 @@ with tabs[5]:
                 st.warning("Descreva o risco.")
             else:
                 indice = peso_impacto(impacto) * peso_prob(prob)
-                risks.append(
-                    {
-                        "descricao": desc_risk.strip(),
-                        "impacto": impacto,
-                        "prob": prob,
-                        "resposta": resposta,
-                        "plano": plano.strip(),
-                        "indice": indice,
-                    }
-                )
-                salvar_estado()
+                novo_risco = {
+                    "id": int(datetime.now().timestamp() * 1000),
+                    "descricao": desc_risk.strip(),
+                    "impacto": impacto,
+                    "prob": prob,
+                    "resposta": resposta,
+                    "plano": plano.strip(),
+                    "indice": indice,
+                }
+                risks.append(novo_risco)
+                salvar_item("risks", novo_risco)
                 st.success("Risco adicionado.")
                 st.rerun()
 
@@ -1892,13 +3935,13 @@ with tabs[5]:
             r_sel["resposta"] = resposta_edit
             r_sel["plano"] = plano_edit.strip()
             r_sel["indice"] = peso_impacto(impacto_edit) * peso_prob(prob_edit)
-            salvar_estado()
+            salvar_item("risks", r_sel)
             st.success("Risco atualizado.")
             st.rerun()
 
         if st.button("Excluir risco selecionado", key="risk_del_btn"):
-            risks.pop(idx_risk)
-            salvar_estado()
+            risco_removido = risks.pop(idx_risk)
+            excluir_item("risks", risco_removido["id"])
             st.success("Risco excluído.")
             st.rerun()
     else:
@@ -1935,22 +3978,22 @@ with tabs[6]:
             if not titulo_l.strip() or not desc_l.strip():
                 st.warning("Título e descrição são obrigatórios.")
             else:
-                lessons.append(
-                    {
-                        "titulo": titulo_l.strip(),
-                        "fase": fase_l,
-                        "categoria": categoria_l,
-                        "descricao": desc_l.strip(),
-                        "recomendacao": rec_l.strip(),
-                    }
-                )
-                salvar_estado()
+                nova_licao = {
+                    "id": int(datetime.now().timestamp() * 1000),
+                    "titulo": titulo_l.strip(),
+                    "fase": fase_l,
+                    "categoria": categoria_l,
+                    "descricao": desc_l.strip(),
+                    "recomendacao": rec_l.strip(),
+                }
+                lessons.append(nova_licao)
+                salvar_item("lessons", nova_licao)
                 st.success("Lição adicionada.")
                 st.rerun()
 
     if lessons:
         df_l = pd.DataFrame(lessons)
-        st.dataframe(df_l, use_container_width=True, height=260)
+        st.dataframe(df_l.drop(columns=["id"], errors="ignore"), use_container_width=True, height=260)
 
         idx_lesson = st.selectbox(
             "Selecione a lição para excluir",
@@ -1959,8 +4002,8 @@ with tabs[6]:
             key="lesson_del_idx"
         )
         if st.button("Excluir lição selecionada", key="lesson_del_btn"):
-            lessons.pop(idx_lesson)
-            salvar_estado()
+            licao_removida = lessons.pop(idx_lesson)
+            excluir_item("lessons", licao_removida["id"])
             st.success("Lição excluída.")
             st.rerun()
     else:
@@ -2009,7 +4052,7 @@ with tabs[7]:
         )
 
     if st.button("💾 Salvar encerramento", type="primary"):
-        salvar_estado()
+        salvar_estado("close")
         st.success("Dados de encerramento salvos.")
 
 # --------------------------------------------------------
@@ -2028,7 +4071,9 @@ with tabs[8]:
     df_fin = pd.DataFrame(finances) if finances else pd.DataFrame()
     df_r = pd.DataFrame(risks) if risks else pd.DataFrame()
     df_l = pd.DataFrame(lessons) if lessons else pd.DataFrame()
-    df_eap_rel = pd.DataFrame(eapTasks) if eapTasks else pd.DataFrame()
+    df_eap_rel = (
+        pd.DataFrame([eapTasks[i] for i in ArvoreEAP(eapTasks).ordem]) if eapTasks else pd.DataFrame()
+    )
 
     def montar_html_completo(html_corpo: str) -> str:
         return f"""
@@ -2412,23 +4457,23 @@ with tabs[9]:
                 risk_ref = None
                 if idx_risk_ref > 0:
                     risk_ref = risks[idx_risk_ref - 1]["descricao"]
-                action_plan.append(
-                    {
-                        "descricao": acao_desc.strip(),
-                        "responsavel": acao_resp.strip(),
-                        "status": acao_status,
-                        "prazo": acao_prazo.strftime("%Y-%m-%d"),
-                        "risco_relacionado": risk_ref,
-                    }
-                )
-                salvar_estado()
+                nova_acao = {
+                    "id": int(datetime.now().timestamp() * 1000),
+                    "descricao": acao_desc.strip(),
+                    "responsavel": acao_resp.strip(),
+                    "status": acao_status,
+                    "prazo": acao_prazo.strftime("%Y-%m-%d"),
+                    "risco_relacionado": risk_ref,
+                }
+                action_plan.append(nova_acao)
+                salvar_item("actionPlan", nova_acao)
                 st.success("Ação adicionada ao plano.")
                 st.rerun()
 
     if action_plan:
         df_ap = pd.DataFrame(action_plan)
         st.markdown("#### Ações cadastradas")
-        st.dataframe(df_ap, use_container_width=True, height=260)
+        st.dataframe(df_ap.drop(columns=["id"], errors="ignore"), use_container_width=True, height=260)
 
         idx_ap = st.selectbox(
             "Selecione a ação para excluir",
@@ -2437,9 +4482,69 @@ with tabs[9]:
             key="ap_del_idx"
         )
         if st.button("Excluir ação selecionada", key="ap_del_btn"):
-            action_plan.pop(idx_ap)
-            salvar_estado()
+            acao_removida = action_plan.pop(idx_ap)
+            excluir_item("actionPlan", acao_removida["id"])
             st.success("Ação excluída.")
             st.rerun()
     else:
         st.info("Nenhuma ação registrada no plano de ação.")
+
+# --------------------------------------------------------
+# TAB 10 - PORTFÓLIO
+# --------------------------------------------------------
+
+with tabs[10]:
+    st.markdown("### 🗂️ Portfólio de projetos")
+
+    pf1, pf2 = st.columns([3, 1])
+    with pf1:
+        incluir_encerrados = st.checkbox("Incluir projetos encerrados", key="pf_encerrados")
+    with pf2:
+        if st.button("🔄 Atualizar painel", key="pf_atualizar"):
+            painel_portfolio.clear()
+
+    painel = painel_portfolio(incluir_encerrados)
+
+    m1, m2, m3, m4, m5 = st.columns(5)
+    with m1:
+        st.metric("Projetos", painel["projetos"])
+    with m2:
+        st.metric("Saldo de caixa (real)", format_currency_br(painel["saldo_real"]))
+    with m3:
+        st.metric("Saldo previsto", format_currency_br(painel["saldo_previsto"]))
+    with m4:
+        st.metric("Atividades em atraso", painel["atrasadas"])
+    with m5:
+        st.metric("Ações abertas", painel["acoes_abertas"])
+
+    col_pf_l, col_pf_r = st.columns(2)
+    with col_pf_l:
+        st.markdown("#### Projetos com atividades em atraso")
+        if painel["em_atraso"]:
+            st.dataframe(pd.DataFrame(painel["em_atraso"]), use_container_width=True)
+        else:
+            st.caption("Nenhum projeto com atividades em atraso.")
+    with col_pf_r:
+        st.markdown("#### Maiores riscos")
+        if painel["riscos"]:
+            st.dataframe(pd.DataFrame(painel["riscos"]), use_container_width=True)
+        else:
+            st.caption("Nenhum risco registrado.")
+
+    st.markdown("#### Projetos com término previsto neste mês")
+    if painel["fim_no_mes"]:
+        st.dataframe(pd.DataFrame(painel["fim_no_mes"]), use_container_width=True)
+    else:
+        st.caption("Nenhum projeto com término previsto (CPM) neste mês.")
+
+# --------------------------------------------------------
+# BASE DAS GRAVAÇÕES PARCIAIS
+# --------------------------------------------------------
+
+# Os widgets do TAP e do encerramento completam campos ausentes com valores
+# padrão. Depois da primeira renderização de um estado vindo do banco, o hash
+# passa a refletir esse conteúdo, para que só edições reais contem como
+# alterações pendentes.
+if not st.session_state.get("conflito"):
+    for secao in st.session_state.pop("rebasear_hashes", set()):
+        st.session_state.hash_secoes[secao] = hash_secao(st.session_state.state.get(secao))
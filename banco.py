@@ -0,0 +1,1634 @@
+"""
+Infraestrutura de acesso ao PostgreSQL (Neon) usada pelo app.
+
+Este módulo não depende do Streamlit, para que possa ser reutilizado por
+scripts de linha de comando e benchmarks.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import Json, execute_values
+
+from compactacao import algoritmo_documento, codificar_documento, decodificar_documento
+
+# --------------------------------------------------------
+# POOL DE CONEXÕES
+# --------------------------------------------------------
+
+class PoolConexoes:
+    """
+    Pool de conexões thread-safe compartilhado por todas as sessões do processo.
+
+    - Quando todas as conexões estão emprestadas, a chamada espera (até
+      `timeout_espera` segundos) em vez de falhar.
+    - Conexões ociosas há mais de `max_ocioso` segundos são validadas com
+      um `SELECT 1` antes de serem entregues; conexões mortas são descartadas.
+    - O tempo de espera por uma conexão livre é medido e exposto em `metricas()`.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout_espera=30.0, max_ocioso=300.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Configuração de pool inválida: exige 0 <= min <= max e max >= 1.")
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._ultimo_uso = {}
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout_espera = timeout_espera
+        self.max_ocioso = max_ocioso
+        self._em_uso = 0
+        self._emprestimos = 0
+        self._esperas = 0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    def _conexao_saudavel(self, conn):
+        if conn.closed:
+            return False
+        ocioso = time.monotonic() - self._ultimo_uso.get(id(conn), 0.0)
+        if ocioso < self.max_ocioso:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _obter(self):
+        inicio = time.monotonic()
+        if not self._vagas.acquire(timeout=self.timeout_espera):
+            with self._lock:
+                self._timeouts += 1
+            raise pg_pool.PoolError(
+                f"Nenhuma conexão livre no pool após {self.timeout_espera:.0f}s."
+            )
+        espera = time.monotonic() - inicio
+
+        try:
+            # No máximo uma tentativa por vaga do pool: conexões velhas são
+            # descartadas e substituídas por novas.
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._conexao_saudavel(conn):
+                    break
+                self._pool.putconn(conn, close=True)
+                self._ultimo_uso.pop(id(conn), None)
+                with self._lock:
+                    self._descartadas += 1
+            else:
+                raise psycopg2.OperationalError("Não foi possível obter uma conexão válida do pool.")
+        except Exception:
+            self._vagas.release()
+            raise
+
+        with self._lock:
+            self._em_uso += 1
+            self._emprestimos += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+            if espera > 0.001:
+                self._esperas += 1
+        return conn
+
+    def _devolver(self, conn, erro=False):
+        descartar = conn.closed != 0
+        if not descartar:
+            try:
+                status = conn.get_transaction_status()
+                if erro or status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                descartar = True
+
+        if descartar:
+            self._ultimo_uso.pop(id(conn), None)
+            with self._lock:
+                self._descartadas += 1
+        else:
+            self._ultimo_uso[id(conn)] = time.monotonic()
+
+        try:
+            self._pool.putconn(conn, close=descartar)
+        finally:
+            with self._lock:
+                self._em_uso -= 1
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        """
+        Empresta uma conexão do pool e a devolve ao final do bloco `with`.
+        Transações não confirmadas são desfeitas na devolução.
+        """
+        conn = self._obter()
+        try:
+            yield conn
+        except Exception:
+            self._devolver(conn, erro=True)
+            raise
+        else:
+            self._devolver(conn)
+
+    def metricas(self):
+        """
+        Retorna um retrato das métricas do pool (tempos em milissegundos).
+        """
+        with self._lock:
+            media = self._espera_total / self._emprestimos if self._emprestimos else 0.0
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "em_uso": self._em_uso,
+                "emprestimos": self._emprestimos,
+                "esperas": self._esperas,
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+                "espera_media_ms": round(media * 1000, 3),
+                "espera_max_ms": round(self._espera_max * 1000, 3),
+            }
+
+    def fechar(self):
+        self._pool.closeall()
+
+# --------------------------------------------------------
+# CACHE DE DOCUMENTOS DE PROJETO
+# --------------------------------------------------------
+
+class CacheDocumentos:
+    """
+    Cache LRU de documentos de projeto compartilhado pelas sessões do processo.
+
+    - A chave é (id do projeto, versão): uma entrada só é devolvida para a
+      versão pedida, que o chamador obtém com uma consulta barata ao banco.
+      Só a versão mais recente de cada projeto é mantida.
+    - Os documentos ficam serializados (pickle); o limite `max_bytes` vale
+      sobre o tamanho serializado, e os menos usados saem primeiro.
+    - Cada leitura desserializa uma cópia própria, então edições feitas por
+      uma sessão nunca alteram o que está no cache nem o que outra sessão vê.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._acertos = 0
+        self._faltas = 0
+        self._despejos = 0
+
+    def obter(self, project_id, versao):
+        """
+        Retorna uma cópia do documento em cache na versão pedida, ou None.
+        """
+        with self._lock:
+            item = self._itens.get(project_id)
+            if item is None or item[0] != versao:
+                self._faltas += 1
+                return None
+            self._itens.move_to_end(project_id)
+            self._acertos += 1
+            dados = item[1]
+        return pickle.loads(dados)
+
+    def guardar(self, project_id, versao, documento):
+        """
+        Guarda o documento na versão informada, substituindo versões anteriores.
+        Documentos maiores que o limite inteiro do cache não são guardados.
+        """
+        dados = pickle.dumps(documento, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            atual = self._itens.get(project_id)
+            if atual is not None and atual[0] > versao:
+                return
+            self._remover(project_id)
+            if len(dados) > self.max_bytes:
+                return
+            self._itens[project_id] = (versao, dados)
+            self._bytes += len(dados)
+            while self._bytes > self.max_bytes:
+                antigo = next(iter(self._itens))
+                self._remover(antigo)
+                self._despejos += 1
+
+    def descartar(self, project_id):
+        with self._lock:
+            self._remover(project_id)
+
+    def _remover(self, project_id):
+        item = self._itens.pop(project_id, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "documentos": len(self._itens),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "acertos": self._acertos,
+                "faltas": self._faltas,
+                "despejos": self._despejos,
+            }
+
+# --------------------------------------------------------
+# FILA DE GRAVAÇÃO ASSÍNCRONA (WRITE-BEHIND)
+# --------------------------------------------------------
+
+# Erros em que vale tentar de novo: queda de conexão, servidor reiniciando,
+# Neon acordando o compute, pool sem conexão livre.
+ERROS_TRANSITORIOS = (psycopg2.OperationalError, psycopg2.InterfaceError, pg_pool.PoolError)
+
+
+class ConflitoEdicao(Exception):
+    """
+    Outra sessão gravou as mesmas seções depois da versão-base desta sessão.
+    Fica neste módulo (e não no app, que é reexecutado a cada rerun) para
+    que a exceção levantada na thread da fila seja reconhecida pela página.
+    """
+
+    def __init__(self, secoes):
+        super().__init__(f"Seções alteradas por outra sessão: {', '.join(sorted(secoes))}")
+        self.secoes = set(secoes)
+
+
+class FilaGravacao:
+    """
+    Fila de gravações de projetos processada por uma thread em segundo plano.
+
+    Os lotes são separados por projeto e por origem (a sessão que grava):
+    cada par tem no máximo um lote pendente. Novas gravações do mesmo par
+    são mescladas no lote ainda não enviado: a última versão de cada seção
+    e a última operação de cada item prevalecem, e o lote inteiro vira uma
+    única chamada a `executar(project_id, lote)`, onde lote é
+    {"secoes": {seção: valor}, "itens": {(seção, id): item ou None},
+    "versao_base": versão do projeto vista pela origem, "proprias": versões
+    já gravadas pela própria origem} (item None = exclusão). `executar`
+    retorna a versão gravada, que entra nas "proprias" dos lotes seguintes:
+    a versão-base da sessão só avança quando a fila esvazia, e sem isso as
+    gravações anteriores da própria sessão pareceriam de outra.
+
+    As operações precisam ser idempotentes, pois erros transitórios são
+    repetidos com espera exponencial (até `max_tentativas`); esgotadas as
+    tentativas, o lote volta para a fila e o erro fica no status. Outros
+    erros (conflito de edição, dados inválidos, projeto excluído...) não se
+    resolvem repetindo: o lote sai da fila e fica guardado como falha até
+    ser reenviado (`reenviar`) ou descartado (`descartar_falha`).
+    """
+
+    def __init__(self, executar, max_tentativas=5, espera_inicial=0.5, espera_max=30.0):
+        self._executar = executar
+        self.max_tentativas = max_tentativas
+        self.espera_inicial = espera_inicial
+        self.espera_max = espera_max
+        self._cond = threading.Condition()
+        self._pendentes = OrderedDict()
+        self._em_andamento = None
+        self._status = {}
+        self._falhas = {}
+        self._proprias = {}
+        self._thread = threading.Thread(target=self._trabalhar, name="fila-gravacao", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _mesclar(lote, novo):
+        """
+        Mescla `novo` sobre `lote` (os valores de `novo` prevalecem). A
+        versão-base fica a mais antiga: é a partir dela que as alterações
+        de outras sessões contam como conflito.
+        """
+        lote["secoes"].update(novo["secoes"])
+        lote["itens"].update(novo["itens"])
+        bases = [b for b in (lote["versao_base"], novo["versao_base"]) if b is not None]
+        lote["versao_base"] = min(bases, default=None)
+
+    def enfileirar(self, project_id, secoes=None, itens=None, versao_base=None, origem=None):
+        """
+        Agenda a gravação de seções e/ou itens de um projeto e retorna logo.
+        Os valores são copiados na chamada; edições posteriores feitas pela
+        sessão não alteram o que foi agendado. Com `versao_base`, as seções
+        que outra origem gravar depois dela fazem o lote falhar por conflito
+        (sem versão-base, a gravação é incondicional).
+        """
+        secoes, itens = pickle.loads(pickle.dumps((secoes, itens), protocol=pickle.HIGHEST_PROTOCOL))
+        chave = (project_id, origem)
+        with self._cond:
+            lote = self._pendentes.setdefault(
+                chave, {"secoes": {}, "itens": {}, "versao_base": versao_base}
+            )
+            self._mesclar(lote, {"secoes": secoes or {}, "itens": itens or {}, "versao_base": versao_base})
+            if versao_base is not None and chave in self._proprias and chave not in self._falhas:
+                # A origem já viu tudo até versao_base.
+                self._proprias[chave] = {v for v in self._proprias[chave] if v > versao_base}
+            self._status.setdefault(chave, {"erro": None, "gravado_em": None, "gravacoes": 0})
+            self._cond.notify_all()
+
+    def _proximo_lote(self):
+        with self._cond:
+            while not self._pendentes:
+                self._cond.wait()
+            chave, lote = self._pendentes.popitem(last=False)
+            lote["proprias"] = frozenset(self._proprias.get(chave, ()))
+            self._em_andamento = chave
+            return chave, lote
+
+    def _trabalhar(self):
+        while True:
+            chave, lote = self._proximo_lote()
+            espera = self.espera_inicial
+            erro = None
+            for tentativa in range(1, self.max_tentativas + 1):
+                try:
+                    versao = self._executar(chave[0], lote)
+                    erro = None
+                    break
+                except ERROS_TRANSITORIOS as e:
+                    erro = e
+                    if tentativa < self.max_tentativas:
+                        time.sleep(espera)
+                        espera = min(espera * 2, self.espera_max)
+                except Exception as e:
+                    # Erro permanente (conflito, dados inválidos, projeto
+                    # excluído...): repetir não adianta; o lote fica
+                    # guardado como falha.
+                    erro = e
+                    break
+
+            with self._cond:
+                status = self._status[chave]
+                if erro is None:
+                    status["gravado_em"] = time.time()
+                    status["gravacoes"] += 1
+                    if versao is not None:
+                        self._proprias.setdefault(chave, set()).add(versao)
+                    # O que acabou de ser gravado é mais novo que a falha:
+                    # reenviá-la não pode sobrescrever.
+                    falha = self._falhas.get(chave)
+                    if falha is not None:
+                        for secao in lote["secoes"]:
+                            falha["secoes"].pop(secao, None)
+                        for item in lote["itens"]:
+                            falha["itens"].pop(item, None)
+                        if not falha["secoes"] and not falha["itens"]:
+                            del self._falhas[chave]
+                    if chave not in self._falhas:
+                        status["erro"] = None
+                else:
+                    status["erro"] = f"{type(erro).__name__}: {erro}"
+                    if isinstance(erro, ERROS_TRANSITORIOS):
+                        # Devolve o lote por baixo do que chegou enquanto isso.
+                        novo = self._pendentes.pop(chave, None)
+                        if novo is not None:
+                            self._mesclar(lote, novo)
+                        self._pendentes[chave] = lote
+                    else:
+                        # Falha anterior ainda não reenviada fica por baixo.
+                        falha = self._falhas.get(chave)
+                        if falha is not None:
+                            self._mesclar(falha, lote)
+                            lote = falha
+                        lote["erro"] = erro
+                        self._falhas[chave] = lote
+                self._em_andamento = None
+                self._cond.notify_all()
+            if erro is not None and isinstance(erro, ERROS_TRANSITORIOS):
+                time.sleep(self.espera_max)
+
+    @staticmethod
+    def _do_projeto(chave, project_id):
+        return project_id is None or chave[0] == project_id
+
+    def _ocupada(self, project_id):
+        return any(self._do_projeto(c, project_id) for c in self._pendentes) or (
+            self._em_andamento is not None and self._do_projeto(self._em_andamento, project_id)
+        )
+
+    def pendente(self, project_id):
+        """
+        Indica se o projeto tem gravação (de qualquer origem) na fila ou em
+        andamento.
+        """
+        with self._cond:
+            return self._ocupada(project_id)
+
+    def status(self, project_id, origem=None):
+        """
+        Retorna {"pendente", "falha", "erro", "gravado_em", "gravacoes"} das
+        gravações da origem no projeto; "falha" indica um lote recusado com
+        erro permanente, aguardando `reenviar` ou `descartar_falha`.
+        """
+        chave = (project_id, origem)
+        with self._cond:
+            status = dict(self._status.get(chave, {"erro": None, "gravado_em": None, "gravacoes": 0}))
+            status["pendente"] = chave in self._pendentes or self._em_andamento == chave
+            status["falha"] = chave in self._falhas
+            return status
+
+    def falha(self, project_id, origem=None):
+        """
+        Erro que recusou o lote em falha da origem no projeto (None se não
+        há falha).
+        """
+        with self._cond:
+            lote = self._falhas.get((project_id, origem))
+            return lote["erro"] if lote is not None else None
+
+    def reenviar(self, project_id, origem=None):
+        """
+        Devolve à fila o lote que falhou, por baixo das gravações que
+        chegaram depois dele. Retorna False se não havia falha.
+        """
+        chave = (project_id, origem)
+        with self._cond:
+            lote = self._falhas.pop(chave, None)
+            if lote is None:
+                return False
+            del lote["erro"]
+            novo = self._pendentes.pop(chave, None)
+            if novo is not None:
+                self._mesclar(lote, novo)
+            self._pendentes[chave] = lote
+            self._cond.notify_all()
+            return True
+
+    def descartar_falha(self, project_id, origem=None):
+        """
+        Descarta o lote que falhou e o retorna (None se não havia falha);
+        as alterações dele só são gravadas se quem chama as reenfileirar.
+        """
+        chave = (project_id, origem)
+        with self._cond:
+            lote = self._falhas.pop(chave, None)
+            status = self._status.get(chave)
+            if status is not None and chave not in self._pendentes and self._em_andamento != chave:
+                status["erro"] = None
+            return lote
+
+    def descarregar(self, project_id=None, timeout=None):
+        """
+        Espera até que as gravações do projeto (ou de todos, sem project_id)
+        cheguem ao banco, de qualquer origem. Retorna False se o tempo limite
+        acabar antes, se a última tentativa terminou em erro ou se há lote
+        em falha.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._ocupada(project_id):
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+            return not any(self._do_projeto(c, project_id) for c in self._falhas) and all(
+                s["erro"] is None for c, s in self._status.items() if self._do_projeto(c, project_id)
+            )
+
+# --------------------------------------------------------
+# MIGRAÇÕES DE SCHEMA
+# --------------------------------------------------------
+
+# Texto pesquisável de um projeto na busca da barra lateral. A mesma
+# expressão é usada no índice trigram e na consulta, para que o índice valha.
+EXPR_BUSCA_PROJETOS = (
+    "lower(coalesce(nome, '') || ' ' || coalesce(gerente, '') || ' ' || coalesce(patrocinador, ''))"
+)
+
+
+def _indices_busca_projetos(cur):
+    """
+    Índices da busca paginada de projetos. O índice trigram (substring em
+    nome, gerente e patrocinador) depende da extensão pg_trgm; se ela não
+    puder ser criada (falta de permissão), a busca continua funcionando por
+    varredura na ordem da chave primária.
+    """
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_projects_status_id ON projects (status, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_projects_encerrado_id ON projects (id DESC) WHERE encerrado;
+        """
+    )
+    cur.execute("SAVEPOINT trgm;")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT trgm;")
+        return
+    cur.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_projects_busca_trgm
+            ON projects USING GIN (({EXPR_BUSCA_PROJETOS}) gin_trgm_ops);
+        """
+    )
+
+
+def _separar_listas_comprimidas(cur):
+    """
+    O bloco único projects.listas_comprimidas vira uma linha por seção em
+    project_lists, para que gravar uma seção não descomprima nem regrave as
+    outras. Cada seção é recodificada com o algoritmo do bloco original.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS project_lists (
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            secao TEXT NOT NULL,
+            dados BYTEA NOT NULL,
+            PRIMARY KEY (project_id, secao)
+        );
+        """
+    )
+    cur.execute("SELECT id FROM projects WHERE listas_comprimidas IS NOT NULL ORDER BY id;")
+    for (pid,) in cur.fetchall():
+        cur.execute("SELECT listas_comprimidas FROM projects WHERE id = %s;", (pid,))
+        bloco = cur.fetchone()[0]
+        gravar_listas_comprimidas(
+            cur, pid, decodificar_documento(bloco), algoritmo_documento(bloco)
+        )
+    cur.execute("ALTER TABLE projects DROP COLUMN IF EXISTS listas_comprimidas;")
+
+
+# Cada migração é (versão, descrição, sql). O "sql" pode ser um texto ou uma
+# função que recebe o cursor, para migrações de dados. Migrações já
+# publicadas nunca devem ser alteradas: mudanças novas entram no fim da lista.
+MIGRACOES = [
+    (
+        1,
+        "Cria a tabela de projetos",
+        """
+        CREATE TABLE IF NOT EXISTS projects (
+            id SERIAL PRIMARY KEY,
+            data TEXT,
+            nome TEXT,
+            status TEXT,
+            dataInicio TEXT,
+            gerente TEXT,
+            patrocinador TEXT,
+            encerrado BOOLEAN DEFAULT FALSE
+        );
+        """,
+    ),
+    (
+        2,
+        "Converte projects.data de TEXT para JSONB",
+        """
+        CREATE OR REPLACE FUNCTION pg_temp.bk_texto_para_jsonb(t TEXT) RETURNS JSONB AS $$
+        BEGIN
+            IF t IS NULL OR btrim(t) = '' THEN
+                RETURN NULL;
+            END IF;
+            RETURN t::jsonb;
+        EXCEPTION WHEN others THEN
+            -- Texto que não é JSON válido é preservado como string JSON;
+            -- o app já tratava esses registros como estado padrão.
+            RETURN to_jsonb(t);
+        END;
+        $$ LANGUAGE plpgsql;
+
+        ALTER TABLE projects
+            ALTER COLUMN data TYPE JSONB USING pg_temp.bk_texto_para_jsonb(data);
+        """,
+    ),
+    (
+        3,
+        "Índices JSONB para status do TAP, finanças e atividades da EAP",
+        """
+        CREATE INDEX IF NOT EXISTS idx_projects_tap_status
+            ON projects ((data -> 'tap' ->> 'status'));
+        CREATE INDEX IF NOT EXISTS idx_projects_finances
+            ON projects USING GIN ((data -> 'finances') jsonb_path_ops);
+        CREATE INDEX IF NOT EXISTS idx_projects_eap_tasks
+            ON projects USING GIN ((data -> 'eapTasks') jsonb_path_ops);
+        """,
+    ),
+    (
+        4,
+        "Tabelas por entidade para o modo de armazenamento normalizado",
+        """
+        ALTER TABLE projects
+            ADD COLUMN IF NOT EXISTS normalizado BOOLEAN NOT NULL DEFAULT FALSE;
+        """
+        + "".join(
+            f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            item_id BIGINT NOT NULL,
+            posicao INTEGER NOT NULL,
+            dados JSONB NOT NULL,
+            PRIMARY KEY (project_id, item_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_{tabela}_posicao ON {tabela} (project_id, posicao);
+        """
+            for tabela in ("eap_tasks", "finances", "kpis", "risks", "lessons", "action_items")
+        ),
+    ),
+    (
+        5,
+        "Versão do projeto e versão por seção para controle de concorrência",
+        """
+        ALTER TABLE projects
+            ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS versoes_secoes JSONB NOT NULL DEFAULT '{}'::jsonb;
+        """,
+    ),
+    (6, "Índices da busca paginada de projetos", _indices_busca_projetos),
+    (
+        7,
+        "Journal de alterações dos projetos",
+        """
+        CREATE TABLE IF NOT EXISTS project_events (
+            id BIGSERIAL PRIMARY KEY,
+            project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+            versao BIGINT NOT NULL,
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            autor TEXT,
+            tipo TEXT NOT NULL CHECK (tipo IN ('patch', 'snapshot')),
+            patch JSONB NOT NULL,
+            desfaz BIGINT
+        );
+        CREATE INDEX IF NOT EXISTS idx_project_events_versao
+            ON project_events (project_id, versao);
+        CREATE INDEX IF NOT EXISTS idx_project_events_snapshots
+            ON project_events (project_id, versao) WHERE tipo = 'snapshot';
+        """,
+    ),
+    (
+        8,
+        "Seções em lista comprimidas (bytea) para o modo comprimido",
+        """
+        ALTER TABLE projects
+            ADD COLUMN IF NOT EXISTS comprimido BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS listas_comprimidas BYTEA;
+        """,
+    ),
+    (
+        9,
+        "Resumo de portfólio por projeto (project_summary)",
+        """
+        CREATE TABLE IF NOT EXISTS project_summary (
+            project_id INTEGER PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+            versao BIGINT NOT NULL,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            atividades_total INTEGER NOT NULL DEFAULT 0,
+            atividades_por_status JSONB NOT NULL DEFAULT '{}'::jsonb,
+            atividades_a_fazer INTEGER NOT NULL DEFAULT 0,
+            fins_pendentes DATE[] NOT NULL DEFAULT '{}',
+            primeiro_fim_pendente DATE,
+            receita_prevista NUMERIC NOT NULL DEFAULT 0,
+            receita_realizada NUMERIC NOT NULL DEFAULT 0,
+            despesa_prevista NUMERIC NOT NULL DEFAULT 0,
+            despesa_realizada NUMERIC NOT NULL DEFAULT 0,
+            maior_indice_risco NUMERIC,
+            acoes_abertas INTEGER NOT NULL DEFAULT 0,
+            data_inicio DATE,
+            data_fim_cpm DATE
+        );
+        CREATE INDEX IF NOT EXISTS idx_project_summary_primeiro_fim
+            ON project_summary (primeiro_fim_pendente);
+        CREATE INDEX IF NOT EXISTS idx_project_summary_risco
+            ON project_summary (maior_indice_risco DESC NULLS LAST);
+        CREATE INDEX IF NOT EXISTS idx_project_summary_fim_cpm
+            ON project_summary (data_fim_cpm);
+        """,
+    ),
+    (
+        10,
+        "Descrição do maior risco no resumo de portfólio",
+        """
+        ALTER TABLE project_summary ADD COLUMN IF NOT EXISTS maior_risco TEXT;
+        -- Força o recálculo dos resumos existentes na inicialização do app.
+        UPDATE project_summary SET versao = -1;
+        """,
+    ),
+    (
+        11,
+        "Arquivo (camada fria) de projetos encerrados",
+        """
+        ALTER TABLE projects
+            ADD COLUMN IF NOT EXISTS arquivado BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS inativo_desde TIMESTAMPTZ;
+        UPDATE projects SET inativo_desde = now() WHERE encerrado AND inativo_desde IS NULL;
+        CREATE TABLE IF NOT EXISTS projects_archive (
+            project_id INTEGER PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+            versao BIGINT NOT NULL,
+            arquivado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            documento BYTEA NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_projects_quentes ON projects (id DESC) WHERE NOT arquivado;
+        CREATE INDEX IF NOT EXISTS idx_projects_a_arquivar
+            ON projects (inativo_desde) WHERE encerrado AND NOT arquivado;
+        """,
+    ),
+    (
+        12,
+        "Términos do resumo de portfólio em dias de trabalho (calendário do projeto)",
+        """
+        -- Força o recálculo dos resumos existentes na inicialização do app.
+        UPDATE project_summary SET versao = -1;
+        """,
+    ),
+    (
+        13,
+        "Remove os índices JSONB da migração 3 (consultas usam colunas e project_summary)",
+        """
+        -- O status do TAP é lido da coluna projects.status e as consultas de
+        -- finanças e atividades entre projetos usam project_summary: estes
+        -- índices só custavam espaço e escrita em cada gravação.
+        DROP INDEX IF EXISTS idx_projects_tap_status;
+        DROP INDEX IF EXISTS idx_projects_finances;
+        DROP INDEX IF EXISTS idx_projects_eap_tasks;
+        """,
+    ),
+    (
+        14,
+        "Modo comprimido: um bloco comprimido por seção em lista (project_lists)",
+        _separar_listas_comprimidas,
+    ),
+]
+
+# Chave do advisory lock que serializa migrações entre processos ("BKMIGRAR").
+CHAVE_LOCK_MIGRACOES = 0x424B4D4947524152
+
+
+def versao_schema(migracoes=MIGRACOES):
+    """
+    Versão de schema esperada pelo código.
+    """
+    return max((m[0] for m in migracoes), default=0)
+
+
+def aplicar_migracoes(conn, migracoes=MIGRACOES):
+    """
+    Aplica, em ordem, as migrações ainda não registradas em schema_migrations.
+
+    Um advisory lock de sessão garante que só um processo migre por vez;
+    quem chega depois espera e encontra as versões já aplicadas. Cada
+    migração roda na sua própria transação junto com o seu registro.
+    Retorna a lista de versões aplicadas nesta chamada.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s);", (CHAVE_LOCK_MIGRACOES,))
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT,
+                aplicada_em TIMESTAMPTZ DEFAULT now()
+            );
+            """
+        )
+        conn.commit()
+
+        cur.execute("SELECT versao FROM schema_migrations;")
+        aplicadas = {r[0] for r in cur.fetchall()}
+
+        novas = []
+        for versao, descricao, sql in sorted(migracoes, key=lambda m: m[0]):
+            if versao in aplicadas:
+                continue
+            try:
+                if callable(sql):
+                    sql(cur)
+                else:
+                    cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (versao, descricao) VALUES (%s, %s);",
+                    (versao, descricao),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            novas.append(versao)
+        return novas
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s);", (CHAVE_LOCK_MIGRACOES,))
+        conn.commit()
+        cur.close()
+
+# --------------------------------------------------------
+# ARMAZENAMENTO NORMALIZADO (TABELAS POR ENTIDADE)
+# --------------------------------------------------------
+
+# Seções em lista do estado do projeto -> tabela filha no modo normalizado.
+# As demais seções (tap, close) ficam no documento projects.data.
+TABELAS_SECOES = {
+    "eapTasks": "eap_tasks",
+    "finances": "finances",
+    "kpis": "kpis",
+    "risks": "risks",
+    "lessons": "lessons",
+    "actionPlan": "action_items",
+}
+
+MODOS_ARMAZENAMENTO = ("documento", "normalizado", "comprimido")
+
+
+def normalizar_projetos(cur, project_id=None):
+    """
+    Move as seções em lista de projects.data para as tabelas filhas e marca
+    os projetos como normalizados. Itens sem "id" numérico (ou com id
+    repetido no mesmo projeto) recebem um id negativo derivado da posição.
+    Sem project_id, converte todos os projetos ainda não normalizados.
+    """
+    filtro = "AND p.id = %s" if project_id is not None else ""
+    params = (project_id,) if project_id is not None else ()
+
+    for secao, tabela in TABELAS_SECOES.items():
+        cur.execute(
+            f"""
+            WITH itens AS (
+                SELECT p.id AS project_id, e.ord, e.item,
+                       CASE WHEN jsonb_typeof(e.item -> 'id') = 'number'
+                            THEN (e.item ->> 'id')::numeric::bigint END AS id_item
+                FROM projects p
+                CROSS JOIN LATERAL jsonb_array_elements(
+                    CASE WHEN jsonb_typeof(p.data -> '{secao}') = 'array'
+                         THEN p.data -> '{secao}' ELSE '[]'::jsonb END
+                ) WITH ORDINALITY AS e(item, ord)
+                WHERE NOT p.normalizado
+                  AND jsonb_typeof(p.data) = 'object'
+                  AND jsonb_typeof(e.item) = 'object'
+                  {filtro}
+            ), numerados AS (
+                SELECT *, row_number() OVER (
+                    PARTITION BY project_id, id_item ORDER BY ord
+                ) AS repeticao
+                FROM itens
+            )
+            INSERT INTO {tabela} (project_id, item_id, posicao, dados)
+            SELECT project_id,
+                   CASE WHEN id_item IS NOT NULL AND repeticao = 1 THEN id_item ELSE -ord END,
+                   ord,
+                   item - 'id'
+            FROM numerados;
+            """,
+            params,
+        )
+
+    remover = " - ".join(f"'{secao}'" for secao in TABELAS_SECOES)
+    cur.execute(
+        f"""
+        UPDATE projects p
+        SET data = CASE
+                WHEN jsonb_typeof(p.data) = 'object' THEN p.data - {remover}
+                WHEN p.data IS NULL THEN '{{}}'::jsonb
+                ELSE jsonb_build_object('_legado', p.data)
+            END,
+            normalizado = TRUE
+        WHERE NOT p.normalizado {filtro};
+        """,
+        params,
+    )
+
+
+def _sql_secoes_em_lista(alias):
+    """
+    Argumentos de jsonb_build_object com cada seção em lista do projeto
+    `alias`, remontada das tabelas filhas na ordem de "posicao".
+    """
+    return ",\n".join(
+        f"""'{secao}', COALESCE((
+                SELECT jsonb_agg(t.dados || jsonb_build_object('id', t.item_id) ORDER BY t.posicao)
+                FROM {tabela} t WHERE t.project_id = {alias}.id
+            ), '[]'::jsonb)"""
+        for secao, tabela in TABELAS_SECOES.items()
+    )
+
+
+def desnormalizar_projetos(cur, project_id=None):
+    """
+    Caminho inverso de normalizar_projetos: remonta as seções em lista dentro
+    de projects.data (na ordem de "posicao") e apaga as linhas filhas.
+    """
+    filtro = "AND p.id = %s" if project_id is not None else ""
+    params = (project_id,) if project_id is not None else ()
+
+    cur.execute(
+        f"""
+        UPDATE projects p
+        SET data = CASE WHEN jsonb_typeof(p.data) = 'object' THEN p.data ELSE '{{}}'::jsonb END
+                   || jsonb_build_object({_sql_secoes_em_lista('p')}),
+            normalizado = FALSE
+        WHERE p.normalizado {filtro};
+        """,
+        params,
+    )
+    for tabela in TABELAS_SECOES.values():
+        cur.execute(
+            f"""
+            DELETE FROM {tabela} t
+            USING projects p
+            WHERE t.project_id = p.id AND NOT p.normalizado {filtro};
+            """,
+            params,
+        )
+
+
+def ler_listas_comprimidas(cur, project_id, secoes=None):
+    """
+    Modo comprimido: decodifica as seções em lista do projeto (todas, ou só
+    as informadas). Seções nunca gravadas ficam de fora.
+    """
+    if secoes is None:
+        cur.execute("SELECT secao, dados FROM project_lists WHERE project_id = %s;", (project_id,))
+    else:
+        cur.execute(
+            "SELECT secao, dados FROM project_lists WHERE project_id = %s AND secao = ANY(%s);",
+            (project_id, list(secoes)),
+        )
+    return {secao: decodificar_documento(dados) for secao, dados in cur.fetchall()}
+
+
+def gravar_listas_comprimidas(cur, project_id, listas, algoritmo="zlib"):
+    """
+    Modo comprimido: grava as seções em lista informadas, cada uma no seu
+    bloco comprimido em project_lists; as outras seções não são lidas nem
+    regravadas.
+    """
+    if not listas:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO project_lists (project_id, secao, dados) VALUES %s
+        ON CONFLICT (project_id, secao) DO UPDATE SET dados = EXCLUDED.dados;
+        """,
+        [
+            (project_id, secao, psycopg2.Binary(codificar_documento(valor, algoritmo)))
+            for secao, valor in listas.items()
+        ],
+    )
+
+
+def comprimir_projetos(cur, project_id=None, algoritmo="zlib"):
+    """
+    Modo comprimido: tira as seções em lista de projects.data e as grava,
+    codificadas por compactacao.codificar_documento, em project_lists (um
+    bloco por seção). Só converte projetos no modo documento (nem
+    normalizados nem já comprimidos). A compressão é feita no Python, um
+    projeto por vez.
+    """
+    filtro = "AND id = %s" if project_id is not None else ""
+    params = (project_id,) if project_id is not None else ()
+    cur.execute(
+        f"SELECT id FROM projects WHERE NOT normalizado AND NOT comprimido {filtro} ORDER BY id;",
+        params,
+    )
+    for (pid,) in cur.fetchall():
+        cur.execute("SELECT data FROM projects WHERE id = %s FOR UPDATE;", (pid,))
+        data = cur.fetchone()[0]
+        if not isinstance(data, dict):
+            data = {} if data is None else {"_legado": data}
+        listas = {secao: data.pop(secao) for secao in TABELAS_SECOES if secao in data}
+        cur.execute(
+            "UPDATE projects SET data = %s, comprimido = TRUE WHERE id = %s;", (Json(data), pid)
+        )
+        gravar_listas_comprimidas(cur, pid, listas, algoritmo)
+
+
+def descomprimir_projetos(cur, project_id=None):
+    """
+    Caminho inverso de comprimir_projetos: devolve as seções em lista para
+    projects.data e apaga os blocos de project_lists.
+    """
+    filtro = "AND id = %s" if project_id is not None else ""
+    params = (project_id,) if project_id is not None else ()
+    cur.execute(f"SELECT id FROM projects WHERE comprimido {filtro} ORDER BY id;", params)
+    for (pid,) in cur.fetchall():
+        cur.execute("SELECT data FROM projects WHERE id = %s FOR UPDATE;", (pid,))
+        data = cur.fetchone()[0]
+        if not isinstance(data, dict):
+            data = {}
+        data.update(ler_listas_comprimidas(cur, pid))
+        cur.execute("DELETE FROM project_lists WHERE project_id = %s;", (pid,))
+        cur.execute(
+            "UPDATE projects SET data = %s, comprimido = FALSE WHERE id = %s;", (Json(data), pid)
+        )
+
+
+def ajustar_modo_projetos(cur, modo, project_id=None, algoritmo="zlib"):
+    """
+    Converte os projetos (todos, ou só um) para o modo de armazenamento
+    informado. Conversões entre normalizado e comprimido passam pelo modo
+    documento.
+    """
+    if modo not in MODOS_ARMAZENAMENTO:
+        raise ValueError(f"Modo de armazenamento desconhecido: {modo!r}")
+    if modo != "comprimido":
+        descomprimir_projetos(cur, project_id)
+    if modo != "normalizado":
+        desnormalizar_projetos(cur, project_id)
+    if modo == "normalizado":
+        normalizar_projetos(cur, project_id)
+    elif modo == "comprimido":
+        comprimir_projetos(cur, project_id, algoritmo)
+
+
+def ajustar_modo_armazenamento(conn, modo, algoritmo="zlib"):
+    """
+    Converte todos os projetos para o modo de armazenamento configurado
+    ("documento", "normalizado" ou "comprimido"). Roda sob o mesmo advisory
+    lock das migrações e numa única transação.
+    """
+    if modo not in MODOS_ARMAZENAMENTO:
+        raise ValueError(f"Modo de armazenamento desconhecido: {modo!r}")
+
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_xact_lock(%s);", (CHAVE_LOCK_MIGRACOES,))
+    try:
+        ajustar_modo_projetos(cur, modo, algoritmo=algoritmo)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+# --------------------------------------------------------
+# HISTÓRICO DE ALTERAÇÕES (JOURNAL)
+# --------------------------------------------------------
+
+# Cada gravação de projeto vira uma linha em project_events com o patch do
+# que mudou (tipo "patch"); de tempos em tempos grava-se o documento inteiro
+# (tipo "snapshot"). projects.data continua sendo o estado atual; o journal
+# serve para auditoria, para reconstruir o projeto em qualquer versão
+# (snapshot mais próximo + patches seguintes) e para desfazer alterações.
+#
+# Operações do patch:
+#   {"op": "set", "path": [seção] ou [seção, chave], "valor": v}
+#   {"op": "del", "path": [seção, chave]}
+#   {"op": "item", "secao": s, "id": id, "valor": {...}}   inclui/edita item
+#   {"op": "item_del", "secao": s, "id": id}               exclui item
+#   {"op": "ordem", "secao": s, "ids": [...]}              reordena a lista
+
+
+def _ids_itens(itens):
+    """
+    Ids dos itens de uma seção em lista, ou None se algum item não tem id
+    (ou se há ids repetidos) e a seção precisa ser gravada inteira.
+    """
+    if not isinstance(itens, list):
+        return None
+    ids = []
+    for item in itens:
+        if not isinstance(item, dict) or "id" not in item:
+            return None
+        ids.append(item["id"])
+    return ids if len(set(ids)) == len(ids) else None
+
+
+def _patch_lista(secao, antigos, novos):
+    ids_antigos = _ids_itens(antigos)
+    ids_novos = _ids_itens(novos)
+    if ids_antigos is None or ids_novos is None:
+        return [{"op": "set", "path": [secao], "valor": novos}]
+
+    ops = []
+    por_id = {item["id"]: item for item in antigos}
+    novos_ids = set(ids_novos)
+    restantes = [i for i in ids_antigos if i in novos_ids]
+    for i in ids_antigos:
+        if i not in novos_ids:
+            ops.append({"op": "item_del", "secao": secao, "id": i})
+    for item in novos:
+        if por_id.get(item["id"]) != item:
+            ops.append({"op": "item", "secao": secao, "id": item["id"],
+                        "valor": {k: v for k, v in item.items() if k != "id"}})
+            if item["id"] not in por_id:
+                restantes.append(item["id"])
+    if restantes != ids_novos:
+        ops.append({"op": "ordem", "secao": secao, "ids": ids_novos})
+    return ops
+
+
+def gerar_patch(antigos, novos):
+    """
+    Patch que leva as seções `antigos` às seções `novos` (dicts seção -> valor).
+    Seções em lista com ids são comparadas item a item; seções dict, chave a
+    chave; o resto é substituído inteiro.
+    """
+    ops = []
+    for secao, novo in novos.items():
+        antigo = antigos.get(secao)
+        if antigo == novo:
+            continue
+        if isinstance(antigo, list) and isinstance(novo, list):
+            ops.extend(_patch_lista(secao, antigo, novo))
+        elif isinstance(antigo, dict) and isinstance(novo, dict):
+            for chave in antigo:
+                if chave not in novo:
+                    ops.append({"op": "del", "path": [secao, chave]})
+            for chave, valor in novo.items():
+                if antigo.get(chave, object()) != valor:
+                    ops.append({"op": "set", "path": [secao, chave], "valor": valor})
+        else:
+            ops.append({"op": "set", "path": [secao], "valor": novo})
+    return ops
+
+
+def aplicar_patch(documento, patch):
+    """
+    Aplica um patch (gerado por gerar_patch ou pelas operações de item) ao
+    documento, alterando-o no lugar. Retorna o próprio documento.
+    """
+    for op in patch:
+        tipo = op["op"]
+        if tipo in ("set", "del"):
+            alvo = documento
+            *caminho, chave = op["path"]
+            for parte in caminho:
+                if not isinstance(alvo.get(parte), dict):
+                    alvo[parte] = {}
+                alvo = alvo[parte]
+            if tipo == "set":
+                alvo[chave] = op["valor"]
+            else:
+                alvo.pop(chave, None)
+            continue
+
+        itens = documento.get(op["secao"])
+        if not isinstance(itens, list):
+            itens = documento[op["secao"]] = []
+        if tipo == "item":
+            novo = {"id": op["id"], **op["valor"]}
+            for pos, item in enumerate(itens):
+                if isinstance(item, dict) and item.get("id") == op["id"]:
+                    itens[pos] = novo
+                    break
+            else:
+                itens.append(novo)
+        elif tipo == "item_del":
+            itens[:] = [i for i in itens if not (isinstance(i, dict) and i.get("id") == op["id"])]
+        elif tipo == "ordem":
+            por_id = {i.get("id"): i for i in itens if isinstance(i, dict)}
+            itens[:] = [por_id[i] for i in op["ids"] if i in por_id]
+    return documento
+
+
+def secoes_do_patch(patch):
+    """
+    Seções alteradas por um patch, na ordem em que aparecem.
+    """
+    secoes = []
+    for op in patch:
+        secao = op["path"][0] if "path" in op else op["secao"]
+        if secao not in secoes:
+            secoes.append(secao)
+    return secoes
+
+
+def resumir_patch(patch):
+    """
+    Descrição curta de um patch para exibição
+    (ex.: "tap: nome, status; risks: 2 gravado(s), 1 excluído(s)").
+    """
+    partes = {}
+    for op in patch:
+        if "path" in op:
+            secao = op["path"][0]
+            partes.setdefault(secao, [])
+            if len(op["path"]) > 1:
+                partes[secao].append(str(op["path"][1]))
+        else:
+            contagem = partes.setdefault(op["secao"], {"item": 0, "item_del": 0, "ordem": 0})
+            if isinstance(contagem, dict):
+                contagem[op["op"]] += 1
+    textos = []
+    for secao, info in partes.items():
+        if isinstance(info, dict):
+            detalhes = []
+            if info["item"]:
+                detalhes.append(f"{info['item']} gravado(s)")
+            if info["item_del"]:
+                detalhes.append(f"{info['item_del']} excluído(s)")
+            if info["ordem"]:
+                detalhes.append("reordenado")
+            textos.append(f"{secao}: {', '.join(detalhes)}")
+        else:
+            textos.append(f"{secao}: {', '.join(info)}" if info else secao)
+    return "; ".join(textos)
+
+
+def sql_documento_completo(alias="p"):
+    """
+    Expressão SQL do documento completo de um projeto (as seções em lista de
+    projetos normalizados são remontadas a partir das tabelas filhas).
+    """
+    return f"""
+        CASE WHEN {alias}.normalizado
+             THEN CASE WHEN jsonb_typeof({alias}.data) = 'object' THEN {alias}.data ELSE '{{}}'::jsonb END
+                  || jsonb_build_object({_sql_secoes_em_lista(alias)})
+             ELSE {alias}.data
+        END
+    """
+
+
+def ultimo_snapshot(cur, project_id):
+    """
+    Versão do snapshot mais recente do projeto (None se ainda não há).
+    """
+    cur.execute(
+        "SELECT max(versao) FROM project_events WHERE project_id = %s AND tipo = 'snapshot';",
+        (project_id,),
+    )
+    return cur.fetchone()[0]
+
+
+def documento_completo(cur, project_id):
+    """
+    Documento completo do projeto (qualquer modo de armazenamento, inclusive
+    arquivado) e a versão.
+    Retorna (documento, versão) ou (None, None) se o projeto não existe.
+    """
+    cur.execute(
+        f"""
+        SELECT {sql_documento_completo('p')}, p.comprimido, p.version, a.documento
+        FROM projects p
+        LEFT JOIN projects_archive a ON a.project_id = p.id AND p.arquivado
+        WHERE p.id = %s;
+        """,
+        (project_id,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None, None
+    documento, comprimido, versao, arquivo = row
+    if arquivo is not None:
+        return decodificar_documento(arquivo), versao
+    if comprimido:
+        documento = documento if isinstance(documento, dict) else {}
+        documento.update(ler_listas_comprimidas(cur, project_id))
+    return documento, versao
+
+
+def gravar_snapshot(cur, project_id, autor=None):
+    """
+    Registra o documento completo do projeto, na versão atual, no journal.
+    """
+    cur.execute(
+        f"""
+        INSERT INTO project_events (project_id, versao, autor, tipo, patch)
+        SELECT p.id, p.version, %s, 'snapshot', COALESCE({sql_documento_completo('p')}, '{{}}'::jsonb)
+        FROM projects p WHERE p.id = %s AND NOT p.comprimido AND NOT p.arquivado;
+        """,
+        (autor, project_id),
+    )
+    if cur.rowcount == 0:
+        # Projeto comprimido ou arquivado: só pode ser decodificado no Python.
+        documento, versao = documento_completo(cur, project_id)
+        if documento is not None:
+            cur.execute(
+                """
+                INSERT INTO project_events (project_id, versao, autor, tipo, patch)
+                VALUES (%s, %s, %s, 'snapshot', %s);
+                """,
+                (project_id, versao, autor, Json(documento)),
+            )
+
+
+def registrar_evento(cur, project_id, versao, patch, autor=None,
+                     intervalo_snapshot=50, retencao_dias=None, desfaz=None):
+    """
+    Registra no journal o patch que levou o projeto à `versao` (`desfaz` é a
+    versão anulada, quando o evento é um "desfazer") e faz a
+    compactação periódica: a cada `intervalo_snapshot` versões desde o último
+    snapshot grava um novo e, com `retencao_dias`, apaga os eventos mais
+    antigos que a janela, preservando o snapshot que serve de base a ela.
+    O snapshot-base do projeto (estado antes do primeiro patch) precisa ter
+    sido gravado antes da alteração, com garantir_snapshot_base().
+    """
+    cur.execute(
+        """
+        INSERT INTO project_events (project_id, versao, autor, tipo, patch, desfaz)
+        VALUES (%s, %s, %s, 'patch', %s, %s);
+        """,
+        (project_id, versao, autor, Json(patch), desfaz),
+    )
+    base = ultimo_snapshot(cur, project_id)
+    if intervalo_snapshot and (base is None or versao - base >= intervalo_snapshot):
+        gravar_snapshot(cur, project_id, autor)
+    if retencao_dias:
+        cur.execute(
+            """
+            DELETE FROM project_events e
+            WHERE e.project_id = %(id)s
+              AND e.versao < (
+                  SELECT max(s.versao) FROM project_events s
+                  WHERE s.project_id = %(id)s AND s.tipo = 'snapshot'
+                    AND s.criado_em < now() - make_interval(days => %(dias)s)
+              );
+            """,
+            {"id": project_id, "dias": int(retencao_dias)},
+        )
+
+
+def garantir_snapshot_base(cur, project_id, autor=None):
+    """
+    Grava o snapshot do estado atual se o projeto ainda não tem nenhum
+    (projetos anteriores ao journal). Deve rodar antes da alteração, na
+    mesma transação, com a linha do projeto travada.
+    """
+    if ultimo_snapshot(cur, project_id) is None:
+        gravar_snapshot(cur, project_id, autor)
+
+
+def reconstruir_estado(cur, project_id, versao=None, instante=None):
+    """
+    Reconstrói o documento do projeto numa versão (ou no último estado até
+    `instante`): parte do snapshot mais próximo anterior e aplica os patches
+    seguintes. Retorna (documento, versão) ou (None, None) se o journal não
+    cobre o ponto pedido.
+    """
+    filtros = ["project_id = %(id)s"]
+    if versao is not None:
+        filtros.append("versao <= %(versao)s")
+    if instante is not None:
+        filtros.append("criado_em <= %(instante)s")
+    where = " AND ".join(filtros)
+    params = {"id": project_id, "versao": versao, "instante": instante}
+
+    cur.execute(
+        f"""
+        SELECT versao, patch FROM project_events
+        WHERE {where} AND tipo = 'snapshot'
+        ORDER BY versao DESC, id DESC LIMIT 1;
+        """,
+        params,
+    )
+    snapshot = cur.fetchone()
+    if snapshot is None:
+        return None, None
+    versao_atual, documento = snapshot
+    cur.execute(
+        f"""
+        SELECT versao, patch FROM project_events
+        WHERE {where} AND tipo = 'patch' AND versao > %(base)s
+        ORDER BY versao, id;
+        """,
+        {**params, "base": versao_atual},
+    )
+    for versao_patch, patch in cur.fetchall():
+        aplicar_patch(documento, patch)
+        versao_atual = versao_patch
+    return documento, versao_atual
+
+
+def versao_a_desfazer(cur, project_id, limite=500):
+    """
+    Evento que um "desfazer" deve anular: o patch mais recente que não é
+    ele mesmo um desfazer nem já foi desfeito. Retorna (versão, patch) ou None.
+    """
+    cur.execute(
+        """
+        SELECT versao, patch, desfaz FROM project_events
+        WHERE project_id = %s AND tipo = 'patch'
+        ORDER BY versao DESC, id DESC
+        LIMIT %s;
+        """,
+        (project_id, limite),
+    )
+    desfeitas = set()
+    for versao, patch, desfaz in cur.fetchall():
+        if desfaz is not None:
+            desfeitas.add(desfaz)
+        elif versao not in desfeitas:
+            return versao, patch
+    return None
+
+
+def listar_eventos(cur, project_id, limite=50):
+    """
+    Eventos mais recentes do journal:
+    [(id, versão, data, autor, tipo, patch, versão desfeita)].
+    Snapshots vêm sem o documento.
+    """
+    cur.execute(
+        """
+        SELECT id, versao, criado_em, autor, tipo,
+               CASE WHEN tipo = 'patch' THEN patch ELSE '[]'::jsonb END, desfaz
+        FROM project_events
+        WHERE project_id = %s
+        ORDER BY versao DESC, id DESC
+        LIMIT %s;
+        """,
+        (project_id, limite),
+    )
+    return cur.fetchall()
+
+# --------------------------------------------------------
+# RESUMO DE PORTFÓLIO (project_summary)
+# --------------------------------------------------------
+
+# Uma linha por projeto com as métricas da Home já calculadas, mantida na
+# mesma transação de cada gravação. Um painel de portfólio lê todos os
+# projetos com uma consulta só, sem abrir os documentos. "versao" é a versão
+# do projeto em que o resumo foi calculado; linhas defasadas (gravações
+# feitas por versões antigas do app) são recalculadas na inicialização.
+#
+# A contagem de atrasadas depende do dia da consulta, por isso o resumo
+# guarda as datas de término previstas das atividades não concluídas
+# (fins_pendentes) e a contagem é feita no SQL (sql_atividades_atrasadas).
+
+CAMPOS_RESUMO = (
+    "atividades_total",
+    "atividades_por_status",
+    "atividades_a_fazer",
+    "fins_pendentes",
+    "receita_prevista",
+    "receita_realizada",
+    "despesa_prevista",
+    "despesa_realizada",
+    "maior_indice_risco",
+    "maior_risco",
+    "acoes_abertas",
+    "data_inicio",
+    "data_fim_cpm",
+)
+
+
+def sql_atividades_atrasadas(alias="s"):
+    """
+    Expressão SQL da quantidade de atividades atrasadas hoje de um resumo.
+    """
+    return f"(SELECT count(*) FROM unnest({alias}.fins_pendentes) f WHERE f < current_date)"
+
+
+def gravar_resumo(cur, project_id, versao, resumo, parcial=False):
+    """
+    Insere ou atualiza o resumo do projeto. `resumo` traz as chaves de
+    CAMPOS_RESUMO (as ausentes ficam com o padrão da tabela).
+
+    Com parcial=True, só as colunas presentes em `resumo` são atualizadas
+    (além da versão), num resumo que já existe; um resumo vazio só avança
+    a versão. Retorna False se o projeto ainda não tem resumo.
+    """
+    colunas = {
+        c: Json(resumo[c]) if c == "atividades_por_status" else resumo[c]
+        for c in CAMPOS_RESUMO
+        if c in resumo
+    }
+    if "fins_pendentes" in resumo or not parcial:
+        colunas["primeiro_fim_pendente"] = min(resumo.get("fins_pendentes") or [], default=None)
+    if parcial:
+        sets = ["versao = %s"]
+        if colunas:
+            sets.append("atualizado_em = now()")
+            sets.extend(f"{c} = %s" for c in colunas)
+        cur.execute(
+            f"UPDATE project_summary SET {', '.join(sets)} WHERE project_id = %s;",
+            (versao, *colunas.values(), project_id),
+        )
+        return cur.rowcount > 0
+    cur.execute(
+        f"""
+        INSERT INTO project_summary (project_id, versao, atualizado_em, {', '.join(colunas)})
+        VALUES (%s, %s, now(), {', '.join(['%s'] * len(colunas))})
+        ON CONFLICT (project_id) DO UPDATE
+        SET versao = EXCLUDED.versao,
+            atualizado_em = EXCLUDED.atualizado_em,
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in colunas)};
+        """,
+        (project_id, versao, *colunas.values()),
+    )
+    return True
+
+
+def projetos_com_resumo_defasado(cur):
+    """
+    IDs dos projetos sem resumo ou com resumo de uma versão anterior.
+    """
+    cur.execute(
+        """
+        SELECT p.id
+        FROM projects p
+        LEFT JOIN project_summary s ON s.project_id = p.id
+        WHERE s.project_id IS NULL OR s.versao <> p.version
+        ORDER BY p.id;
+        """
+    )
+    return [r[0] for r in cur.fetchall()]
+
+# --------------------------------------------------------
+# ARQUIVO DE PROJETOS ENCERRADOS (CAMADA FRIA)
+# --------------------------------------------------------
+
+# Projetos encerrados e inativos há mais que a retenção configurada têm o
+# documento completo movido, comprimido, para projects_archive. Em projects
+# fica só um esboço (colunas da listagem, versão, flags; data = NULL e sem
+# linhas filhas), para que listagens e buscas percorram pouco dado. O
+# documento volta para projects (desarquivar_projeto) quando o projeto é
+# aberto, gravado ou reaberto. A versão não muda em nenhum dos dois
+# sentidos: o conteúdo é o mesmo.
+
+
+def arquivar_projetos(conn, retencao_dias, algoritmo="lzma"):
+    """
+    Arquiva os projetos encerrados com inativo_desde anterior à retenção,
+    um por transação (linhas já travadas por outra sessão ficam para a
+    próxima passada). Retorna os ids arquivados.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT id FROM projects
+        WHERE encerrado AND NOT arquivado
+          AND inativo_desde < now() - make_interval(days => %s)
+        ORDER BY id;
+        """,
+        (int(retencao_dias),),
+    )
+    candidatos = [r[0] for r in cur.fetchall()]
+    arquivados = []
+    try:
+        for project_id in candidatos:
+            cur.execute(
+                """
+                SELECT 1 FROM projects
+                WHERE id = %s AND encerrado AND NOT arquivado
+                FOR UPDATE SKIP LOCKED;
+                """,
+                (project_id,),
+            )
+            if cur.fetchone() is None:
+                conn.rollback()
+                continue
+            documento, versao = documento_completo(cur, project_id)
+            cur.execute(
+                """
+                INSERT INTO projects_archive (project_id, versao, documento)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (project_id) DO UPDATE
+                SET versao = EXCLUDED.versao,
+                    arquivado_em = now(),
+                    documento = EXCLUDED.documento;
+                """,
+                (
+                    project_id,
+                    versao,
+                    psycopg2.Binary(codificar_documento(documento or {}, algoritmo)),
+                ),
+            )
+            for tabela in (*TABELAS_SECOES.values(), "project_lists"):
+                cur.execute(f"DELETE FROM {tabela} WHERE project_id = %s;", (project_id,))
+            cur.execute(
+                """
+                UPDATE projects
+                SET data = NULL, normalizado = FALSE, comprimido = FALSE, arquivado = TRUE
+                WHERE id = %s;
+                """,
+                (project_id,),
+            )
+            conn.commit()
+            arquivados.append(project_id)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return arquivados
+
+
+def desarquivar_projeto(cur, project_id, modo="documento", algoritmo="zlib"):
+    """
+    Devolve o documento arquivado para projects, no modo de armazenamento
+    informado. A linha do projeto deve estar travada. Retorna False se o
+    projeto não estava arquivado.
+    """
+    cur.execute(
+        """
+        SELECT a.documento FROM projects p
+        LEFT JOIN projects_archive a ON a.project_id = p.id
+        WHERE p.id = %s AND p.arquivado;
+        """,
+        (project_id,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return False
+    documento = decodificar_documento(row[0]) if row[0] is not None else {}
+    for tabela in (*TABELAS_SECOES.values(), "project_lists"):
+        cur.execute(f"DELETE FROM {tabela} WHERE project_id = %s;", (project_id,))
+    cur.execute(
+        """
+        UPDATE projects
+        SET data = %s, normalizado = FALSE, comprimido = FALSE, arquivado = FALSE,
+            inativo_desde = CASE WHEN encerrado THEN now() END
+        WHERE id = %s;
+        """,
+        (Json(documento), project_id),
+    )
+    cur.execute("DELETE FROM projects_archive WHERE project_id = %s;", (project_id,))
+    ajustar_modo_projetos(cur, modo, project_id, algoritmo)
+    return True
@@ -0,0 +1,142 @@
+"""
+Benchmark do formato comprimido de documentos (compactacao.py).
+
+Gera um projeto sintético grande (lançamentos financeiros e atividades da EAP)
+e compara, para cada formato, o tamanho em bytes que trafega até o banco e o
+tempo de codificação/decodificação em relação ao json.dumps simples.
+
+Uso:
+    python benchmarks/bench_compactacao.py [--financas N] [--atividades N] [--repeticoes N]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compactacao import codificar_documento, decodificar_documento  # noqa: E402
+
+CATEGORIAS = {
+    "Receita": ["Medição", "Aditivo", "Adiantamento"],
+    "Despesa": ["Material", "Mão de obra", "Equipamento", "Serviços de terceiros"],
+}
+
+
+def gerar_projeto(n_financas, n_atividades, semente=42):
+    rnd = random.Random(semente)
+    inicio = date(2025, 1, 6)
+
+    financas = []
+    for i in range(n_financas):
+        tipo = rnd.choice(list(CATEGORIAS))
+        prevista = inicio + timedelta(days=rnd.randint(0, 720))
+        realizado = rnd.random() < 0.6
+        financas.append(
+            {
+                "id": 1_700_000_000_000 + i,
+                "tipo": tipo,
+                "categoria": "Operacional" if tipo == "Despesa" else "Contrato",
+                "subcategoria": rnd.choice(CATEGORIAS[tipo]),
+                "descricao": f"{tipo} {i:05d}",
+                "valor": round(rnd.uniform(500, 80_000), 2),
+                "recorrencia": rnd.choice(["Nenhuma", "Mensal", "Quinzenal"]),
+                "qtdRecorrencias": rnd.randint(1, 12),
+                "dataPrevista": prevista.isoformat(),
+                "realizado": realizado,
+                "dataRealizada": (prevista + timedelta(days=rnd.randint(-5, 20))).isoformat()
+                if realizado
+                else "",
+            }
+        )
+
+    atividades = []
+    for i in range(n_atividades):
+        nivel = rnd.randint(1, 3)
+        codigo = ".".join(str(rnd.randint(1, 9)) for _ in range(nivel))
+        atividades.append(
+            {
+                "id": 1_710_000_000_000 + i,
+                "codigo": codigo,
+                "nome": f"Atividade {i:05d}",
+                "nivel": nivel,
+                "predecessoras": [] if i == 0 else [f"{rnd.randint(1, 9)}.{rnd.randint(1, 9)}"],
+                "responsavel": rnd.choice(["Ana", "Bruno", "Carla", "Diego"]),
+                "duracao": rnd.randint(1, 30),
+                "status": rnd.choice(["Não iniciada", "Em andamento", "Concluída"]),
+            }
+        )
+
+    return {
+        "tap": {"nome": "Projeto sintético", "gerente": "Ana", "objetivo": "Benchmark " * 20},
+        "eapTasks": atividades,
+        "finances": financas,
+        "kpis": [],
+        "risks": [],
+        "lessons": [],
+        "close": {},
+        "actionPlan": [],
+    }
+
+
+def _json_simples(doc):
+    return json.dumps(doc).encode("utf-8")
+
+
+def _json_compacto(doc):
+    return json.dumps(doc, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+FORMATOS = [
+    ("json.dumps", _json_simples, lambda b: json.loads(b)),
+    ("json compacto", _json_compacto, lambda b: json.loads(b)),
+    (
+        "json + zlib",
+        lambda d: zlib.compress(_json_compacto(d), 6),
+        lambda b: json.loads(zlib.decompress(b)),
+    ),
+    ("colunar + zlib", lambda d: codificar_documento(d, "zlib"), decodificar_documento),
+    ("colunar + lzma", lambda d: codificar_documento(d, "lzma"), decodificar_documento),
+]
+
+
+def _cronometrar(funcao, arg, repeticoes):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(arg)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--financas", type=int, default=3000)
+    parser.add_argument("--atividades", type=int, default=1500)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    doc = gerar_projeto(args.financas, args.atividades)
+    base = None
+    print(f"Projeto: {args.financas} lançamentos, {args.atividades} atividades")
+    print(f"{'formato':<16}{'bytes':>12}{'razão':>8}{'codifica (ms)':>16}{'decodifica (ms)':>18}")
+    for nome, codificar, decodificar in FORMATOS:
+        t_cod, dados = _cronometrar(codificar, doc, args.repeticoes)
+        t_dec, volta = _cronometrar(decodificar, dados, args.repeticoes)
+        if volta != doc:
+            raise AssertionError(f"{nome}: documento decodificado difere do original")
+        base = base or len(dados)
+        print(
+            f"{nome:<16}{len(dados):>12,}{len(dados) / base:>8.2f}"
+            f"{t_cod * 1000:>16.2f}{t_dec * 1000:>18.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark do motor de CPM (cronograma.py) contra a implementação anterior
+(laço de ponto fixo de até 1000 passadas sobre todas as atividades).
+
+Gera uma rede de precedências acíclica sintética (cada atividade depende de
+1 a 3 atividades anteriores, relação FS) e mede as duas implementações em
+dois cenários:
+- lista já em ordem topológica: os cálculos precisam coincidir, e o
+  benchmark confere ES/EF/LS/LF de todas as atividades;
+- lista embaralhada: a implementação anterior fixa as datas de cada
+  atividade na primeira passada, antes de as predecessoras estarem
+  calculadas; o benchmark conta as atividades com datas divergentes.
+
+No cálculo completo o motor novo não é mais rápido que o anterior: ele
+interpreta tipo e defasagem das ligações e monta o grafo com a detecção de
+ciclos, e fica entre o mesmo tempo e cerca de 25% mais lento que o laço
+anterior (ganho de 0,8x a 1x). O que muda é que as datas ficam certas com a
+lista fora de ordem e que a edição de uma atividade não recalcula a EAP
+inteira.
+
+Depois mede edições isoladas (duração ou predecessoras de uma atividade
+sorteada) no motor incremental contra o cálculo completo, conferindo que os
+resultados coincidem a cada edição.
+
+Uso:
+    python benchmarks/bench_cronograma.py [--atividades N ...] [--repeticoes N] [--edicoes N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cronograma import CronogramaIncremental, calcular_cronograma  # noqa: E402
+
+
+# Cópia da implementação anterior de app.calcular_cpm, mantida só para
+# comparação.
+def calcular_cpm_legado(tasks):
+    if not tasks:
+        return tasks, 0
+
+    tasks = [dict(t) for t in tasks]
+    mapa = {t["codigo"]: t for t in tasks}
+
+    for t in tasks:
+        t["es"] = 0
+        t["ef"] = 0
+        t["ls"] = 0
+        t["lf"] = 0
+        t["slack"] = 0
+
+    max_iter = 1000
+    for _ in range(max_iter):
+        atualizado = False
+        for t in tasks:
+            dur = int(t.get("duracao") or 0)
+            preds = t.get("predecessoras") or []
+            rel = t.get("relacao") or "FS"
+
+            if preds:
+                max_start = 0
+                todos_ok = True
+                for cod in preds:
+                    p = mapa.get(cod)
+                    if not p:
+                        todos_ok = False
+                        break
+                    if rel in ("FS", "FF"):
+                        cand = p.get("ef", 0)
+                    else:
+                        cand = p.get("es", 0)
+                    if cand > max_start:
+                        max_start = cand
+                if not todos_ok:
+                    continue
+                if t["ef"] == 0:
+                    t["es"] = max_start
+                    t["ef"] = t["es"] + dur
+                    atualizado = True
+            else:
+                if t["ef"] == 0:
+                    t["es"] = 0
+                    t["ef"] = dur
+                    atualizado = True
+        if not atualizado:
+            break
+
+    projeto_fim = max((t["ef"] for t in tasks), default=0)
+
+    succ_map = {t["codigo"]: [] for t in tasks}
+    for t in tasks:
+        for cod_p in (t.get("predecessoras") or []):
+            if cod_p in succ_map:
+                succ_map[cod_p].append(t["codigo"])
+
+    ordem = sorted(tasks, key=lambda x: x["es"], reverse=True)
+    for t in ordem:
+        cod = t["codigo"]
+        dur = int(t.get("duracao") or 0)
+        succs = succ_map.get(cod) or []
+        if not succs:
+            t["lf"] = projeto_fim
+            t["ls"] = projeto_fim - dur
+        else:
+            min_ls = None
+            for scod in succs:
+                s = mapa[scod]
+                if s["lf"] == 0:
+                    s["lf"] = s["ef"]
+                    s["ls"] = s["lf"] - int(s.get("duracao") or 0)
+                if (min_ls is None) or (s["ls"] < min_ls):
+                    min_ls = s["ls"]
+            if min_ls is None:
+                min_ls = projeto_fim - dur
+            t["lf"] = min_ls
+            t["ls"] = t["lf"] - dur
+
+        t["slack"] = t["ls"] - t["es"]
+
+    return tasks, projeto_fim
+
+
+def gerar_rede(n, embaralhar=False, semente=42):
+    rnd = random.Random(semente)
+    tarefas = []
+    for i in range(n):
+        preds = sorted({str(rnd.randrange(i)) for _ in range(rnd.randint(1, 3))}) if i else []
+        tarefas.append(
+            {
+                "codigo": str(i),
+                "descricao": f"Atividade {i}",
+                "duracao": rnd.randint(1, 20),
+                "predecessoras": preds,
+                "relacao": "FS",
+            }
+        )
+    if embaralhar:
+        rnd.shuffle(tarefas)
+    return tarefas
+
+
+def _cronometrar(funcao, arg, repeticoes):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(arg)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, resultado
+
+
+def medir_edicoes(tarefas, edicoes, semente=7):
+    """
+    Tempo médio (s) por edição no motor incremental e no cálculo completo.
+    """
+    rnd = random.Random(semente)
+    tarefas = list(tarefas)
+    motor = CronogramaIncremental()
+    motor.calcular(tarefas)
+    t_inc = t_completo = 0.0
+    for _ in range(edicoes):
+        i = rnd.randrange(len(tarefas))
+        tarefa = dict(tarefas[i])
+        if rnd.random() < 0.5 or i == 0:
+            tarefa["duracao"] = rnd.randint(1, 20)
+        else:
+            tarefa["predecessoras"] = sorted(
+                {str(rnd.randrange(max(0, i - 50), i)) for _ in range(rnd.randint(1, 3))}
+            )
+        tarefas[i] = tarefa
+
+        t0 = time.perf_counter()
+        res_inc, fim_inc, _ = motor.calcular(tarefas)
+        t_inc += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        res_completo, fim_completo, _ = calcular_cronograma(tarefas)
+        t_completo += time.perf_counter() - t0
+        if fim_inc != fim_completo or res_inc != res_completo:
+            raise AssertionError("Motor incremental divergiu do cálculo completo")
+    return t_inc / edicoes, t_completo / edicoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--atividades", type=int, nargs="+", default=[1000, 5000, 10000, 20000])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--edicoes", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{'lista':<12}{'atividades':>10}{'ligações':>10}{'anterior (ms)':>15}"
+        f"{'topológico (ms)':>17}{'ganho':>8}{'divergentes':>13}"
+    )
+    for embaralhar in (False, True):
+        for n in args.atividades:
+            tarefas = gerar_rede(n, embaralhar)
+            ligacoes = sum(len(t["predecessoras"]) for t in tarefas)
+            t_leg, (res_leg, fim_leg) = _cronometrar(calcular_cpm_legado, tarefas, args.repeticoes)
+            t_novo, (res_novo, fim_novo, problemas) = _cronometrar(
+                calcular_cronograma, tarefas, args.repeticoes
+            )
+            if any(problemas.values()):
+                raise AssertionError(f"Rede sintética com problemas: {problemas}")
+
+            divergentes = sum(
+                1 for a, b in zip(res_leg, res_novo)
+                if any(a[k] != b[k] for k in ("es", "ef", "ls", "lf"))
+            )
+            if not embaralhar and (divergentes or fim_leg != fim_novo):
+                raise AssertionError(f"{divergentes} atividade(s) com datas diferentes na lista ordenada")
+
+            print(
+                f"{'embaralhada' if embaralhar else 'ordenada':<12}{n:>10}{ligacoes:>10}"
+                f"{t_leg * 1000:>15.1f}{t_novo * 1000:>17.1f}{t_leg / t_novo:>7.2f}x{divergentes:>13}"
+            )
+
+    print()
+    print(f"{'edição isolada':<16}{'atividades':>10}{'completo (ms)':>15}{'incremental (ms)':>18}{'ganho':>8}")
+    for n in args.atividades:
+        t_inc, t_completo = medir_edicoes(gerar_rede(n), args.edicoes)
+        print(
+            f"{'':<16}{n:>10}{t_completo * 1000:>15.2f}{t_inc * 1000:>18.2f}"
+            f"{t_completo / t_inc:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark da curva S de trabalho: laço anterior (dias x atividades em
+Python) contra cronograma.curva_s_trabalho (vetor de diferenças e somas
+acumuladas com NumPy).
+
+Gera cronogramas sintéticos com atividades espalhadas pelo prazo, calcula
+ES/EF pelo motor de CPM e confere, para cada tamanho, que as duas curvas
+coincidem (diferença máxima abaixo de 1e-9 ponto percentual: a versão
+anterior acumula frações em ponto flutuante, a nova conta em inteiros).
+
+Uso:
+    python benchmarks/bench_curva_s.py [--atividades N ...] [--dias N] [--repeticoes N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from cronograma import calcular_cronograma, curva_s_trabalho  # noqa: E402
+
+
+# Cópia do laço anterior de app.gerar_curva_s_trabalho, mantida só para
+# comparação.
+def curva_s_legado(tasks_cpm, total_dias):
+    soma_duracoes = sum(int(t.get("duracao") or 0) for t in tasks_cpm)
+    dias = list(range(0, total_dias + 1))
+    progresso = []
+
+    for d in dias:
+        acum = 0
+        for t in tasks_cpm:
+            dur = int(t.get("duracao") or 0)
+            es = t.get("es", 0)
+            peso = dur / soma_duracoes if soma_duracoes > 0 else 0
+            if d <= es:
+                frac = 0
+            elif d >= es + dur:
+                frac = 1
+            else:
+                frac = (d - es) / dur
+            acum += peso * frac
+        progresso.append(acum * 100.0)
+    return progresso
+
+
+def gerar_cronograma(n, dias, semente=42):
+    """
+    Atividades em cadeias curtas (relação FS com defasagem) que, juntas,
+    ocupam aproximadamente `dias` dias.
+    """
+    rnd = random.Random(semente)
+    tarefas = []
+    for i in range(n):
+        tarefa = {"codigo": str(i), "duracao": rnd.randint(1, 30), "predecessoras": []}
+        if i and rnd.random() < 0.7:
+            tarefa["predecessoras"] = [f"{rnd.randrange(max(0, i - 10), i)}FS+{rnd.randint(0, 5)}"]
+        else:
+            tarefa["predecessoras"] = [f"0SS+{rnd.randrange(dias)}"] if i else []
+        tarefas.append(tarefa)
+    return calcular_cronograma(tarefas)
+
+
+def _cronometrar(funcao, args, repeticoes):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(*args)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--atividades", type=int, nargs="+", default=[300, 1000, 3000])
+    parser.add_argument("--dias", type=int, default=730)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'atividades':>10}{'dias':>8}{'anterior (ms)':>15}{'numpy (ms)':>12}"
+        f"{'ganho':>9}{'dif. máxima':>14}"
+    )
+    for n in args.atividades:
+        tarefas, fim, _ = gerar_cronograma(n, args.dias)
+        t_leg, leg = _cronometrar(curva_s_legado, (tarefas, fim), 1)
+        t_np, novo = _cronometrar(curva_s_trabalho, (tarefas, fim), args.repeticoes)
+        diferenca = float(np.max(np.abs(np.asarray(leg) - novo)))
+        if len(leg) != len(novo) or diferenca > 1e-9:
+            raise AssertionError(f"Curvas diferentes para {n} atividades: {diferenca}")
+        print(
+            f"{n:>10}{fim + 1:>8}{t_leg * 1000:>15.1f}{t_np * 1000:>12.2f}"
+            f"{t_leg / t_np:>8.0f}x{diferenca:>14.1e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
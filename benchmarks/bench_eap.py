@@ -0,0 +1,118 @@
+"""
+Benchmark da árvore da EAP: totais dos nós resumo por varredura ingênua
+(para cada nó, percorre todas as atividades procurando os descendentes pelo
+prefixo do código) contra eap.ArvoreEAP (montagem única e passada em
+pós-ordem por níveis com NumPy), e o custo de recolher ramos.
+
+Gera EAPs sintéticas com `--ramos` filhos por nó e confere, para cada
+tamanho, que os dois cálculos dão os mesmos totais.
+
+Uso:
+    python benchmarks/bench_eap.py [--profundidade N ...] [--ramos N] [--repeticoes N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from eap import PERCENTUAL_STATUS, ArvoreEAP, chave_natural  # noqa: E402
+
+STATUS = tuple(PERCENTUAL_STATUS)
+
+
+def gerar_eap(profundidade, ramos, semente=42):
+    """
+    EAP completa com `ramos` filhos por nó até `profundidade` níveis, em
+    ordem embaralhada, com es/ef, status e custo aleatórios.
+    """
+    rnd = random.Random(semente)
+    tarefas = []
+    nivel = [""]
+    for _ in range(profundidade):
+        proximo = []
+        for pai in nivel:
+            for k in range(1, ramos + 1):
+                codigo = f"{pai}.{k}" if pai else str(k)
+                es = rnd.randrange(500)
+                duracao = rnd.randint(1, 30)
+                tarefas.append(
+                    {
+                        "codigo": codigo,
+                        "es": es,
+                        "ef": es + duracao,
+                        "duracao": duracao,
+                        "status": rnd.choice(STATUS),
+                        "custo": rnd.randint(0, 10_000),
+                    }
+                )
+                proximo.append(codigo)
+        nivel = proximo
+    rnd.shuffle(tarefas)
+    return tarefas
+
+
+def totais_ingenuos(tarefas):
+    """Totais por varredura: O(n) por nó, O(n²) no total."""
+    ordem = sorted(range(len(tarefas)), key=lambda i: chave_natural(tarefas[i]["codigo"]))
+    linhas = []
+    for i in ordem:
+        prefixo = tarefas[i]["codigo"] + "."
+        ramo = [t for t in tarefas if t is tarefas[i] or t["codigo"].startswith(prefixo)]
+        trabalho = sum(t["duracao"] for t in ramo)
+        feito = sum(t["duracao"] * PERCENTUAL_STATUS[t["status"]] for t in ramo)
+        es = min(t["es"] for t in ramo)
+        ef = max(t["ef"] for t in ramo)
+        linhas.append((es, ef, feito / trabalho, sum(t["custo"] for t in ramo)))
+    return np.array(linhas, dtype=float)
+
+
+def totais_arvore(tarefas):
+    totais = ArvoreEAP(tarefas).totalizar(tarefas)
+    return np.column_stack([totais.es, totais.ef, totais.percentual, totais.custo]).astype(float)
+
+
+def _cronometrar(funcao, args, repeticoes):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(*args)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profundidade", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--ramos", type=int, default=10)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'atividades':>10}{'ingênuo (ms)':>14}{'árvore (ms)':>13}{'ganho':>9}"
+        f"{'recolher (ms)':>15}"
+    )
+    for profundidade in args.profundidade:
+        tarefas = gerar_eap(profundidade, args.ramos)
+        t_ing, ingenuo = _cronometrar(totais_ingenuos, (tarefas,), 1)
+        t_arv, arvore = _cronometrar(totais_arvore, (tarefas,), args.repeticoes)
+        if not np.allclose(ingenuo, arvore):
+            raise AssertionError(f"Totais diferentes para {len(tarefas)} atividades")
+
+        indice = ArvoreEAP(tarefas)
+        recolhidos = indice.resumos()[:: max(1, args.ramos // 2)]
+        t_rec, _ = _cronometrar(indice.visiveis, (recolhidos,), args.repeticoes)
+        print(
+            f"{len(tarefas):>10}{t_ing * 1000:>14.1f}{t_arv * 1000:>13.1f}"
+            f"{t_ing / t_arv:>8.0f}x{t_rec * 1000:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
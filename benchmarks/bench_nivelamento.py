@@ -0,0 +1,114 @@
+"""
+Benchmark do nivelamento de recursos: busca dia a dia (vetor de ocupação
+por responsável, testando cada dia candidato) contra
+nivelamento.nivelar_recursos (ocupação em intervalos/degraus).
+
+Gera EAPs sintéticas com ligações FS/SS/FF/SF e responsáveis sorteados,
+calcula o CPM e confere, para cada tamanho, que os dois nivelamentos dão as
+mesmas datas.
+
+Uso:
+    python benchmarks/bench_nivelamento.py [--atividades N ...] [--recursos N] [--repeticoes N]
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cronograma import (  # noqa: E402
+    calcular_cronograma,
+    duracao_atividade,
+    inicio_mais_cedo,
+    rede_precedencias,
+)
+from nivelamento import nivelar_recursos  # noqa: E402
+
+
+def nivelar_dia_a_dia(tarefas, capacidade=1):
+    """Mesmo esquema serial, com a ocupação de cada responsável dia a dia."""
+    preds, succs, ordem, _ = rede_precedencias(tarefas)
+    posicao = {i: p for p, i in enumerate(ordem)}
+    dur = [duracao_atividade(t) for t in tarefas]
+    pendentes = [sum(1 for j, _, _ in preds[i] if posicao[j] < posicao[i]) for i in range(len(tarefas))]
+    fila = [(t.get("slack", 0), t.get("es", 0), posicao[i], i) for i, t in enumerate(tarefas) if not pendentes[i]]
+    heapq.heapify(fila)
+    es, ef = [0] * len(tarefas), [0] * len(tarefas)
+    ocupacao = {}
+    while fila:
+        i = heapq.heappop(fila)[-1]
+        inicio = inicio_mais_cedo(i, preds, posicao, dur, es, ef)
+        nome = str(tarefas[i].get("responsavel") or "").strip()
+        if nome and dur[i] > 0:
+            dias = ocupacao.setdefault(nome, [])
+            while any(d < len(dias) and dias[d] >= capacidade for d in range(inicio, inicio + dur[i])):
+                inicio += 1
+            if len(dias) < inicio + dur[i]:
+                dias.extend([0] * (inicio + dur[i] - len(dias)))
+            for d in range(inicio, inicio + dur[i]):
+                dias[d] += 1
+        es[i], ef[i] = inicio, inicio + dur[i]
+        for j, _, _ in succs[i]:
+            if posicao[j] > posicao[i]:
+                pendentes[j] -= 1
+                if not pendentes[j]:
+                    heapq.heappush(fila, (tarefas[j].get("slack", 0), tarefas[j].get("es", 0), posicao[j], j))
+    return es
+
+
+def gerar_eap(n, recursos, semente=42):
+    rnd = random.Random(semente)
+    tarefas = []
+    for i in range(n):
+        tarefa = {
+            "codigo": str(i),
+            "duracao": rnd.randint(1, 20),
+            "responsavel": f"Engenheiro {rnd.randrange(recursos)}",
+            "predecessoras": [],
+        }
+        for _ in range(rnd.randint(0, 2) if i else 0):
+            j = rnd.randrange(max(0, i - 50), i)
+            tarefa["predecessoras"].append(f"{j}{rnd.choice(('FS', 'SS', 'FF', 'SF'))}{rnd.randint(-2, 5):+d}")
+        tarefas.append(tarefa)
+    return calcular_cronograma(tarefas)[0]
+
+
+def _cronometrar(funcao, args, repeticoes):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = funcao(*args)
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--atividades", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--recursos", type=int, default=30)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'atividades':>10}{'recursos':>10}{'dia a dia (ms)':>16}{'intervalos (ms)':>17}"
+        f"{'ganho':>9}{'fim CPM':>9}{'fim nivelado':>14}"
+    )
+    for n in args.atividades:
+        tarefas = gerar_eap(n, args.recursos)
+        t_dia, es_dia = _cronometrar(nivelar_dia_a_dia, (tarefas,), 1)
+        t_int, resultado = _cronometrar(nivelar_recursos, (tarefas,), args.repeticoes)
+        if es_dia != [t["es"] for t in resultado.tarefas]:
+            raise AssertionError(f"Nivelamentos diferentes para {n} atividades")
+        print(
+            f"{n:>10}{args.recursos:>10}{t_dia * 1000:>16.1f}{t_int * 1000:>17.1f}"
+            f"{t_dia / t_int:>8.0f}x{resultado.projeto_fim_cpm:>9}{resultado.projeto_fim:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark da análise de risco do cronograma (simulacao.py).
+
+Gera redes sintéticas (cada atividade depende de 1 a 3 anteriores, com
+durações otimista/mais provável/pessimista) e mede simular_cronograma para
+cada combinação de tamanho e iterações. Antes, confere que uma simulação
+sem incerteza reproduz exatamente a duração do projeto calculada por
+cronograma.calcular_cronograma.
+
+Uso:
+    python benchmarks/bench_simulacao.py [--atividades N ...] [--iteracoes N ...] [--processos N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from cronograma import calcular_cronograma  # noqa: E402
+from simulacao import simular_cronograma  # noqa: E402
+
+
+def gerar_rede(n, semente=42):
+    rnd = random.Random(semente)
+    tarefas = []
+    for i in range(n):
+        provavel = rnd.randint(2, 20)
+        preds = sorted({str(rnd.randrange(i)) for _ in range(rnd.randint(1, 3))}) if i else []
+        tarefas.append(
+            {
+                "codigo": str(i),
+                "duracao": provavel,
+                "duracaoOtimista": max(1, provavel - rnd.randint(0, 3)),
+                "duracaoPessimista": provavel + rnd.randint(0, 10),
+                "predecessoras": preds,
+            }
+        )
+    return tarefas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--atividades", type=int, nargs="+", default=[200, 2000])
+    parser.add_argument("--iteracoes", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--processos", type=int, default=None, help="padrão: decide pelo tamanho")
+    args = parser.parse_args()
+
+    for n in args.atividades:
+        fixas = [
+            {k: v for k, v in t.items() if k not in ("duracaoOtimista", "duracaoPessimista")}
+            for t in gerar_rede(n)
+        ]
+        _, fim, _ = calcular_cronograma(fixas)
+        resultado = simular_cronograma(fixas, iteracoes=100, semente=1, processos=1)
+        if not np.all(resultado.fins == fim):
+            raise AssertionError(f"Simulação sem incerteza diverge do CPM ({n} atividades)")
+
+    print(f"{'atividades':>10}{'iterações':>11}{'tempo (s)':>11}{'CPM (dias)':>12}{'P50':>9}{'P80':>9}{'P90':>9}")
+    for n in args.atividades:
+        tarefas = gerar_rede(n)
+        for iteracoes in args.iteracoes:
+            t0 = time.perf_counter()
+            resultado = simular_cronograma(tarefas, iteracoes, semente=1, processos=args.processos)
+            tempo = time.perf_counter() - t0
+            p = resultado.percentis
+            print(
+                f"{n:>10}{iteracoes:>11}{tempo:>11.2f}{resultado.duracao_deterministica:>12}"
+                f"{p[50]:>9.1f}{p[80]:>9.1f}{p[90]:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
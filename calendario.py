@@ -0,0 +1,332 @@
+"""
+Calendários de trabalho do cronograma.
+
+O CPM (cronograma.py) calcula em dias de trabalho contados a partir do
+início do projeto. Um Calendario diz quais datas são dias de trabalho:
+- semana de trabalho (máscara seg..dom, ex.: "1111100");
+- feriados nacionais do Brasil (fixos e móveis, a partir da Páscoa), com ou
+  sem os pontos facultativos (Carnaval e Corpus Christi);
+- feriados e folgas adicionais (datas sem trabalho);
+- dias trabalhados extras (datas de trabalho fora da semana, ex.: um sábado).
+
+A conversão de deslocamentos em datas usa uma tabela pré-calculada com os
+dias de trabalho a partir do início do projeto: o dia útil k é tabela[k],
+então converter milhares de ES/EF é uma indexação do NumPy. A tabela é
+montada vetorizada (máscara da semana, np.isin com feriados e extras) e
+cresce sob demanda.
+
+Calendários de recursos (por responsável) partem do calendário do projeto,
+com semana própria e folgas adicionais (férias, por exemplo). A duração de
+uma atividade conta em dias de trabalho do calendário do seu responsável,
+quando ele tem um. Como as datas deixam de ser um simples deslocamento no
+calendário do projeto, elas são refeitas por uma passada de ida em datas
+(ver datas_atividades), e uma sucessora nunca começa antes do que as
+ligações permitem. Folga e caminho crítico continuam os do CPM, em dias do
+calendário do projeto.
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+import json
+from bisect import bisect_left
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from cronograma import duracao_atividade, rede_precedencias
+
+DIAS_SEMANA = ("Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom")
+SEMANA_PADRAO = "1111100"
+
+# Feriados nacionais de data fixa (Lei 662/1949 e posteriores; Consciência
+# Negra a partir de 2024, Lei 14.759/2023).
+_FERIADOS_FIXOS = (
+    (1, 1, "Confraternização Universal", None),
+    (4, 21, "Tiradentes", None),
+    (5, 1, "Dia do Trabalho", None),
+    (9, 7, "Independência do Brasil", None),
+    (10, 12, "Nossa Senhora Aparecida", None),
+    (11, 2, "Finados", None),
+    (11, 15, "Proclamação da República", None),
+    (11, 20, "Dia Nacional de Zumbi e da Consciência Negra", 2024),
+    (12, 25, "Natal", None),
+)
+
+# 1970-01-01 (dia 0 do datetime64) foi uma quinta-feira.
+_DESLOCAMENTO_SEMANA = 3
+
+
+def pascoa(ano: int) -> date:
+    """
+    Domingo de Páscoa (calendário gregoriano, algoritmo de Meeus/Jones/Butcher).
+    """
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+
+def feriados_nacionais(ano: int, facultativos: bool = True) -> dict:
+    """
+    Feriados nacionais do ano ({data: nome}). Com facultativos, inclui os
+    pontos facultativos nacionais em que o trabalho costuma parar
+    (Carnaval e Corpus Christi).
+    """
+    feriados = {
+        date(ano, mes, dia): nome
+        for mes, dia, nome, desde in _FERIADOS_FIXOS
+        if desde is None or ano >= desde
+    }
+    domingo = pascoa(ano)
+    feriados[domingo - timedelta(days=2)] = "Sexta-feira Santa"
+    if facultativos:
+        feriados[domingo - timedelta(days=48)] = "Carnaval"
+        feriados[domingo - timedelta(days=47)] = "Carnaval"
+        feriados[domingo + timedelta(days=60)] = "Corpus Christi"
+    return feriados
+
+
+def _datas_iso(valores):
+    datas = []
+    for v in valores or []:
+        try:
+            datas.append(np.datetime64(str(v), "D"))
+        except ValueError:
+            continue
+    return np.array(sorted(set(datas)), dtype="datetime64[D]")
+
+
+class Calendario:
+    """
+    Calendário de trabalho. As tabelas de dias úteis ficam guardadas por
+    data de início, então o mesmo calendário (ver calendario_de_config)
+    converte as datas de todos os reruns sem recalcular a tabela.
+    """
+
+    def __init__(
+        self,
+        semana=SEMANA_PADRAO,
+        feriados=(),
+        dias_trabalhados=(),
+        nacionais=True,
+        facultativos=True,
+    ):
+        semana = str(semana or SEMANA_PADRAO)
+        if len(semana) != 7 or set(semana) - {"0", "1"} or "1" not in semana:
+            raise ValueError(f"Semana de trabalho inválida: {semana!r}")
+        self.semana = semana
+        self.nacionais = bool(nacionais)
+        self.facultativos = bool(facultativos)
+        self._mascara = np.array([c == "1" for c in semana])
+        self._feriados = _datas_iso(feriados)
+        self._extras = _datas_iso(dias_trabalhados)
+        self._tabelas = {}
+
+    def _feriados_ate(self, inicio, fim):
+        if not self.nacionais:
+            return self._feriados
+        nacionais = [
+            np.datetime64(d, "D")
+            for ano in range(inicio.year, fim.year + 1)
+            for d in feriados_nacionais(ano, self.facultativos)
+        ]
+        return np.union1d(self._feriados, np.array(nacionais, dtype="datetime64[D]"))
+
+    def tabela(self, inicio: date, minimo: int = 1) -> np.ndarray:
+        """
+        Os primeiros `minimo` (ou mais) dias de trabalho a partir de
+        `inicio`, inclusive, como datetime64[D].
+        """
+        tabela = self._tabelas.get(inicio)
+        if tabela is not None and len(tabela) >= minimo:
+            return tabela
+
+        uteis_na_semana = int(self._mascara.sum())
+        extensao = max(int(max(minimo, 366) * 7 / uteis_na_semana * 1.1) + 31, 2 * (len(tabela) if tabela is not None else 0))
+        while True:
+            dias = np.datetime64(inicio, "D") + np.arange(extensao)
+            semana = (dias.astype(np.int64) + _DESLOCAMENTO_SEMANA) % 7
+            uteis = self._mascara[semana]
+            uteis &= ~np.isin(dias, self._feriados_ate(inicio, inicio + timedelta(days=extensao)))
+            uteis |= np.isin(dias, self._extras)
+            tabela = dias[uteis]
+            if len(tabela) >= minimo:
+                break
+            extensao *= 2
+        self._tabelas[inicio] = tabela
+        return tabela
+
+    def datas(self, inicio: date, deslocamentos) -> np.ndarray:
+        """
+        Data (datetime64[D]) de cada deslocamento em dias de trabalho
+        desde `inicio` (0 = primeiro dia de trabalho a partir dele).
+        """
+        deslocamentos = np.maximum(np.asarray(deslocamentos, dtype=np.int64), 0)
+        minimo = int(deslocamentos.max()) + 1 if deslocamentos.size else 1
+        return self.tabela(inicio, minimo)[deslocamentos]
+
+    def terminos(self, inicio: date, es, ef) -> np.ndarray:
+        """
+        Último dia de trabalho de cada atividade (EF exclusivo; marcos, com
+        EF = ES, terminam no dia do início).
+        """
+        es = np.asarray(es, dtype=np.int64)
+        ef = np.asarray(ef, dtype=np.int64)
+        return self.datas(inicio, np.maximum(ef - 1, es))
+
+    def dias_uteis(self, inicio: date, fim: date) -> int:
+        """
+        Quantidade de dias de trabalho entre `inicio` e `fim`, inclusive.
+        """
+        if fim < inicio:
+            return 0
+        tabela = self.tabela(inicio)
+        alvo = np.datetime64(fim, "D")
+        while tabela[-1] < alvo:
+            tabela = self.tabela(inicio, 2 * len(tabela))
+        return int(np.searchsorted(tabela, alvo, side="right"))
+
+
+@lru_cache(maxsize=128)
+def _calendario_cache(chave: str) -> Calendario:
+    config = json.loads(chave)
+    return Calendario(
+        semana=config.get("semana") or SEMANA_PADRAO,
+        feriados=config.get("feriados") or (),
+        dias_trabalhados=config.get("diasTrabalhados") or (),
+        nacionais=config.get("feriadosNacionais", True),
+        facultativos=config.get("facultativos", True),
+    )
+
+
+def calendario_de_config(config=None) -> Calendario:
+    """
+    Calendário descrito por um dict do documento do projeto:
+    {"semana": "1111100", "feriadosNacionais": bool, "facultativos": bool,
+    "feriados": [ISO], "diasTrabalhados": [ISO]}. Configurações iguais
+    devolvem o mesmo objeto (e as mesmas tabelas já calculadas).
+    """
+    return _calendario_cache(json.dumps(config or {}, sort_keys=True, default=str))
+
+
+def calendarios_de_recursos(config_projeto=None, recursos=None) -> dict:
+    """
+    {responsável: Calendario} a partir do calendário do projeto e de
+    {responsável: {"semana": "1111100", "folgas": [ISO]}}: a semana própria
+    substitui a do projeto, e as folgas somam-se aos feriados dele.
+    """
+    base = dict(config_projeto or {})
+    calendarios = {}
+    for nome, recurso in (recursos or {}).items():
+        if not nome or not isinstance(recurso, dict):
+            continue
+        config = dict(base)
+        config["semana"] = recurso.get("semana") or base.get("semana") or SEMANA_PADRAO
+        config["feriados"] = sorted(set(base.get("feriados") or []) | set(recurso.get("folgas") or []))
+        calendarios[nome] = calendario_de_config(config)
+    return calendarios
+
+
+class _DiasUteis:
+    """
+    Dias de trabalho de um calendário a partir de uma data, como números de
+    dia (datetime64[D] em int), numa lista que cresce sob demanda.
+    """
+
+    def __init__(self, calendario: Calendario, inicio: date):
+        self.calendario = calendario
+        self.inicio = inicio
+        self.dias = calendario.tabela(inicio).astype(np.int64).tolist()
+
+    def _crescer(self):
+        tabela = self.calendario.tabela(self.inicio, 2 * len(self.dias))
+        self.dias = tabela.astype(np.int64).tolist()
+
+    def dia(self, k: int) -> int:
+        """O k-ésimo dia de trabalho (0 = o primeiro)."""
+        while k >= len(self.dias):
+            self._crescer()
+        return self.dias[max(k, 0)]
+
+    def indice(self, dia: int) -> int:
+        """Dias de trabalho antes de `dia` (posição do primeiro dia >= dia)."""
+        while dia > self.dias[-1]:
+            self._crescer()
+        return bisect_left(self.dias, dia)
+
+
+def datas_atividades(tarefas, inicio: date, calendario: Calendario, por_responsavel=None):
+    """
+    (inícios, términos) em datetime64[D] de atividades já calculadas pelo
+    CPM (ES/EF em dias de trabalho do calendário do projeto).
+
+    Sem calendários de responsáveis, é uma indexação na tabela do projeto.
+    Se alguma atividade tem responsável com calendário próprio, as datas
+    saem de uma passada de ida em datas, na ordem da rede: cada atividade
+    começa no primeiro dia de trabalho do seu calendário permitido pelas
+    ligações (defasagens em dias de trabalho do projeto) e dura `duracao`
+    dias de trabalho desse calendário.
+    """
+    es = np.fromiter((t.get("es", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    ef = np.fromiter((t.get("ef", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    responsaveis = [t.get("responsavel") or "" for t in tarefas]
+    if not por_responsavel or not any(nome in por_responsavel for nome in responsaveis):
+        return calendario.datas(inicio, es), calendario.terminos(inicio, es, ef)
+
+    projeto = _DiasUteis(calendario, inicio)
+    proprios = {nome: _DiasUteis(cal, inicio) for nome, cal in por_responsavel.items()}
+    tabelas = [proprios.get(nome, projeto) for nome in responsaveis]
+
+    preds, _, ordem, _ = rede_precedencias(tarefas)
+    posicao = [0] * len(tarefas)
+    for k, i in enumerate(ordem):
+        posicao[i] = k
+    dur = [duracao_atividade(t) for t in tarefas]
+    primeiro = projeto.dia(0)
+    comeco = [0] * len(tarefas)
+    fim = [0] * len(tarefas)  # dia seguinte ao último dia de trabalho
+    for k, i in enumerate(ordem):
+        tabela = tabelas[i]
+        limite = primeiro
+        for j, tipo, lag in preds[i]:
+            if posicao[j] >= k:
+                continue
+            referencia = fim[j] if tipo in ("FS", "FF") else comeco[j]
+            if tipo in ("FS", "SS"):
+                # Limite do início: `lag` dias de trabalho do projeto
+                # depois (ou antes) da referência.
+                cand = referencia if not lag else projeto.dia(projeto.indice(referencia) + lag)
+            else:
+                # FF/SF limitam o último dia de trabalho: o dia do projeto
+                # em que terminaria uma atividade com EF = referência + lag
+                # e, no FF sem defasagem, o último dia da predecessora.
+                k_ultimo = projeto.indice(referencia) + lag - 1
+                if k_ultimo < 0:
+                    continue
+                ultimo = projeto.dia(k_ultimo)
+                if tipo == "FF" and not lag and dur[j] > 0:
+                    ultimo = max(ultimo, fim[j] - 1)
+                if dur[i] > 0:
+                    posicao_inicio = tabela.indice(ultimo) - dur[i] + 1
+                else:
+                    posicao_inicio = tabela.indice(ultimo + 1)
+                if posicao_inicio <= 0:
+                    continue
+                cand = tabela.dia(posicao_inicio)
+            if cand > limite:
+                limite = cand
+        p = tabela.indice(limite)
+        comeco[i] = tabela.dia(p)
+        fim[i] = tabela.dia(p + dur[i] - 1) + 1 if dur[i] > 0 else comeco[i]
+
+    inicios = np.array(comeco, dtype="datetime64[D]")
+    terminos = np.array([f - 1 if f > c else c for c, f in zip(comeco, fim)], dtype="datetime64[D]")
+    return inicios, terminos
@@ -0,0 +1,125 @@
+"""
+Formato comprimido para documentos de projeto.
+
+Listas de dicts (lançamentos financeiros, atividades da EAP...) repetem as
+mesmas chaves em todo item. Antes de comprimir, cada uma dessas listas é
+convertida para um formato colunar: as chaves aparecem uma única vez e os
+valores ficam agrupados por coluna, o que também aproxima valores parecidos
+(datas, categorias, status) e ajuda o compressor. O resultado é JSON compacto
+comprimido com zlib ou lzma, precedido de um cabeçalho de 5 bytes.
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+import json
+import lzma
+import zlib
+
+# Cabeçalho: 4 bytes de identificação do formato + 1 byte do algoritmo.
+MAGICO = b"BKC1"
+ALGORITMOS = {"zlib": b"Z", "lzma": b"X"}
+
+# Chaves reservadas da representação colunar (não ocorrem nos dados do app).
+_COLUNAS = "\u0000colunas"
+_VALORES = "\u0000valores"
+_AUSENTES = "\u0000ausentes"
+
+
+def _para_colunar(valor):
+    if isinstance(valor, dict):
+        return {k: _para_colunar(v) for k, v in valor.items()}
+    if not isinstance(valor, list):
+        return valor
+    if len(valor) < 2 or not all(isinstance(item, dict) for item in valor):
+        return [_para_colunar(item) for item in valor]
+
+    chaves = []
+    vistas = set()
+    for item in valor:
+        for chave in item:
+            if chave not in vistas:
+                vistas.add(chave)
+                chaves.append(chave)
+
+    valores = []
+    ausentes = {}
+    for pos, chave in enumerate(chaves):
+        coluna = []
+        for linha, item in enumerate(valor):
+            if chave in item:
+                coluna.append(_para_colunar(item[chave]))
+            else:
+                coluna.append(None)
+                ausentes.setdefault(str(pos), []).append(linha)
+        valores.append(coluna)
+
+    tabela = {_COLUNAS: chaves, _VALORES: valores}
+    if ausentes:
+        tabela[_AUSENTES] = ausentes
+    return tabela
+
+
+def _de_colunar(valor):
+    if isinstance(valor, list):
+        return [_de_colunar(item) for item in valor]
+    if not isinstance(valor, dict):
+        return valor
+    if _COLUNAS not in valor:
+        return {k: _de_colunar(v) for k, v in valor.items()}
+
+    chaves = valor[_COLUNAS]
+    colunas = valor[_VALORES]
+    ausentes = {int(pos): set(linhas) for pos, linhas in valor.get(_AUSENTES, {}).items()}
+    total = len(colunas[0]) if colunas else 0
+    itens = [{} for _ in range(total)]
+    for pos, (chave, coluna) in enumerate(zip(chaves, colunas)):
+        faltando = ausentes.get(pos, ())
+        for linha, celula in enumerate(coluna):
+            if linha not in faltando:
+                itens[linha][chave] = _de_colunar(celula)
+    return itens
+
+
+def codificar_documento(documento, algoritmo="zlib", nivel=None):
+    """
+    Codifica um documento (dict/list JSON) no formato comprimido.
+    algoritmo: "zlib" (rápido, padrão) ou "lzma" (menor, mais lento).
+    """
+    if algoritmo not in ALGORITMOS:
+        raise ValueError(f"Algoritmo de compressão desconhecido: {algoritmo!r}")
+    texto = json.dumps(
+        _para_colunar(documento), separators=(",", ":"), ensure_ascii=False, default=str
+    ).encode("utf-8")
+    if algoritmo == "zlib":
+        corpo = zlib.compress(texto, 6 if nivel is None else nivel)
+    else:
+        corpo = lzma.compress(texto, preset=6 if nivel is None else nivel)
+    return MAGICO + ALGORITMOS[algoritmo] + corpo
+
+
+def algoritmo_documento(dados):
+    """
+    Algoritmo ("zlib" ou "lzma") de bytes gerados por codificar_documento.
+    """
+    dados = bytes(dados[:5])
+    for algoritmo, marca in ALGORITMOS.items():
+        if dados == MAGICO + marca:
+            return algoritmo
+    raise ValueError("Conteúdo não está no formato comprimido de documentos.")
+
+
+def decodificar_documento(dados):
+    """
+    Decodifica bytes gerados por codificar_documento (o algoritmo vem do cabeçalho).
+    """
+    dados = bytes(dados)
+    if dados[:4] != MAGICO:
+        raise ValueError("Conteúdo não está no formato comprimido de documentos.")
+    algoritmo = dados[4:5]
+    if algoritmo == ALGORITMOS["zlib"]:
+        texto = zlib.decompress(dados[5:])
+    elif algoritmo == ALGORITMOS["lzma"]:
+        texto = lzma.decompress(dados[5:])
+    else:
+        raise ValueError(f"Algoritmo de compressão desconhecido no cabeçalho: {algoritmo!r}")
+    return _de_colunar(json.loads(texto))
@@ -0,0 +1,648 @@
+"""
+Motor de CPM (método do caminho crítico) das atividades da EAP.
+
+A rede de precedências é o grafo codigo -> predecessoras. Cada entrada de
+"predecessoras" é uma ligação com tipo e defasagem (lag, em dias; negativo
+é antecipação):
+    "1.2"        relação padrão da atividade ("relacao", FS se ausente), lag 0
+    "1.2FS+3"    começa 3 dias depois do término de 1.2
+    "1.2SS-2"    começa 2 dias antes do início de 1.2
+    "1.2FF"      termina junto com 1.2 (ou depois)
+    "1.2SF+1"    termina 1 dia depois do início de 1.2 (ou depois)
+O tipo vem em maiúsculas colado ao código; a defasagem exige o tipo. Uma
+entrada igual ao código de alguma atividade é sempre lida como esse código.
+
+A ordem de cálculo vem de uma ordenação topológica (algoritmo de Kahn), então
+as passadas de ida (ES/EF) e de volta (LS/LF) custam O(V + E), com E o número
+de ligações. Problemas na rede não geram datas silenciosamente erradas: são
+devolvidos para exibição.
+- ciclos: grupos de atividades que dependem umas das outras (componentes
+  fortemente conexos). Para ainda produzir datas, as ligações que fecham o
+  ciclo são ignoradas;
+- ausentes: predecessoras citadas que não existem na EAP (ignoradas);
+- duplicados: códigos usados por mais de uma atividade (vale a última).
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import operator
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import NamedTuple
+
+import numpy as np
+
+TIPOS_LIGACAO = ("FS", "SS", "FF", "SF")
+
+_LIGACAO = re.compile(r"^(?P<codigo>.+?)(?:(?P<tipo>FS|SS|FF|SF)\s*(?:(?P<lag>[+-]\s*\d+)\s*d?)?)?$")
+
+
+def interpretar_predecessora(texto, relacao_padrao="FS"):
+    """
+    Decompõe uma entrada de "predecessoras" em (código, tipo, defasagem).
+    """
+    texto = str(texto).strip()
+    m = _LIGACAO.match(texto)
+    if not m:
+        return texto, relacao_padrao, 0
+    lag = int(m.group("lag").replace(" ", "")) if m.group("lag") else 0
+    return m.group("codigo").strip(), m.group("tipo") or relacao_padrao, lag
+
+
+def formatar_predecessora(codigo, tipo="FS", lag=0):
+    """
+    Texto de uma ligação no formato de "predecessoras" (ex.: "1.2FS+3").
+    """
+    if not lag:
+        return f"{codigo}{tipo}" if tipo != "FS" else str(codigo)
+    return f"{codigo}{tipo}{lag:+d}"
+
+
+def duracao_atividade(tarefa) -> int:
+    """
+    Duração da atividade em dias (0 se ausente ou inválida).
+    """
+    try:
+        return int(tarefa.get("duracao") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _montar_grafo(tarefas):
+    """
+    Ligações de cada atividade, pela posição na lista: preds[i] e succs[j]
+    trazem (outra ponta, tipo, defasagem). Devolve também os problemas de
+    código encontrados.
+    """
+    indice = {}
+    duplicados = []
+    for i, t in enumerate(tarefas):
+        codigo = t.get("codigo")
+        if codigo in indice and codigo not in duplicados:
+            duplicados.append(codigo)
+        indice[codigo] = i
+
+    succs = [[] for _ in tarefas]
+    ausentes = []
+    preds = [_ligacoes(t, indice, ausentes) for t in tarefas]
+    for i, ligacoes in enumerate(preds):
+        for j, tipo, lag in ligacoes:
+            succs[j].append((i, tipo, lag))
+    return preds, succs, {"ausentes": ausentes, "duplicados": duplicados, "indice": indice}
+
+
+def _ligacoes(tarefa, indice, ausentes):
+    """
+    Ligações (predecessora, tipo, defasagem) de uma atividade, sem repetição.
+    As predecessoras citadas que não existem são acrescentadas a `ausentes`.
+    """
+    padrao = tarefa.get("relacao")
+    if padrao not in TIPOS_LIGACAO:
+        padrao = "FS"
+    ligacoes = []
+    for entrada in tarefa.get("predecessoras") or ():
+        # Um código existente vale como está (e poupa o regex no caso comum).
+        j = indice.get(entrada)
+        if j is not None:
+            ligacao = (j, padrao, 0)
+        else:
+            cod, tipo, lag = interpretar_predecessora(entrada, padrao)
+            j = indice.get(cod)
+            if j is None:
+                ausentes.append((tarefa.get("codigo"), cod))
+                continue
+            ligacao = (j, tipo, lag)
+        # Poucas ligações por atividade: a busca na lista sai mais barata
+        # que um conjunto.
+        if ligacao not in ligacoes:
+            ligacoes.append(ligacao)
+    return ligacoes
+
+
+def _componentes_fortes(nos, succs):
+    """
+    Tarjan iterativo restrito a `nos`. Devolve os componentes fortemente
+    conexos em ordem topológica do grafo condensado.
+    """
+    restantes = set(nos)
+    ordem_visita = {}
+    menor = {}
+    pilha = []
+    na_pilha = set()
+    componentes = []
+    adjacentes = {}
+    contador = 0
+
+    for raiz in nos:
+        if raiz in ordem_visita:
+            continue
+        trabalho = [(raiz, 0)]
+        while trabalho:
+            v, pos = trabalho.pop()
+            if pos == 0:
+                ordem_visita[v] = menor[v] = contador
+                contador += 1
+                pilha.append(v)
+                na_pilha.add(v)
+            if v not in adjacentes:
+                adjacentes[v] = list(dict.fromkeys(w for w, _, _ in succs[v] if w in restantes))
+            vizinhos = adjacentes[v]
+            avancou = False
+            for k in range(pos, len(vizinhos)):
+                w = vizinhos[k]
+                if w not in ordem_visita:
+                    trabalho.append((v, k + 1))
+                    trabalho.append((w, 0))
+                    avancou = True
+                    break
+                if w in na_pilha:
+                    menor[v] = min(menor[v], ordem_visita[w])
+            if avancou:
+                continue
+            if menor[v] == ordem_visita[v]:
+                componente = []
+                while True:
+                    w = pilha.pop()
+                    na_pilha.discard(w)
+                    componente.append(w)
+                    if w == v:
+                        break
+                componentes.append(sorted(componente))
+            if trabalho:
+                pai = trabalho[-1][0]
+                menor[pai] = min(menor[pai], menor[v])
+
+    componentes.reverse()
+    return componentes
+
+
+def ordem_topologica(tarefas, preds, succs):
+    """
+    Ordem de cálculo (algoritmo de Kahn, estável na ordem da lista) e os
+    ciclos encontrados. Atividades em ciclos, ou que dependem deles, entram
+    no fim da ordem, componente por componente.
+    """
+    grau = [len(p) for p in preds]
+    fila = deque(i for i, g in enumerate(grau) if g == 0)
+    ordem = []
+    while fila:
+        i = fila.popleft()
+        ordem.append(i)
+        for j, _, _ in succs[i]:
+            grau[j] -= 1
+            if grau[j] == 0:
+                fila.append(j)
+
+    ciclos = []
+    if len(ordem) < len(tarefas):
+        ordenados = set(ordem)
+        restantes = [i for i in range(len(tarefas)) if i not in ordenados]
+        for componente in _componentes_fortes(restantes, succs):
+            if len(componente) > 1 or any(j == componente[0] for j, _, _ in succs[componente[0]]):
+                ciclos.append([tarefas[i].get("codigo") for i in componente])
+            ordem.extend(componente)
+    return ordem, ciclos
+
+
+def rede_precedencias(tarefas):
+    """
+    Ligações de cada atividade (preds/succs, como em _montar_grafo), a
+    ordem de cálculo e os problemas da rede, para outros motores de cálculo
+    sobre a mesma rede.
+    """
+    preds, succs, problemas = _montar_grafo(tarefas)
+    del problemas["indice"]
+    ordem, problemas["ciclos"] = ordem_topologica(tarefas, preds, succs)
+    return preds, succs, ordem, problemas
+
+
+def inicio_mais_cedo(i, preds, posicao, dur, es, ef):
+    """
+    Ida: o maior início permitido pelas ligações com atividades anteriores
+    na ordem (as que fecham ciclos são ignoradas), nunca antes do início do
+    projeto.
+    """
+    inicio = 0
+    for j, tipo, lag in preds[i]:
+        if posicao[j] >= posicao[i]:
+            continue
+        if tipo == "FS":
+            cand = ef[j] + lag
+        elif tipo == "SS":
+            cand = es[j] + lag
+        elif tipo == "FF":
+            cand = ef[j] + lag - dur[i]
+        else:
+            cand = es[j] + lag - dur[i]
+        if cand > inicio:
+            inicio = cand
+    return inicio
+
+
+def termino_mais_tarde(i, succs, posicao, dur, ls, lf, projeto_fim):
+    """
+    Volta: o menor término permitido pelas ligações com sucessoras, limitado
+    ao fim do projeto.
+    """
+    termino = projeto_fim
+    for j, tipo, lag in succs[i]:
+        if posicao[j] <= posicao[i]:
+            continue
+        if tipo == "FS":
+            cand = ls[j] - lag
+        elif tipo == "SS":
+            cand = ls[j] - lag + dur[i]
+        elif tipo == "FF":
+            cand = lf[j] - lag
+        else:
+            cand = lf[j] - lag + dur[i]
+        if cand < termino:
+            termino = cand
+    return termino
+
+
+def _instantaneo(tarefa):
+    # Cópia usada para detectar alterações; a lista de predecessoras é
+    # copiada porque o app pode alterá-la no lugar.
+    copia = dict(tarefa)
+    if isinstance(copia.get("predecessoras"), list):
+        copia["predecessoras"] = list(copia["predecessoras"])
+    return copia
+
+
+class CronogramaIncremental:
+    """
+    Motor de CPM que guarda o grafo e as datas entre chamadas.
+
+    calcular(tarefas) compara a lista com a da chamada anterior: se só
+    mudaram campos de algumas atividades (duração, predecessoras, relação ou
+    outros), as datas são repropagadas apenas pelo cone afetado — sucessoras
+    na ida, predecessoras na volta — e a propagação para onde as datas não
+    mudam. A volta inteira só é refeita quando a duração do projeto muda.
+    Uma ligação nova contra a ordem topológica atual só reordena as
+    atividades entre as duas pontas. Inclusão, exclusão, reordenação ou
+    troca de código de atividades, ligações que fecham ciclos e redes com
+    ciclos ou códigos duplicados levam ao cálculo completo.
+
+    O resultado tem o mesmo formato de calcular_cronograma. As atividades
+    devolvidas não devem ser alteradas; o motor também não as altera depois
+    (cada cálculo devolve uma lista nova e cópias das atividades que
+    mudaram), então um resultado anterior continua válido.
+    """
+
+    def __init__(self):
+        self._originais = None
+
+    def calcular(self, tarefas):
+        tarefas = list(tarefas or [])
+        if (
+            self._originais is None
+            or len(tarefas) != len(self._originais)
+            or self._problemas["ciclos"]
+            or self._problemas["duplicados"]
+        ):
+            return self._recalcular(tarefas)
+
+        # Comparação feita em C (map/compress): numa edição isolada, é o
+        # único passo proporcional ao tamanho da EAP.
+        alteradas = list(
+            itertools.compress(range(len(tarefas)), map(operator.ne, tarefas, self._originais))
+        )
+        if any(tarefas[i].get("codigo") != self._originais[i].get("codigo") for i in alteradas):
+            return self._recalcular(tarefas)
+        if alteradas and not self._repropagar(tarefas, alteradas):
+            return self._recalcular(tarefas)
+        return self._tarefas, self._projeto_fim, self._problemas
+
+    def _recalcular(self, tarefas):
+        self._originais = [_instantaneo(t) for t in tarefas]
+        return self._calcular_completo(tarefas)
+
+    def _calcular_completo(self, tarefas):
+        self._tarefas = [dict(t) for t in tarefas]
+        self._preds, self._succs, problemas = _montar_grafo(self._tarefas)
+        self._indice = problemas.pop("indice")
+        ordem, problemas["ciclos"] = ordem_topologica(self._tarefas, self._preds, self._succs)
+        self._ordem = ordem
+        self._problemas = problemas
+        self._ausentes = {}
+        for cod, pred in problemas["ausentes"]:
+            self._ausentes.setdefault(self._indice.get(cod), []).append((cod, pred))
+
+        n = len(tarefas)
+        self._posicao = posicao = [0] * n
+        for k, i in enumerate(ordem):
+            posicao[i] = k
+        self._dur = dur = [duracao_atividade(t) for t in self._tarefas]
+        self._es = es = [0] * n
+        self._ef = ef = [0] * n
+        preds = self._preds
+        # Mesma regra de inicio_mais_cedo, escrita aqui para não pagar uma
+        # chamada por atividade; k é a posição de i na ordem.
+        for k, i in enumerate(ordem):
+            inicio = 0
+            d = dur[i]
+            for j, tipo, lag in preds[i]:
+                if posicao[j] >= k:
+                    continue
+                if tipo == "FS":
+                    cand = ef[j] + lag
+                elif tipo == "SS":
+                    cand = es[j] + lag
+                elif tipo == "FF":
+                    cand = ef[j] + lag - d
+                else:
+                    cand = es[j] + lag - d
+                if cand > inicio:
+                    inicio = cand
+            es[i] = inicio
+            ef[i] = inicio + d
+        self._projeto_fim = max(ef) if n else 0
+        self._passada_volta()
+        self._gravar_datas(range(n))
+        return self._tarefas, self._projeto_fim, self._problemas
+
+    def _passada_volta(self):
+        n = len(self._tarefas)
+        projeto_fim = self._projeto_fim
+        succs, posicao, dur = self._succs, self._posicao, self._dur
+        self._lf = lf = [projeto_fim] * n
+        self._ls = ls = [0] * n
+        # Mesma regra de termino_mais_tarde, sem uma chamada por atividade.
+        for i in reversed(self._ordem):
+            termino = projeto_fim
+            p = posicao[i]
+            d = dur[i]
+            for j, tipo, lag in succs[i]:
+                if posicao[j] <= p:
+                    continue
+                if tipo == "FS":
+                    cand = ls[j] - lag
+                elif tipo == "SS":
+                    cand = ls[j] - lag + d
+                elif tipo == "FF":
+                    cand = lf[j] - lag
+                else:
+                    cand = lf[j] - lag + d
+                if cand < termino:
+                    termino = cand
+            lf[i] = termino
+            ls[i] = termino - d
+
+    def _gravar_datas(self, indices, copiar=False):
+        for i in indices:
+            t = self._tarefas[i]
+            if copiar:
+                t = self._tarefas[i] = dict(t)
+            t["es"] = self._es[i]
+            t["ef"] = self._ef[i]
+            t["ls"] = self._ls[i]
+            t["lf"] = self._lf[i]
+            t["slack"] = self._ls[i] - self._es[i]
+
+    def _reordenar(self, origem, destino):
+        """
+        Corrige a ordem topológica depois da ligação origem -> destino, com
+        origem hoje depois de destino (algoritmo de Pearce-Kelly): só as
+        atividades entre as duas posições alcançáveis a partir delas trocam
+        de lugar. Retorna False se a ligação fecha um ciclo.
+        """
+        posicao, ordem = self._posicao, self._ordem
+        inferior, superior = posicao[destino], posicao[origem]
+
+        adiante = {destino}
+        pilha = [destino]
+        while pilha:
+            v = pilha.pop()
+            for w, _, _ in self._succs[v]:
+                if w == origem:
+                    return False
+                if w not in adiante and posicao[w] < superior:
+                    adiante.add(w)
+                    pilha.append(w)
+
+        atras = {origem}
+        pilha = [origem]
+        while pilha:
+            v = pilha.pop()
+            for w, _, _ in self._preds[v]:
+                if w not in atras and posicao[w] > inferior:
+                    atras.add(w)
+                    pilha.append(w)
+
+        nos = sorted(atras, key=posicao.__getitem__) + sorted(adiante, key=posicao.__getitem__)
+        for no, pos in zip(nos, sorted(posicao[v] for v in nos)):
+            posicao[no] = pos
+            ordem[pos] = no
+        return True
+
+    def _repropagar(self, tarefas, alteradas):
+        """
+        Aplica as alterações de `alteradas` e repropaga as datas. Retorna
+        False quando uma ligação nova fecha um ciclo.
+        """
+        preds, succs, posicao = self._preds, self._succs, self._posicao
+        self._tarefas = list(self._tarefas)
+        volta = set()
+        for i in alteradas:
+            ausentes = []
+            ligacoes = _ligacoes(tarefas[i], self._indice, ausentes)
+            anteriores = {j for j, _, _ in preds[i]}
+            for j in anteriores:
+                succs[j] = [s for s in succs[j] if s[0] != i]
+            for j, tipo, lag in ligacoes:
+                succs[j].append((i, tipo, lag))
+            preds[i] = ligacoes
+            volta.update(anteriores)
+            volta.update(j for j, _, _ in ligacoes)
+            volta.add(i)
+            if ausentes:
+                self._ausentes[i] = ausentes
+            else:
+                self._ausentes.pop(i, None)
+            self._originais[i] = _instantaneo(tarefas[i])
+            self._tarefas[i] = dict(tarefas[i])
+            self._dur[i] = duracao_atividade(self._tarefas[i])
+
+        for i in alteradas:
+            for j, _, _ in preds[i]:
+                if posicao[j] >= posicao[i] and not self._reordenar(j, i):
+                    return False
+
+        # Ida pelo cone das sucessoras, na ordem topológica.
+        dur, es, ef = self._dur, self._es, self._ef
+        tocadas = set(alteradas)
+        fila = [(posicao[i], i) for i in alteradas]
+        heapq.heapify(fila)
+        vistas = set()
+        while fila:
+            _, i = heapq.heappop(fila)
+            if i in vistas:
+                continue
+            vistas.add(i)
+            inicio = inicio_mais_cedo(i, preds, posicao, dur, es, ef)
+            if inicio == es[i] and inicio + dur[i] == ef[i]:
+                continue
+            es[i] = inicio
+            ef[i] = inicio + dur[i]
+            tocadas.add(i)
+            for j, _, _ in succs[i]:
+                if j not in vistas:
+                    heapq.heappush(fila, (posicao[j], j))
+
+        projeto_fim = max(ef)
+        if projeto_fim != self._projeto_fim:
+            self._projeto_fim = projeto_fim
+            self._passada_volta()
+            tocadas = range(len(self._tarefas))
+        else:
+            # Volta pelo cone das predecessoras, na ordem topológica reversa.
+            ls, lf = self._ls, self._lf
+            fila = [(-posicao[i], i) for i in volta]
+            heapq.heapify(fila)
+            vistas = set()
+            while fila:
+                _, i = heapq.heappop(fila)
+                if i in vistas:
+                    continue
+                vistas.add(i)
+                termino = termino_mais_tarde(i, succs, posicao, dur, ls, lf, projeto_fim)
+                if termino == lf[i] and termino - dur[i] == ls[i]:
+                    continue
+                lf[i] = termino
+                ls[i] = termino - dur[i]
+                tocadas.add(i)
+                for j, _, _ in preds[i]:
+                    if j not in vistas:
+                        heapq.heappush(fila, (-posicao[j], j))
+
+        self._gravar_datas(tocadas, copiar=True)
+        self._problemas = dict(self._problemas)
+        self._problemas["ausentes"] = [a for i in sorted(self._ausentes) for a in self._ausentes[i]]
+        return True
+
+
+def calcular_cronograma(tarefas):
+    """
+    Calcula ES/EF/LS/LF/folga (em dias desde o início do projeto) de cópias
+    das atividades, na ordem original.
+    Retorna (atividades, duração do projeto, problemas), com problemas =
+    {"ciclos": [[códigos]], "ausentes": [(atividade, predecessora)],
+    "duplicados": [códigos]}.
+    """
+    return CronogramaIncremental()._calcular_completo(list(tarefas or []))
+
+
+def curva_s_trabalho(tarefas, projeto_fim):
+    """
+    Progresso planejado (%) em cada dia 0..projeto_fim de atividades já
+    calculadas, ponderado pela duração: cada atividade avança linearmente
+    entre ES e EF.
+
+    O trabalho acumulado no dia d é a soma de min(max(d - ES, 0), duração).
+    Ele cresce, de d para d + 1, o número de atividades em andamento
+    (ES <= d < EF), que sai de um vetor de diferenças (+1 em ES, -1 em EF)
+    com uma soma acumulada; uma segunda soma acumulada dá o trabalho. O
+    custo é O(atividades + dias), com a conta em inteiros até a divisão.
+    """
+    dias = max(int(projeto_fim), 0) + 1
+    es = np.fromiter((t.get("es", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    ef = np.fromiter((t.get("ef", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    total = int((ef - es).sum())
+    if total <= 0:
+        return np.zeros(dias)
+    em_andamento = np.cumsum(
+        np.bincount(es, minlength=dias)[:dias] - np.bincount(ef, minlength=dias)[:dias]
+    )
+    trabalho = np.concatenate(([0], np.cumsum(em_andamento[:-1])))
+    return trabalho / total * 100.0
+
+
+# --------------------------------------------------------
+# CACHE DE CRONOGRAMAS
+# --------------------------------------------------------
+
+class Cronograma(NamedTuple):
+    """
+    Cronograma calculado de uma EAP. `derivados` guarda resultados que só
+    dependem do cronograma (ex.: a curva S), calculados uma vez por entrada.
+    """
+
+    tarefas: list
+    projeto_fim: int
+    problemas: dict
+    data_inicio: str
+    derivados: dict
+
+
+def chave_cronograma(tarefas, data_inicio=None) -> str:
+    """
+    Hash do conteúdo das atividades e da data de início do projeto.
+    """
+    texto = json.dumps(
+        [tarefas or [], data_inicio], sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CacheCronogramas:
+    """
+    Cache LRU de cronogramas calculados, compartilhado pelas sessões do processo.
+
+    - A chave é o hash do conteúdo da EAP e da data de início: a mesma EAP
+      é calculada uma vez e reaproveitada pela Home, pela aba EAP, pelos
+      relatórios e pelas métricas gravadas no resumo do portfólio.
+    - Numa falta, o cálculo usa o motor incremental informado pelo chamador
+      (um por sessão), então editar uma atividade continua barato.
+    - As entradas são compartilhadas, não cópias: quem lê não deve alterar
+      as atividades nem os derivados já guardados.
+    """
+
+    def __init__(self, max_itens=64):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._faltas = 0
+        self._despejos = 0
+
+    def obter(self, tarefas, data_inicio=None, motor=None):
+        """
+        Cronograma das atividades, do cache ou calculado (e guardado).
+        """
+        chave = chave_cronograma(tarefas, data_inicio)
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                self._itens.move_to_end(chave)
+                self._acertos += 1
+                return item
+            self._faltas += 1
+
+        if motor is None:
+            resultado = calcular_cronograma(tarefas)
+        else:
+            resultado = motor.calcular(tarefas)
+        item = Cronograma(*resultado, data_inicio, {})
+        with self._lock:
+            self._itens[chave] = item
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self._despejos += 1
+        return item
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "cronogramas": len(self._itens),
+                "max_itens": self.max_itens,
+                "acertos": self._acertos,
+                "faltas": self._faltas,
+                "despejos": self._despejos,
+            }
@@ -0,0 +1,216 @@
+"""
+Índice hierárquico da EAP (estrutura analítica do projeto).
+
+As atividades da EAP têm códigos como "1.2.3"; a hierarquia vem do código:
+o pai de "1.2.3" é a atividade de código "1.2" ou, se ela não existir, o
+ancestral mais próximo que existir ("1"). Códigos vazios e códigos sem
+ancestral ficam na raiz.
+
+A árvore é montada uma vez a partir dos códigos:
+- ordem natural (os segmentos numéricos comparam como números, então "1.2"
+  vem antes de "1.10"), que é também a pré-ordem da árvore;
+- cada nó guarda o pai e o fim da sua subárvore na pré-ordem, então os
+  descendentes de um nó são um intervalo contíguo [pos + 1, fim[pos]);
+- recolher/expandir ramos só muda o conjunto de linhas visíveis
+  (arvore.visiveis(recolhidos)), sem remontar a árvore.
+
+Os totais dos nós resumo (início/término, duração, % concluído e custo) saem
+de uma passada em pós-ordem: os níveis são percorridos do mais profundo para
+a raiz e cada nível é acumulado no pai com np.minimum.at / np.maximum.at /
+np.add.at. O valor de um nó inclui o da própria atividade e o dos
+descendentes.
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+# Percentual concluído por status (regra 50/50 do valor agregado: 50% ao
+# iniciar, 100% ao concluir).
+PERCENTUAL_STATUS = {
+    "nao-iniciado": 0.0,
+    "em-andamento": 50.0,
+    "em-analise": 50.0,
+    "em-revisao": 50.0,
+    "concluido": 100.0,
+}
+
+def segmentos_codigo(codigo) -> tuple:
+    """
+    Segmentos de um código da EAP ("1.2.10" -> ("1", "2", "10")).
+    """
+    return tuple(s.strip() for s in str(codigo or "").strip().split(".") if s.strip())
+
+
+def chave_natural(codigo) -> tuple:
+    """
+    Chave de ordenação natural de um código da EAP: segmentos numéricos
+    comparam como números e vêm antes dos segmentos de texto.
+    """
+    return tuple(
+        (0, int(s), "") if s.isdecimal() else (1, 0, s.lower())
+        for s in segmentos_codigo(codigo)
+    )
+
+
+class Totais(NamedTuple):
+    """Totais por nó da árvore, em pré-ordem (arrays alinhados com arvore.ordem)."""
+
+    es: np.ndarray
+    ef: np.ndarray
+    duracao: np.ndarray
+    percentual: np.ndarray
+    custo: np.ndarray
+    inicio: np.ndarray | None
+    termino: np.ndarray | None
+
+
+class ArvoreEAP:
+    """
+    Árvore da EAP montada a partir dos códigos das atividades.
+
+    Posições são índices na pré-ordem (ordem natural dos códigos):
+    - ordem[pos]: índice da atividade na lista original;
+    - pai[pos]: posição do pai (-1 na raiz);
+    - fim[pos]: fim (exclusivo) da subárvore de pos;
+    - profundidade[pos]: 0 na raiz.
+    """
+
+    def __init__(self, tarefas):
+        chaves = [chave_natural(t.get("codigo")) for t in tarefas]
+        ordem = sorted(range(len(tarefas)), key=chaves.__getitem__)
+        n = len(ordem)
+
+        self.codigos = [str(tarefas[i].get("codigo") or "").strip() for i in ordem]
+        pai = [-1] * n
+        fim = [n] * n
+        profundidade = [0] * n
+
+        # Pilha de ancestrais abertos. Na ordem natural um prefixo vem antes
+        # das suas extensões, então o pai é o topo da pilha depois de fechar
+        # quem não é prefixo do código atual.
+        pilha = []
+        for pos, i in enumerate(ordem):
+            chave = chaves[i]
+            while pilha:
+                topo = chaves[ordem[pilha[-1]]]
+                if len(topo) < len(chave) and chave[: len(topo)] == topo:
+                    break
+                fim[pilha.pop()] = pos
+            if pilha:
+                pai[pos] = pilha[-1]
+                profundidade[pos] = profundidade[pilha[-1]] + 1
+            if chave:
+                pilha.append(pos)
+            else:
+                fim[pos] = pos + 1
+
+        self.ordem = np.asarray(ordem, dtype=np.int64)
+        self.pai = np.asarray(pai, dtype=np.int64)
+        self.fim = np.asarray(fim, dtype=np.int64)
+        self.profundidade = np.asarray(profundidade, dtype=np.int64)
+        self.posicao = np.empty(n, dtype=np.int64)
+        self.posicao[self.ordem] = np.arange(n)
+        self._posicao_codigo = {codigo: pos for pos, codigo in enumerate(self.codigos)}
+
+    def __len__(self):
+        return len(self.ordem)
+
+    def posicao_de(self, codigo):
+        """Posição do código na pré-ordem (a última, se repetido) ou None."""
+        return self._posicao_codigo.get(str(codigo or "").strip())
+
+    def tem_filhos(self, pos) -> bool:
+        return bool(self.fim[pos] > pos + 1)
+
+    def filhos(self, pos):
+        """Posições dos filhos diretos de pos, em ordem natural."""
+        filho, fim = pos + 1, self.fim[pos]
+        while filho < fim:
+            yield filho
+            filho = int(self.fim[filho])
+
+    def descendentes(self, pos) -> range:
+        return range(pos + 1, int(self.fim[pos]))
+
+    def raizes(self):
+        """Posições dos nós sem pai, em ordem natural."""
+        pos = 0
+        while pos < len(self.ordem):
+            yield pos
+            pos = int(self.fim[pos])
+
+    def resumos(self) -> np.ndarray:
+        """Posições dos nós com filhos (atividades resumo)."""
+        return np.flatnonzero(self.fim > np.arange(len(self.ordem)) + 1)
+
+    def visiveis(self, recolhidos=()) -> np.ndarray:
+        """
+        Posições visíveis com os nós de `recolhidos` (posições) fechados: os
+        descendentes de cada nó recolhido saem da lista. Usa um vetor de
+        diferenças sobre os intervalos das subárvores, sem remontar a árvore.
+        """
+        n = len(self.ordem)
+        recolhidos = np.asarray(sorted(recolhidos), dtype=np.int64)
+        if not len(recolhidos):
+            return np.arange(n)
+        ocultos = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(ocultos, recolhidos + 1, 1)
+        np.subtract.at(ocultos, self.fim[recolhidos], 1)
+        return np.flatnonzero(np.cumsum(ocultos[:n]) == 0)
+
+    def totalizar(self, tarefas, inicios=None, terminos=None) -> Totais:
+        """
+        Totais por nó em pré-ordem. `tarefas` é a lista usada na montagem da
+        árvore, já com es/ef do CPM; `inicios`/`terminos` (datetime64, na
+        ordem da lista), quando informados, também são totalizados.
+
+        - es/ef e início/término: menor início e maior término da subárvore;
+        - duracao: ef - es (dias de trabalho entre o início e o término);
+        - percentual: média do percentual das atividades ponderada pela
+          duração (percentual do status, ver PERCENTUAL_STATUS);
+        - custo: soma dos custos previstos ("custo") da subárvore.
+        """
+        ordem = self.ordem
+        tarefas_ordem = [tarefas[i] for i in ordem]
+        es = np.array([int(t.get("es") or 0) for t in tarefas_ordem], dtype=np.int64)
+        ef = np.array([int(t.get("ef") or 0) for t in tarefas_ordem], dtype=np.int64)
+        trabalho = np.array([max(int(t.get("duracao") or 0), 0) for t in tarefas_ordem], dtype=float)
+        feito = trabalho * np.array(
+            [PERCENTUAL_STATUS.get(t.get("status") or "nao-iniciado", 0.0) for t in tarefas_ordem]
+        )
+        custo = np.array([float(t.get("custo") or 0) for t in tarefas_ordem])
+        dias_inicio = dias_termino = None
+        if inicios is not None:
+            dias_inicio = np.asarray(inicios, dtype="datetime64[D]")[ordem].astype(np.int64)
+        if terminos is not None:
+            dias_termino = np.asarray(terminos, dtype="datetime64[D]")[ordem].astype(np.int64)
+
+        # Pós-ordem por níveis: do mais profundo para a raiz, cada nível é
+        # acumulado no pai (os filhos de um nível já contêm os netos).
+        for nivel in range(int(self.profundidade.max(initial=0)), 0, -1):
+            nos = np.flatnonzero(self.profundidade == nivel)
+            pais = self.pai[nos]
+            np.minimum.at(es, pais, es[nos])
+            np.maximum.at(ef, pais, ef[nos])
+            np.add.at(trabalho, pais, trabalho[nos])
+            np.add.at(feito, pais, feito[nos])
+            np.add.at(custo, pais, custo[nos])
+            if dias_inicio is not None:
+                np.minimum.at(dias_inicio, pais, dias_inicio[nos])
+            if dias_termino is not None:
+                np.maximum.at(dias_termino, pais, dias_termino[nos])
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            percentual = np.where(trabalho > 0, feito / trabalho, 0.0)
+        return Totais(
+            es=es,
+            ef=ef,
+            duracao=ef - es,
+            percentual=percentual,
+            custo=custo,
+            inicio=None if dias_inicio is None else dias_inicio.astype("datetime64[D]"),
+            termino=None if dias_termino is None else dias_termino.astype("datetime64[D]"),
+        )
@@ -0,0 +1,173 @@
+"""
+Nivelamento de recursos do cronograma (programação com recursos limitados).
+
+O CPM (cronograma.py) supõe capacidade ilimitada: duas atividades do mesmo
+responsável podem correr em paralelo sem limite. O nivelamento programa as
+atividades uma a uma (esquema serial) respeitando as ligações da rede e a
+capacidade diária de cada responsável (quantas atividades ele toca ao mesmo
+tempo; 1 por padrão):
+- entre as atividades cujas predecessoras já foram programadas, a próxima é
+  a de menor folga do CPM e, no empate, a de menor ES;
+- ela começa no primeiro dia, a partir do início permitido pelas ligações,
+  em que o responsável tem capacidade livre durante toda a duração.
+
+A ocupação de cada responsável é uma função em degraus guardada como
+intervalos (pontos de mudança e nível em cada trecho), então achar o
+primeiro encaixe e ocupar um intervalo custam O(trechos) e não O(dias).
+Atividades sem responsável, com duração zero ou de responsável com
+capacidade 0 (ilimitada) não disputam recursos.
+
+Os dias são de trabalho, contados do início do projeto, como no CPM.
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+import heapq
+from bisect import bisect_right
+from typing import NamedTuple
+
+import numpy as np
+
+from cronograma import duracao_atividade, inicio_mais_cedo, rede_precedencias
+
+
+class ResultadoNivelamento(NamedTuple):
+    """
+    Resultado de nivelar_recursos. As atividades são cópias na ordem
+    original, com es/ef nivelados e as datas do CPM em esCpm/efCpm.
+    """
+
+    tarefas: list
+    projeto_fim: int
+    projeto_fim_cpm: int
+    atrasadas: int
+
+
+class _Ocupacao:
+    """
+    Atividades em andamento de um responsável por dia, em degraus:
+    nivel[k] vale em [tempos[k], tempos[k + 1]) e o último trecho vai até o
+    infinito (sempre 0, porque toda ocupação termina).
+    """
+
+    def __init__(self):
+        self.tempos = [0]
+        self.niveis = [0]
+
+    def primeiro_encaixe(self, inicio, duracao, capacidade):
+        """Menor início >= inicio com nível < capacidade em [início, início + duração)."""
+        tempos, niveis = self.tempos, self.niveis
+        k = bisect_right(tempos, inicio) - 1
+        while True:
+            fim = inicio + duracao
+            j = k
+            while j < len(tempos) and tempos[j] < fim:
+                if niveis[j] >= capacidade:
+                    break
+                j += 1
+            else:
+                return inicio
+            # Trecho lotado: tenta de novo logo depois dele.
+            k = j + 1
+            inicio = tempos[k]
+
+    def _ponto(self, tempo):
+        k = bisect_right(self.tempos, tempo) - 1
+        if self.tempos[k] != tempo:
+            k += 1
+            self.tempos.insert(k, tempo)
+            self.niveis.insert(k, self.niveis[k - 1])
+        return k
+
+    def ocupar(self, inicio, fim):
+        a = self._ponto(inicio)
+        b = self._ponto(fim)
+        for k in range(a, b):
+            self.niveis[k] += 1
+
+
+def _responsavel(tarefa) -> str:
+    return str(tarefa.get("responsavel") or "").strip()
+
+
+def nivelar_recursos(tarefas, capacidades=None, capacidade_padrao=1) -> ResultadoNivelamento:
+    """
+    Nivela atividades já calculadas pelo CPM (es/ef/slack, como devolvidas
+    por calcular_cronograma). capacidades: {responsável: atividades
+    simultâneas por dia}; quem não está no dicionário usa capacidade_padrao.
+    """
+    tarefas = list(tarefas or [])
+    capacidades = capacidades or {}
+    preds, succs, ordem, _ = rede_precedencias(tarefas)
+    n = len(tarefas)
+    posicao = [0] * n
+    for p, i in enumerate(ordem):
+        posicao[i] = p
+    dur = [duracao_atividade(t) for t in tarefas]
+
+    # Ligações válidas (as que não fecham ciclos) que faltam programar.
+    pendentes = [0] * n
+    for i in range(n):
+        pendentes[i] = sum(1 for j, _, _ in preds[i] if posicao[j] < posicao[i])
+
+    def prioridade(i):
+        t = tarefas[i]
+        return (t.get("slack", 0), t.get("es", 0), posicao[i], i)
+
+    fila = [prioridade(i) for i in range(n) if not pendentes[i]]
+    heapq.heapify(fila)
+    es = [0] * n
+    ef = [0] * n
+    ocupacoes = {}
+    while fila:
+        i = heapq.heappop(fila)[-1]
+        inicio = inicio_mais_cedo(i, preds, posicao, dur, es, ef)
+        nome = _responsavel(tarefas[i])
+        capacidade = capacidades.get(nome, capacidade_padrao) if nome else 0
+        if capacidade > 0 and dur[i] > 0:
+            ocupacao = ocupacoes.get(nome)
+            if ocupacao is None:
+                ocupacao = ocupacoes[nome] = _Ocupacao()
+            inicio = ocupacao.primeiro_encaixe(inicio, dur[i], capacidade)
+            ocupacao.ocupar(inicio, inicio + dur[i])
+        es[i] = inicio
+        ef[i] = inicio + dur[i]
+        for j, _, _ in succs[i]:
+            if posicao[j] > posicao[i]:
+                pendentes[j] -= 1
+                if not pendentes[j]:
+                    heapq.heappush(fila, prioridade(j))
+
+    niveladas = []
+    atrasadas = 0
+    for i, t in enumerate(tarefas):
+        copia = dict(t)
+        copia["esCpm"], copia["efCpm"] = t.get("es", 0), t.get("ef", 0)
+        copia["es"], copia["ef"] = es[i], ef[i]
+        atrasadas += es[i] > copia["esCpm"]
+        niveladas.append(copia)
+    return ResultadoNivelamento(
+        tarefas=niveladas,
+        projeto_fim=max(ef, default=0),
+        projeto_fim_cpm=max((t.get("ef", 0) for t in tarefas), default=0),
+        atrasadas=atrasadas,
+    )
+
+
+def histograma_recursos(tarefas, dias=None):
+    """
+    Atividades em andamento por responsável em cada dia 0..dias-1 (ES <= d
+    < EF): (nomes, matriz responsáveis x dias). Sai de um vetor de
+    diferenças por responsável (+1 em ES, -1 em EF) com soma acumulada.
+    """
+    nomes_tarefas = np.array([_responsavel(t) for t in tarefas], dtype=object)
+    es = np.fromiter((t.get("es", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    ef = np.fromiter((t.get("ef", 0) for t in tarefas), dtype=np.int64, count=len(tarefas))
+    if dias is None:
+        dias = int(ef.max(initial=0))
+    validas = (nomes_tarefas != "") & (ef > es)
+    nomes, recurso = np.unique(nomes_tarefas[validas].astype(str), return_inverse=True)
+    diferencas = np.zeros((len(nomes), dias + 1), dtype=np.int64)
+    np.add.at(diferencas, (recurso, np.clip(es[validas], 0, dias)), 1)
+    np.add.at(diferencas, (recurso, np.clip(ef[validas], 0, dias)), -1)
+    return nomes.tolist(), np.cumsum(diferencas, axis=1)[:, :dias]
@@ -0,0 +1,354 @@
+"""
+Análise de risco do cronograma por simulação de Monte Carlo (PERT).
+
+Cada atividade da EAP pode ter, além da duração (a mais provável), uma
+duração otimista ("duracaoOtimista") e uma pessimista ("duracaoPessimista").
+As durações são sorteadas da distribuição beta-PERT desses três pontos;
+atividades sem os três pontos mantêm a duração fixa.
+
+As iterações são calculadas em lotes: cada lote é uma matriz atividades x
+iterações, e as passadas de ida e de volta do CPM andam por níveis da rede
+(atividades cujas predecessoras já foram calculadas), com todas as ligações
+do nível e todas as iterações do lote numa única operação do NumPy. As
+ligações seguem a mesma semântica de cronograma.py (FS/SS/FF/SF com
+defasagem; ligações que fecham ciclos são ignoradas). Redes grandes
+distribuem os lotes por um pool de processos.
+
+Este módulo não depende do Streamlit nem do banco.
+"""
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from cronograma import duracao_atividade, rede_precedencias
+
+# Elementos por matriz atividades x iterações de um lote (~16 MB em float64).
+ELEMENTOS_POR_LOTE = 2_000_000
+
+# A partir de quantas atividades x iterações vale abrir o pool de processos.
+LIMIAR_PROCESSOS = 20_000_000
+
+# Pontos da tabela de quantis de cada formato beta-PERT.
+PONTOS_QUANTIS = 4097
+
+# Folga (em dias) abaixo da qual uma atividade conta como crítica na iteração.
+TOLERANCIA_CRITICA = 1e-6
+
+# Tipo da ligação -> (usa o término da predecessora, usa o término da sucessora).
+_PONTAS = {"FS": (1, 0), "SS": (0, 0), "FF": (1, 1), "SF": (0, 1)}
+
+
+class ResultadoSimulacao(NamedTuple):
+    """
+    Resultado de simular_cronograma. Durações em dias desde o início do
+    projeto; criticidade e sensibilidade na ordem das atividades.
+    """
+
+    iteracoes: int
+    duracao_deterministica: int
+    fins: np.ndarray
+    percentis: dict
+    codigos: list
+    criticidade: np.ndarray
+    sensibilidade: np.ndarray
+
+
+def _tres_pontos(tarefa):
+    """
+    (otimista, mais provável, pessimista) de uma atividade, em ordem.
+    Sem otimista/pessimista válidos, os três pontos são a duração.
+    """
+    provavel = duracao_atividade(tarefa)
+    try:
+        otimista = float(tarefa.get("duracaoOtimista"))
+    except (TypeError, ValueError):
+        otimista = provavel
+    try:
+        pessimista = float(tarefa.get("duracaoPessimista"))
+    except (TypeError, ValueError):
+        pessimista = provavel
+    if otimista <= 0:
+        otimista = provavel
+    if pessimista <= 0:
+        pessimista = provavel
+    return min(otimista, provavel), provavel, max(pessimista, provavel)
+
+
+def _niveis(ordem, ligacoes):
+    """
+    Agrupa as ligações (origem, destino, ponta da origem, soma a duração do
+    destino, defasagem) por nível do destino: o nível de uma atividade é
+    1 + o maior nível das origens das suas ligações (0 sem ligações).
+
+    Em cada nível, os destinos ficam em ordem decrescente de número de
+    ligações, e as ligações em "fatias": a fatia k tem a k-ésima ligação de
+    cada destino que tem pelo menos k + 1, então ela cobre um prefixo dos
+    destinos e a combinação das candidatas é uma operação elemento a
+    elemento por fatia.
+    """
+    entrada = {}
+    for origem, destino, ponta, com_duracao, lag in ligacoes:
+        entrada.setdefault(destino, []).append((origem, ponta, com_duracao, lag))
+    nivel = {}
+    for i in ordem:
+        nivel[i] = 1 + max((nivel[o] for o, _, _, _ in entrada.get(i, ())), default=-1)
+
+    por_nivel = {}
+    for destino, lista in entrada.items():
+        por_nivel.setdefault(nivel[destino], []).append((destino, lista))
+
+    niveis = []
+    for k in sorted(por_nivel):
+        grupo = sorted(por_nivel[k], key=lambda item: (-len(item[1]), item[0]))
+        destinos = np.array([destino for destino, _ in grupo], dtype=np.intp)
+        fatias = []
+        for pos in range(len(grupo[0][1])):
+            cobertos = [item for item in grupo if len(item[1]) > pos]
+            linhas = [2 * lista[pos][0] + lista[pos][1] for _, lista in cobertos]
+            com_duracao = [n for n, (_, lista) in enumerate(cobertos) if lista[pos][2]]
+            lags = [lista[pos][3] for _, lista in cobertos]
+            fatias.append(
+                {
+                    "linhas": np.array(linhas, dtype=np.intp),
+                    "lags": np.array(lags, dtype=np.float64)[:, None] if any(lags) else None,
+                    "com_duracao": np.array(com_duracao, dtype=np.intp),
+                    "alvos": destinos[com_duracao],
+                }
+            )
+        niveis.append({"destinos": destinos, "fatias": fatias})
+    return niveis
+
+
+def montar_modelo(tarefas):
+    """
+    Modelo da simulação (só arrays e listas, para ir aos processos do pool):
+    os três pontos de cada atividade, os formatos beta-PERT distintos e os
+    níveis das passadas de ida e volta.
+    """
+    preds, _, ordem, problemas = rede_precedencias(tarefas)
+    posicao = [0] * len(tarefas)
+    for k, i in enumerate(ordem):
+        posicao[i] = k
+
+    ida = []
+    volta = []
+    for i, ligacoes in enumerate(preds):
+        for j, tipo, lag in ligacoes:
+            if posicao[j] >= posicao[i]:
+                continue
+            fim_pred, fim_succ = _PONTAS[tipo]
+            # Ida: ES(i) >= [ES ou EF](j) + lag, menos dur(i) se a ligação
+            # chega ao término de i.
+            ida.append((j, i, fim_pred, fim_succ, lag))
+            # Volta: LF(j) <= [LS ou LF](i) - lag, mais dur(j) se a ligação
+            # sai do início de j.
+            volta.append((i, j, fim_succ, 1 - fim_pred, -lag))
+
+    pontos = np.array([_tres_pontos(t) for t in tarefas], dtype=np.float64).reshape(-1, 3)
+    a, m, b = pontos[:, 0], pontos[:, 1], pontos[:, 2]
+    formatos = {}
+    for i in np.flatnonzero(b > a):
+        alfa = 1 + 4 * (m[i] - a[i]) / (b[i] - a[i])
+        beta = 1 + 4 * (b[i] - m[i]) / (b[i] - a[i])
+        formatos.setdefault((alfa, beta), []).append(i)
+    return {
+        "otimista": a,
+        "provavel": m,
+        "pessimista": b,
+        "formatos": [
+            (_tabela_quantis(alfa, beta), np.array(indices, dtype=np.intp))
+            for (alfa, beta), indices in sorted(formatos.items())
+        ],
+        "ida": _niveis(ordem, ida),
+        "volta": _niveis(list(reversed(ordem)), volta),
+        "problemas": problemas,
+    }
+
+
+def _tabela_quantis(alfa, beta, pontos=PONTOS_QUANTIS):
+    """
+    Quantis da distribuição Beta(alfa, beta) em `pontos` probabilidades
+    igualmente espaçadas de 0 a 1, pela integração numérica da densidade.
+    No PERT alfa, beta >= 1, então a densidade é limitada e a integração
+    por trapézios numa grade fina basta.
+    """
+    x = np.linspace(0.0, 1.0, 8 * pontos)
+    densidade = x ** (alfa - 1) * (1 - x) ** (beta - 1)
+    acumulada = np.concatenate(([0.0], np.cumsum((densidade[1:] + densidade[:-1]) / 2)))
+    acumulada /= acumulada[-1]
+    return np.interp(np.linspace(0.0, 1.0, pontos), acumulada, x)
+
+
+def _sortear_duracoes(modelo, rng, iteracoes):
+    """
+    Matriz atividades x iterações com as durações sorteadas (beta-PERT),
+    por transformação inversa: uniformes interpoladas na tabela de quantis
+    de cada formato, bem mais rápido que sortear a beta diretamente.
+    """
+    a, b = modelo["otimista"], modelo["pessimista"]
+    duracoes = np.repeat(modelo["provavel"][:, None], iteracoes, axis=1)
+    for tabela, indices in modelo["formatos"]:
+        pos = rng.random((indices.size, iteracoes))
+        pos *= tabela.size - 1
+        k = pos.astype(np.intp)
+        pos -= k
+        sorteio = tabela[k]
+        sorteio += pos * (tabela[k + 1] - sorteio)
+        duracoes[indices] = a[indices, None] + (b - a)[indices, None] * sorteio
+    return duracoes
+
+
+def _passada(niveis, pontas, duracoes, base, combinar, sinal):
+    """
+    Uma passada do CPM, nível a nível. `pontas` tem duas linhas por
+    atividade: início (2i) e término (2i + 1) — ES/EF na ida, LS/LF na
+    volta. A candidata de cada ligação é a ponta da origem mais a
+    defasagem, corrigida pela duração do destino quando a ligação chega ao
+    término (ida, sinal -1) ou sai do início (volta, sinal +1); o valor do
+    destino combina as candidatas com `base` (máximo na ida, mínimo na
+    volta).
+    """
+    for nivel in niveis:
+        valor = None
+        for fatia in nivel["fatias"]:
+            cand = pontas[fatia["linhas"]]
+            if fatia["lags"] is not None:
+                cand += fatia["lags"]
+            if fatia["com_duracao"].size:
+                ajuste = duracoes[fatia["alvos"]]
+                if sinal < 0:
+                    cand[fatia["com_duracao"]] -= ajuste
+                else:
+                    cand[fatia["com_duracao"]] += ajuste
+            if valor is None:
+                valor = cand
+            else:
+                prefixo = valor[: len(cand)]
+                combinar(prefixo, cand, out=prefixo)
+        combinar(valor, base, out=valor)
+        destinos = nivel["destinos"]
+        if sinal < 0:
+            pontas[2 * destinos] = valor
+            pontas[2 * destinos + 1] = valor + duracoes[destinos]
+        else:
+            pontas[2 * destinos + 1] = valor
+            pontas[2 * destinos] = valor - duracoes[destinos]
+
+
+def _cpm_lote(modelo, duracoes):
+    """
+    ES, LF e término do projeto de cada iteração (colunas de `duracoes`).
+    """
+    n, iteracoes = duracoes.shape
+    pontas = np.empty((2 * n, iteracoes))
+    pontas[0::2] = 0.0
+    pontas[1::2] = duracoes
+    _passada(modelo["ida"], pontas, duracoes, 0.0, np.maximum, -1)
+    es = pontas[0::2].copy()
+    fins = pontas[1::2].max(axis=0)
+
+    pontas[1::2] = fins
+    pontas[0::2] = fins - duracoes
+    _passada(modelo["volta"], pontas, duracoes, fins, np.minimum, 1)
+    return es, pontas[1::2], fins
+
+
+def _simular_lote(modelo, semente, iteracoes):
+    """
+    Simula um lote de iterações. Devolve os términos do projeto, quantas
+    vezes cada atividade foi crítica e as somas para a correlação entre a
+    duração de cada atividade e o término.
+    """
+    rng = np.random.default_rng(semente)
+    duracoes = _sortear_duracoes(modelo, rng, iteracoes)
+    es, lf, fins = _cpm_lote(modelo, duracoes)
+    folga = lf - duracoes - es
+    criticas = (folga <= TOLERANCIA_CRITICA).sum(axis=1)
+
+    somas = {
+        "x": duracoes.sum(axis=1),
+        "xx": np.einsum("ij,ij->i", duracoes, duracoes),
+        "xy": duracoes @ fins,
+        "y": fins.sum(),
+        "yy": fins @ fins,
+    }
+    return fins, criticas, somas
+
+
+def _correlacao(somas, total):
+    """
+    Correlação de Pearson entre a duração de cada atividade e o término,
+    a partir das somas acumuladas dos lotes (0 quando uma das duas não varia).
+    """
+    cov = total * somas["xy"] - somas["x"] * somas["y"]
+    var_x = total * somas["xx"] - somas["x"] ** 2
+    var_y = total * somas["yy"] - somas["y"] ** 2
+    denominador = np.sqrt(np.clip(var_x, 0, None) * max(var_y, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(denominador > 1e-9 * total * total, cov / denominador, 0.0)
+    return np.clip(r, -1.0, 1.0)
+
+
+def simular_cronograma(tarefas, iteracoes=10_000, semente=None, processos=None):
+    """
+    Simula `iteracoes` cronogramas e devolve um ResultadoSimulacao com:
+    - fins: duração do projeto (dias) em cada iteração;
+    - percentis: {50, 80, 90} -> duração do projeto nesse percentil;
+    - criticidade: fração das iterações em que cada atividade foi crítica;
+    - sensibilidade: correlação entre a duração de cada atividade e o
+      término do projeto (base do gráfico de tornado).
+
+    processos: None decide pelo tamanho (pool só para redes grandes, com
+    mais de um núcleo), 0 ou 1 calcula no processo atual. O resultado não
+    depende da quantidade de processos para uma mesma semente.
+    """
+    tarefas = list(tarefas or [])
+    iteracoes = max(int(iteracoes), 1)
+    n = len(tarefas)
+    if not n:
+        vazio = np.zeros(0)
+        return ResultadoSimulacao(
+            iteracoes, 0, np.zeros(iteracoes), {50: 0.0, 80: 0.0, 90: 0.0}, [], vazio, vazio
+        )
+
+    modelo = montar_modelo(tarefas)
+    tamanho = max(1, min(iteracoes, ELEMENTOS_POR_LOTE // n))
+    lotes = [min(tamanho, iteracoes - k) for k in range(0, iteracoes, tamanho)]
+    sementes = np.random.SeedSequence(semente).spawn(len(lotes))
+
+    if processos is None:
+        nucleos = os.cpu_count() or 1
+        processos = min(nucleos, len(lotes)) if n * iteracoes >= LIMIAR_PROCESSOS else 1
+    if processos > 1:
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as pool:
+            resultados = list(
+                pool.map(_simular_lote, [modelo] * len(lotes), sementes, lotes)
+            )
+    else:
+        resultados = [_simular_lote(modelo, s, k) for s, k in zip(sementes, lotes)]
+
+    fins = np.concatenate([r[0] for r in resultados])
+    criticas = sum(r[1] for r in resultados)
+    somas = {
+        chave: sum(r[2][chave] for r in resultados) for chave in ("x", "xx", "xy", "y", "yy")
+    }
+    percentis = {p: float(np.percentile(fins, p)) for p in (50, 80, 90)}
+
+    _, _, fim_provavel = _cpm_lote(modelo, modelo["provavel"][:, None])
+    duracao_deterministica = int(math.ceil(float(fim_provavel[0]) - 1e-9))
+
+    return ResultadoSimulacao(
+        iteracoes=iteracoes,
+        duracao_deterministica=duracao_deterministica,
+        fins=fins,
+        percentis=percentis,
+        codigos=[t.get("codigo") for t in tarefas],
+        criticidade=criticas / iteracoes,
+        sensibilidade=_correlacao(somas, iteracoes),
+    )
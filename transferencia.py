@@ -0,0 +1,315 @@
+"""
+Exportação e importação em lote de projetos (backup, migração entre bancos).
+
+Os projetos trafegam em NDJSON: uma linha JSON por projeto, com os campos da
+listagem, o flag "encerrado", a versão e o documento completo ("data") em
+qualquer modo de armazenamento. Os dados passam por COPY ... TO/FROM STDIN
+em blocos, então a memória usada não depende da quantidade de projetos.
+Arquivos terminados em .gz são comprimidos/descomprimidos com gzip.
+
+Uso:
+    python transferencia.py exportar projetos.ndjson [--ids 1,2,3] [--sem-encerrados]
+    python transferencia.py importar projetos.ndjson [--conflito erro|pular|substituir] [--modo normalizado]
+
+O banco vem de --url, da variável de ambiente DATABASE_URL ou de
+[general] database_url em .streamlit/secrets.toml. A importação aplica as
+migrações pendentes antes, então também serve para popular um PostgreSQL
+local de testes.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+import psycopg2
+import psycopg2.errors
+
+from banco import (
+    TABELAS_SECOES,
+    aplicar_migracoes,
+    ajustar_modo_armazenamento,
+    sql_documento_completo,
+)
+from compactacao import decodificar_documento
+
+# COPY em CSV com aspas e delimitador que nunca aparecem no texto de um
+# JSONB (caracteres de controle saem escapados como \u0001, \u0002), para
+# que cada linha seja o JSON sem nenhum escape adicional do COPY.
+OPCOES_COPY = "(FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02')"
+
+# Linhas lidas por vez do cursor nomeado (projetos comprimidos).
+LOTE_CURSOR = 200
+
+
+def _sql_linha(alias="p"):
+    return f"""
+        jsonb_build_object(
+            'id', {alias}.id,
+            'nome', {alias}.nome,
+            'status', {alias}.status,
+            'dataInicio', {alias}.dataInicio,
+            'gerente', {alias}.gerente,
+            'patrocinador', {alias}.patrocinador,
+            'encerrado', COALESCE({alias}.encerrado, FALSE),
+            'version', {alias}.version,
+            'data', {sql_documento_completo(alias)}
+        )
+    """
+
+
+def _abrir(caminho, modo):
+    if caminho == "-":
+        return sys.stdout.buffer if "w" in modo else sys.stdin.buffer
+    if caminho.endswith(".gz"):
+        return gzip.open(caminho, modo)
+    return open(caminho, modo)
+
+
+def _filtro_exportacao(cur, ids=None, incluir_encerrados=True):
+    condicoes = []
+    if ids:
+        condicoes.append(cur.mogrify("p.id = ANY(%s)", (list(ids),)).decode())
+    if not incluir_encerrados:
+        condicoes.append("NOT COALESCE(p.encerrado, FALSE)")
+    return " AND ".join(condicoes) or "TRUE"
+
+
+def exportar_projetos(conn, arquivo, ids=None, incluir_encerrados=True):
+    """
+    Grava os projetos em `arquivo` (binário), uma linha NDJSON por projeto.
+    Projetos comprimidos ou arquivados são decodificados no Python, lidos
+    em lotes por um cursor nomeado. Retorna a quantidade exportada.
+    """
+    cur = conn.cursor()
+    filtro = _filtro_exportacao(cur, ids, incluir_encerrados)
+    cur.copy_expert(
+        f"""
+        COPY (
+            SELECT {_sql_linha('p')} FROM projects p
+            WHERE NOT p.comprimido AND NOT p.arquivado AND {filtro}
+            ORDER BY p.id
+        ) TO STDOUT WITH {OPCOES_COPY}
+        """,
+        arquivo,
+    )
+    total = cur.rowcount
+    cur.close()
+
+    cur = conn.cursor(name="exportar_decodificados")
+    cur.itersize = LOTE_CURSOR
+    cur.execute(
+        f"""
+        SELECT {_sql_linha('p')},
+               ARRAY(SELECT l.secao FROM project_lists l WHERE l.project_id = p.id ORDER BY l.secao),
+               ARRAY(SELECT l.dados FROM project_lists l WHERE l.project_id = p.id ORDER BY l.secao),
+               a.documento
+        FROM projects p
+        LEFT JOIN projects_archive a ON a.project_id = p.id AND p.arquivado
+        WHERE (p.comprimido OR p.arquivado) AND {filtro}
+        ORDER BY p.id;
+        """
+    )
+    for linha, secoes, blocos, arquivo_doc in cur:
+        if arquivo_doc is not None:
+            linha["data"] = decodificar_documento(arquivo_doc)
+        elif secoes:
+            if not isinstance(linha["data"], dict):
+                linha["data"] = {}
+            for secao, bloco in zip(secoes, blocos):
+                linha["data"][secao] = decodificar_documento(bloco)
+        arquivo.write(json.dumps(linha, ensure_ascii=False).encode("utf-8") + b"\n")
+        total += 1
+    cur.close()
+    conn.commit()
+    return total
+
+
+def importar_projetos(conn, arquivo, conflito="erro"):
+    """
+    Importa um arquivo NDJSON gerado por exportar_projetos, preservando ids,
+    versões e o flag "encerrado", numa única transação. Linhas sem "id"
+    recebem um id novo.
+
+    conflito (projeto com o mesmo id já existe no banco):
+    - "erro": aborta a importação inteira;
+    - "pular": mantém o projeto do banco;
+    - "substituir": troca o documento, numa versão acima das duas, e
+      registra um snapshot no journal do projeto (se ele já tiver journal).
+
+    Os projetos entram no modo documento e fora do arquivo; o app (ou
+    --modo) os converte para o modo configurado, e os encerrados voltam
+    ao arquivo depois da retenção. O resumo de portfólio (project_summary)
+    dos importados fica ausente ou defasado e é recalculado pelo app, na
+    inicialização ou na próxima atualização do painel de portfólio.
+    Retorna a quantidade de projetos gravados.
+    """
+    if conflito not in ("erro", "pular", "substituir"):
+        raise ValueError(f"Política de conflito desconhecida: {conflito!r}")
+
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TEMP TABLE importacao (linha JSONB) ON COMMIT DROP;")
+        cur.copy_expert(f"COPY importacao FROM STDIN WITH {OPCOES_COPY}", arquivo)
+        cur.execute("DELETE FROM importacao WHERE linha IS NULL;")
+
+        acao = ""
+        if conflito == "substituir":
+            for tabela in (*TABELAS_SECOES.values(), "project_lists"):
+                cur.execute(
+                    f"""
+                    DELETE FROM {tabela}
+                    WHERE project_id IN (SELECT (linha ->> 'id')::int FROM importacao);
+                    """
+                )
+            cur.execute(
+                """
+                DELETE FROM projects_archive
+                WHERE project_id IN (SELECT (linha ->> 'id')::int FROM importacao);
+                """
+            )
+            acao = """
+                ON CONFLICT (id) DO UPDATE SET
+                    data = EXCLUDED.data,
+                    nome = EXCLUDED.nome,
+                    status = EXCLUDED.status,
+                    dataInicio = EXCLUDED.dataInicio,
+                    gerente = EXCLUDED.gerente,
+                    patrocinador = EXCLUDED.patrocinador,
+                    encerrado = EXCLUDED.encerrado,
+                    normalizado = FALSE,
+                    comprimido = FALSE,
+                    arquivado = FALSE,
+                    inativo_desde = EXCLUDED.inativo_desde,
+                    version = GREATEST(projects.version, EXCLUDED.version) + 1,
+                    versoes_secoes = COALESCE(
+                        (SELECT jsonb_object_agg(k, GREATEST(projects.version, EXCLUDED.version) + 1)
+                         FROM jsonb_object_keys(
+                             CASE WHEN jsonb_typeof(EXCLUDED.data) = 'object'
+                                  THEN EXCLUDED.data ELSE '{}'::jsonb END
+                         ) AS k),
+                        '{}'::jsonb
+                    )
+            """
+        elif conflito == "pular":
+            acao = "ON CONFLICT (id) DO NOTHING"
+
+        # Projetos substituídos que já tinham journal: o novo conteúdo vira um
+        # snapshot, para que desfazer/restaurar partam dele.
+        cur.execute(
+            f"""
+            WITH gravados AS (
+            INSERT INTO projects (
+                id, data, nome, status, dataInicio, gerente, patrocinador, encerrado,
+                inativo_desde, version
+            )
+            SELECT COALESCE((linha ->> 'id')::int, nextval(pg_get_serial_sequence('projects', 'id'))),
+                   linha -> 'data',
+                   linha ->> 'nome',
+                   linha ->> 'status',
+                   linha ->> 'dataInicio',
+                   linha ->> 'gerente',
+                   linha ->> 'patrocinador',
+                   COALESCE((linha ->> 'encerrado')::boolean, FALSE),
+                   CASE WHEN (linha ->> 'encerrado')::boolean THEN now() END,
+                   COALESCE((linha ->> 'version')::bigint, 1)
+            FROM importacao
+            {acao}
+            RETURNING id, version, data
+            ), snapshots AS (
+                INSERT INTO project_events (project_id, versao, autor, tipo, patch)
+                SELECT g.id, g.version, 'importação', 'snapshot', COALESCE(g.data, '{{}}'::jsonb)
+                FROM gravados g
+                WHERE EXISTS (SELECT 1 FROM project_events e WHERE e.project_id = g.id)
+            )
+            SELECT count(*) FROM gravados;
+            """
+        )
+        gravados = cur.fetchone()[0]
+
+        cur.execute(
+            """
+            SELECT setval(pg_get_serial_sequence('projects', 'id'),
+                          GREATEST((SELECT max(id) FROM projects), 1));
+            """
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return gravados
+
+
+def _url_banco(url=None):
+    if url:
+        return url
+    if os.environ.get("DATABASE_URL"):
+        return os.environ["DATABASE_URL"]
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+    if os.path.exists(caminho):
+        import tomllib
+
+        with open(caminho, "rb") as f:
+            url = tomllib.load(f).get("general", {}).get("database_url")
+        if url:
+            return url
+    raise SystemExit(
+        "Informe o banco com --url, DATABASE_URL ou [general] database_url no .streamlit/secrets.toml."
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exportação e importação em lote de projetos.")
+    parser.add_argument("--url", help="URL de conexão do PostgreSQL")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_exp = sub.add_parser("exportar", help="grava os projetos em NDJSON")
+    p_exp.add_argument("arquivo", help="arquivo de saída (.ndjson, .ndjson.gz ou - para stdout)")
+    p_exp.add_argument("--ids", help="ids separados por vírgula (padrão: todos)")
+    p_exp.add_argument("--sem-encerrados", action="store_true", help="não exporta projetos encerrados")
+
+    p_imp = sub.add_parser("importar", help="lê projetos de um NDJSON")
+    p_imp.add_argument("arquivo", help="arquivo de entrada (.ndjson, .ndjson.gz ou - para stdin)")
+    p_imp.add_argument(
+        "--conflito",
+        choices=("erro", "pular", "substituir"),
+        default="erro",
+        help="o que fazer com ids que já existem no banco (padrão: erro)",
+    )
+    p_imp.add_argument(
+        "--modo",
+        choices=("documento", "normalizado", "comprimido"),
+        help="converte os projetos para este modo de armazenamento após importar",
+    )
+
+    args = parser.parse_args(argv)
+    conn = psycopg2.connect(_url_banco(args.url))
+    conn.set_client_encoding("UTF8")
+    try:
+        if args.comando == "exportar":
+            ids = [int(i) for i in args.ids.split(",") if i.strip()] if args.ids else None
+            with _abrir(args.arquivo, "wb") as arquivo:
+                total = exportar_projetos(conn, arquivo, ids, not args.sem_encerrados)
+            print(f"{total} projeto(s) exportado(s).", file=sys.stderr)
+        else:
+            aplicar_migracoes(conn)
+            with _abrir(args.arquivo, "rb") as arquivo:
+                try:
+                    total = importar_projetos(conn, arquivo, args.conflito)
+                except psycopg2.errors.UniqueViolation as e:
+                    raise SystemExit(
+                        f"Importação cancelada: {e.diag.message_detail} "
+                        "Use --conflito pular ou --conflito substituir."
+                    )
+            if args.modo:
+                ajustar_modo_armazenamento(conn, args.modo)
+            print(f"{total} projeto(s) importado(s).", file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()